@@ -0,0 +1,101 @@
+"""
+Growth assessments as JSON in trials.growth_grid vs packed grids in the
+assessments table (migration v4, grid_codec).
+
+Seeds a scratch database at schema v3 with --trials assessed trials, times
+the v4 migration that backfills them, then compares stored bytes, the
+/assessments upload payload against the old JSON-in-JSON /trials payload,
+and a history query (G cells per assessment) done by parsing JSON vs
+decoding packed grids with NumPy.
+
+    python benchmarks/bench_assessments.py [--trials 20000]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid as uuidlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import db  # noqa: E402
+from grid_codec import STATES, cell_counts, decode_grid, encode_grid  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def random_grid(rnd):
+    return [[rnd.choice(STATES) for _c in range(5)] for _r in range(5)]
+
+
+def seed(n, rnd):
+    grids = [random_grid(rnd) for _ in range(n)]
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO trials (uuid, species, seedlings, lat, lon, user_id, timestamp, growth_grid, assess_updated)"
+            " VALUES (?, 'Fd', 100, ?, ?, 'bench', ?, ?, ?)",
+            [(str(uuidlib.uuid4()), 49 + i * 1e-5, -123 - i * 1e-5, f"2025-0{1 + i % 9}-1{i % 10}T10:00:00+00:00",
+              json.dumps({"grid": g}), i % 2) for i, g in enumerate(grids)])
+    return grids
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trials", type=int, default=20000)
+    args = ap.parse_args()
+    rnd = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_db_path(os.path.join(tmp, "bench.db"))
+        migrate(target=3)
+        grids = seed(args.trials, rnd)
+
+        json_bytes = db.query_one("SELECT SUM(LENGTH(growth_grid)) FROM trials")[0]
+        old_rows = db.query_dicts("SELECT id, uuid, timestamp, growth_grid FROM trials WHERE assess_updated = 1")
+        old_payload = len(json.dumps(old_rows))
+
+        _version, elapsed = timed(migrate)
+        n = db.query_one("SELECT COUNT(*) FROM assessments")[0]
+        print(f"migration v4    {elapsed * 1e3:7.1f} ms to backfill {n} assessments")
+        new_rows = db.query_dicts("SELECT trial_uuid, assessed_on, grid, user_id, updated_at FROM assessments"
+                                  " WHERE synced = 0")
+        new_payload = len(json.dumps(new_rows))
+        print(f"grid storage    {json_bytes / n:7.1f} B JSON -> 8 B packed per assessment")
+        print(f"upload payload  {old_payload / 1024:7.1f} KiB -> {new_payload / 1024:.1f} KiB "
+              f"for {len(new_rows)} pending assessments")
+
+        # round trip: every backfilled grid decodes back to what was stored as JSON
+        codes = dict(db.query_all("SELECT trial_uuid, grid FROM assessments"))
+        uuids = [r[0] for r in db.query_all("SELECT uuid FROM trials ORDER BY id")]
+        assert all(decode_grid(codes[u]) == g for u, g in zip(uuids, grids))
+        assert encode_grid(grids[0]) == codes[uuids[0]]
+
+        payloads = [json.dumps({"grid": g}) for g in grids]
+
+        def g_cells_json():
+            return [sum(row.count("G") for row in json.loads(p)["grid"]) for p in payloads]
+
+        def g_cells_packed():
+            codes = [r[0] for r in db.query_all("SELECT grid FROM assessments ORDER BY id")]
+            return cell_counts(codes)[:, 2]
+
+        expected, t_json = timed(g_cells_json)
+        counted, t_packed = timed(g_cells_packed)
+        assert list(counted) == expected
+        print(f"G cells / grid  {t_json * 1e3:7.1f} ms parsing JSON -> {t_packed * 1e3:.1f} ms "
+              f"query + cell_counts ({n} grids)")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Building an offline basemap pack against the local fake tile server: the
+straightforward way (one request at a time, a new connection per tile, one
+INSERT + commit per tile into a flat tiles table) vs basemap_pack.PackBuilder
+(bounded worker pool with keep-alive sessions, batched transactions,
+deduplicated images). Then an interrupted PackBuilder build is resumed to
+check that only the missing tiles are fetched again.
+
+    python benchmarks/bench_basemap_pack.py [--zooms 10-14] [--latency 0.03] [--workers 4]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import requests  # noqa: E402
+
+import basemap_pack  # noqa: E402
+from basemap_pack import PackBuilder, PackCancelled, count_tiles, iter_tiles, tile_url, tms_row  # noqa: E402
+from fake_tile_server import start_server  # noqa: E402
+
+BBOX = (-123.3, 49.1, -122.9, 49.4)  # west, south, east, north
+
+
+def build_naive(path, url, bbox, zooms):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    for zoom, x, y in iter_tiles(bbox, zooms):
+        response = requests.get(tile_url(url, zoom, x, y), timeout=10)
+        if response.status_code != 200:
+            continue
+        conn.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)", (zoom, x, tms_row(zoom, y), response.content))
+        conn.commit()
+    conn.close()
+
+
+def timed(label, fn, path):
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    print(f"{label:14s} {elapsed:7.2f} s  file {os.path.getsize(path) / 2**20:6.1f} MiB")
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--zooms", default="10-14")
+    ap.add_argument("--latency", type=float, default=0.03)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+    lo, hi = map(int, args.zooms.split("-"))
+    zooms = range(lo, hi + 1)
+
+    server, url = start_server(latency=args.latency)
+    basemap_pack.print = lambda *a, **k: None
+    print(f"{count_tiles(BBOX, zooms)} tiles, zooms {lo}-{hi}, {args.latency * 1e3:.0f} ms latency")
+    with tempfile.TemporaryDirectory() as tmp:
+        naive = os.path.join(tmp, "naive.mbtiles")
+        timed("sequential", lambda: build_naive(naive, url, BBOX, zooms), naive)
+
+        pack = os.path.join(tmp, "pack.mbtiles")
+        stats = timed("PackBuilder", lambda: PackBuilder(pack, url, BBOX, zooms, workers=args.workers).build(), pack)
+        print(f"               {stats}")
+
+        # interrupt a build half way, then resume it
+        resumed = os.path.join(tmp, "resumed.mbtiles")
+        cancel = threading.Event()
+        half = count_tiles(BBOX, zooms) // 2
+
+        def progress(s):
+            if s["fetched"] + s["missing"] >= half:
+                cancel.set()
+
+        try:
+            PackBuilder(resumed, url, BBOX, zooms, workers=args.workers, batch_size=50,
+                        cancel=cancel, progress=progress).build()
+        except PackCancelled:
+            pass
+        requests_before = server.requests
+        stats = PackBuilder(resumed, url, BBOX, zooms, workers=args.workers).build()
+        print(f"resume         skipped {stats['skipped']}, fetched {stats['fetched'] + stats['missing']} "
+              f"({server.requests - requests_before} requests)")
+        with sqlite3.connect(pack) as a, sqlite3.connect(resumed) as b:
+            query = "SELECT COUNT(*) FROM tiles"
+            print(f"               tiles in full build {a.execute(query).fetchone()[0]}, "
+                  f"in resumed build {b.execute(query).fetchone()[0]}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
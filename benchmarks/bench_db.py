@@ -0,0 +1,97 @@
+"""
+Micro-benchmark: per-call sqlite3.connect() vs the shared connection in db.py.
+
+Runs the same statements the app issues on a marker tap / edit / sync against
+a scratch database, once with a fresh connection per call (the old pattern)
+and once through db.py, and prints mean latency per operation.
+
+    python benchmarks/bench_db.py [--rows 5000] [--iters 2000]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid as uuidlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import db  # noqa: E402
+from db_users import init_db  # noqa: E402
+
+
+def old_call(path, sql, params=(), write=False):
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    if write:
+        conn.commit()
+    conn.close()
+    return row
+
+
+def new_call(sql, params=(), write=False):
+    if write:
+        return db.execute(sql, params).fetchone()
+    return db.query_one(sql, params)
+
+
+def seed(rows):
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO app_state(key, value) VALUES('current_user_uuid', 'u1')")
+        conn.execute("INSERT INTO users (user_uuid, name, email, username) VALUES ('u1', 'Bench', '', 'bench')")
+        conn.executemany(
+            "INSERT INTO trials (uuid, species, seedlings, seedlot, spacing, lat, lon, user_id) "
+            "VALUES (?, 'Fd', 100, 'SL1', '3x3m', ?, ?, 'bench')",
+            [(str(uuidlib.uuid4()), 49.0 + i * 1e-5, -123.0 - i * 1e-5) for i in range(rows)],
+        )
+    return [r[0] for r in db.query_all("SELECT uuid FROM trials")]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--iters", type=int, default=2000)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "bench.db")
+    db.set_db_path(path)
+    init_db()
+    uuids = seed(args.rows)
+
+    ops = {
+        "get_current_user_uuid": ("SELECT value FROM app_state WHERE key='current_user_uuid' LIMIT 1", lambda i: (), False),
+        "load_current_user_profile": ("SELECT user_uuid, name, email, username, created_at FROM users WHERE user_uuid = ? LIMIT 1",
+                                      lambda i: ("u1",), False),
+        "get_trial_row": ("SELECT uuid, species, seedlings, seedlot, spacing, site_series, smr, snr, site_fact, site_prep "
+                          "FROM trials WHERE uuid=?", lambda i: (uuids[i % len(uuids)],), False),
+        "update_trial": ("UPDATE trials SET species=?, synced=0 WHERE uuid=?",
+                         lambda i: ("Pl", uuids[i % len(uuids)]), True),
+        "save_grid": ("UPDATE trials SET growth_grid=? WHERE uuid=?",
+                      lambda i: ('{"grid": []}', uuids[i % len(uuids)]), True),
+    }
+
+    print(f"{'operation':28s} {'old (us)':>10s} {'new (us)':>10s} {'speedup':>8s}")
+    for name, (sql, params, write) in ops.items():
+        t0 = time.perf_counter()
+        for i in range(args.iters):
+            old_call(path, sql, params(i), write)
+        old_us = (time.perf_counter() - t0) / args.iters * 1e6
+
+        t0 = time.perf_counter()
+        for i in range(args.iters):
+            new_call(sql, params(i), write)
+        new_us = (time.perf_counter() - t0) / args.iters * 1e6
+
+        print(f"{name:28s} {old_us:10.1f} {new_us:10.1f} {old_us / new_us:7.1f}x")
+
+    db.close_all()
+
+
+if __name__ == "__main__":
+    main()
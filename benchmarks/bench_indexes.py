@@ -0,0 +1,105 @@
+"""
+Query plans and timings for the hot trials queries, before and after the
+index migrations, on a synthetic database.
+
+Builds an N-row trials table at schema v1 (no secondary indexes), times each
+query and prints its EXPLAIN QUERY PLAN, then migrates to the latest version
+(which also moves every growth grid into the assessments table) and repeats.
+Queries on tables a schema does not have yet are reported as n/a.
+
+    python benchmarks/bench_indexes.py [--rows 100000] [--iters 200]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid as uuidlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import db  # noqa: E402
+from migrations import migrate, LATEST_VERSION  # noqa: E402
+
+USERS = [f"user{i}" for i in range(20)]
+
+QUERIES = {
+    "upload_trials count": (
+        "SELECT COUNT(*) FROM trials WHERE synced=0 AND user_id = ?",
+        lambda: (random.choice(USERS),)),
+    "upload_trials page": (
+        "SELECT * FROM trials WHERE synced=0 AND user_id = ? AND id > ? ORDER BY id LIMIT 200",
+        lambda: (random.choice(USERS), 0)),
+    "upload_assess page": (
+        "SELECT id, trial_uuid, assessed_on, grid, user_id, updated_at FROM assessments "
+        "WHERE synced = 0 AND id > ? ORDER BY id LIMIT 200",
+        lambda: (0,)),
+    "download watermark": (
+        "SELECT MAX(timestamp) FROM trials WHERE synced <> 0",
+        lambda: ()),
+    "map bbox": (
+        "SELECT uuid, lat, lon FROM trials WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+        lambda: (49.0, 49.05, -123.05, -123.0)),
+}
+
+
+def seed(rows):
+    rnd = random.Random(1)
+    data = []
+    for i in range(rows):
+        data.append((
+            str(uuidlib.uuid4()), "Fd", 100, "SL1", "3x3m",
+            48.0 + rnd.random() * 4, -126.0 + rnd.random() * 6,
+            f"2024-{1 + i * 12 // rows:02d}-01 00:00:{i % 60:02d}",
+            rnd.choice(USERS),
+            0 if rnd.random() < 0.02 else 1,    # ~2% waiting to upload
+            1 if rnd.random() < 0.01 else 0,    # ~1% new assessments
+            json.dumps({"grid": [[rnd.choice("PMG") for _ in range(5)] for _ in range(5)]}),
+        ))
+    with db.transaction() as conn:
+        conn.executemany("""
+            INSERT INTO trials (uuid, species, seedlings, seedlot, spacing, lat, lon,
+                                timestamp, user_id, synced, assess_updated, growth_grid)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, data)
+
+
+def run(label, iters):
+    conn = db.get_conn()
+    print(f"\n=== {label} ===")
+    for name, (sql, params) in QUERIES.items():
+        try:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params()).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"{name:22s} {'n/a':>9s}      {e}")
+            continue
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            conn.execute(sql, params()).fetchall()
+        ms = (time.perf_counter() - t0) / iters * 1e3
+        print(f"{name:22s} {ms:9.3f} ms   " + " | ".join(p[-1] for p in plan))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--iters", type=int, default=200)
+    args = ap.parse_args()
+
+    db.set_db_path(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    migrate(target=1)
+    seed(args.rows)
+    run(f"schema v1, {args.rows} rows", args.iters)
+
+    migrate()
+    run(f"schema v{LATEST_VERSION}, {args.rows} rows", args.iters)
+    db.close_all()
+
+
+if __name__ == "__main__":
+    main()
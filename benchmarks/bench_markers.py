@@ -0,0 +1,104 @@
+"""
+Per-marker memory and creation time: eager popup markers (the previous
+add_trial_marker, which built the whole popup for every trial) vs the lazy
+TrialMarker that borrows its popup from a pool on first open.
+
+Needs a Kivy install (no window is opened).
+
+    python benchmarks/bench_markers.py [--markers 2000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+from kivy.graphics import Color, Rectangle  # noqa: E402
+from kivy.uix.boxlayout import BoxLayout  # noqa: E402
+from kivy.uix.button import Button  # noqa: E402
+from kivy.uix.label import Label  # noqa: E402
+from kivy_garden.mapview import MapMarkerPopup  # noqa: E402
+
+from trial_markers import PopupPool, TrialMarker, trial_info_text  # noqa: E402
+
+
+def noop(_marker):
+    pass
+
+
+def eager_marker(row):
+    """The pre-pool marker: full popup built up front."""
+    marker = MapMarkerPopup(lat=row[6], lon=row[7])
+    marker.trial_id = row[1]
+    marker.uuid = row[0]
+
+    box = BoxLayout(orientation="vertical", spacing=4, padding=5, size_hint=(None, None))
+    box.size = (600, 600)
+    with box.canvas.before:
+        Color(0, 0, 0, 0.7)
+        box._bg_rect = Rectangle(pos=box.pos, size=box.size)
+
+    def _update_bg(instance, value):
+        box._bg_rect.pos = instance.pos
+        box._bg_rect.size = instance.size
+
+    box.bind(pos=_update_bg, size=_update_bg)
+    info_label = Label(text=trial_info_text(row), markup=True, halign="left", valign="middle")
+    info_label.bind(size=lambda _, __: info_label.texture_update())
+    box.add_widget(info_label)
+    for text, height in (("🗑️ Delete", 64), ("Edit Trial", 64), ("Add Assessment", 80)):
+        btn = Button(text=text, size_hint_y=None, height=height, background_normal="",
+                     background_color=(0.8, 0.2, 0.2, 0.9))
+        btn.bind(on_release=lambda instance: noop(marker))
+        box.add_widget(btn)
+    marker.add_widget(box)
+    return marker
+
+
+def measure(label, build, rows):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    keep = [build(row) for row in rows]
+    elapsed = time.perf_counter() - t0
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    n = len(keep)
+    print(f"{label:8s} {n} markers: {elapsed * 1e3:8.1f} ms total, "
+          f"{elapsed / n * 1e6:7.1f} us/marker, {used / n / 1024:6.1f} KiB/marker")
+    return keep
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--markers", type=int, default=2000)
+    args = ap.parse_args()
+
+    rows = [(f"uuid-{i}", i, "Fd", 100, "SL1", "3x3m", 49.0 + i * 1e-4, -123.0 - i * 1e-4)
+            for i in range(args.markers)]
+
+    measure("eager", eager_marker, rows)
+
+    pool = PopupPool({"delete": noop, "edit": noop, "assess": noop})
+    lazy = measure("lazy", lambda row: TrialMarker(row, pool), rows)
+
+    # First open builds a popup; later opens reuse it from the pool.
+    t0 = time.perf_counter()
+    lazy[0].is_open = True
+    lazy[0].is_open = False
+    first = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    lazy[1].is_open = True
+    lazy[1].is_open = False
+    reuse = time.perf_counter() - t0
+    print(f"popup open/close: first {first * 1e3:.2f} ms, pooled {reuse * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
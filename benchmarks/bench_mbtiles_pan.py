@@ -0,0 +1,144 @@
+"""
+Panning a MapView back and forth over an MBTiles package: the time until
+every visible tile is drawn after each pan step, and how many tiles had to
+be read from SQLite and decoded, with the decoded tile LRU and prefetch off
+vs on.
+
+Needs Kivy with a window (an offscreen/software GL context is fine). The
+package is generated: PNG tiles of random noise, zooms 10-15 around Vancouver.
+
+    python benchmarks/bench_mbtiles_pan.py [--steps 40] [--step-px 300] [--pause-ms 150]
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import numpy as np  # noqa: E402
+from kivy.base import EventLoop  # noqa: E402
+from kivy.core.window import Window  # noqa: E402
+from kivy.graphics.transformation import Matrix  # noqa: E402
+from kivy_garden.mapview import MapView  # noqa: E402
+
+import load_mbtiles  # noqa: E402
+from load_mbtiles import SafeMBTilesSource  # noqa: E402
+
+LAT, LON = 49.25, -123.1
+ZOOMS = range(10, 16)
+SPAN_DEG = 0.25
+
+
+def png(rng):
+    raw = rng.integers(0, 255, (256, 256 * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0  # filter byte
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 256, 256, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 1)) + chunk(b"IEND", b""))
+
+
+def make_mbtiles(path):
+    rng = np.random.default_rng(0)
+    blobs = [png(rng) for _ in range(32)]
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    count = 0
+    for z in ZOOMS:
+        n = 2 ** z
+
+        def col(lon):
+            return int((lon + 180) / 360 * n)
+
+        def row(lat):  # TMS
+            return n - 1 - int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+
+        rows = [(z, x, y, blobs[(x * 7 + y) % len(blobs)])
+                for x in range(col(LON - SPAN_DEG), col(LON + SPAN_DEG) + 1)
+                for y in range(row(LAT - SPAN_DEG), row(LAT + SPAN_DEG) + 1)]
+        conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+        count += len(rows)
+    conn.commit()
+    conn.close()
+    return count
+
+
+def settle(mapview, timeout=10.0):
+    """Run frames until no visible tile is still loading; return the time taken."""
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        EventLoop.idle()
+        if mapview._tiles and all(t.state != "loading" for t in mapview._tiles):
+            break
+        time.sleep(0.001)
+    return time.perf_counter() - t0
+
+
+def idle(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        EventLoop.idle()
+        time.sleep(0.001)
+
+
+def run(label, path, steps, step_px, pause, **source_kwargs):
+    source = SafeMBTilesSource(path, **source_kwargs)
+    reads = 0
+    read_image = source._read_image
+
+    def counted(*key):
+        nonlocal reads
+        reads += 1
+        return read_image(*key)
+
+    source._read_image = counted
+    mapview = MapView(lat=LAT, lon=LON, zoom=13, map_source=source)
+    Window.add_widget(mapview)
+    settle(mapview)
+    times = []
+    for i in range(steps):
+        d = step_px if (i // 5) % 2 == 0 else -step_px  # five steps out, five back
+        mapview._scatter.apply_transform(Matrix().translate(d, d / 2, 0))
+        times.append(settle(mapview))
+        idle(pause)  # between gestures
+    stats = source.stats()
+    times.sort()
+    print(f"{label:12s} settle median {statistics.median(times) * 1e3:6.1f} ms, p90 {times[int(len(times) * 0.9)] * 1e3:6.1f} ms; "
+          f"{reads} SQLite reads+decodes; hits {stats['hits']}, misses {stats['misses']}, prefetched {stats['prefetched']}")
+    Window.remove_widget(mapview)
+    source.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--steps", type=int, default=40)
+    ap.add_argument("--step-px", type=int, default=300)
+    ap.add_argument("--pause-ms", type=int, default=150, help="idle time between pan steps")
+    args = ap.parse_args()
+
+    EventLoop.ensure_window()
+    load_mbtiles.print = lambda *a, **k: None  # keep the output to the results
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "basemap.mbtiles")
+        print(f"{make_mbtiles(path)} tiles, window {Window.width}x{Window.height}")
+        run("no cache", path, args.steps, args.step_px, args.pause_ms / 1e3, cache_bytes=0, prefetch=False)
+        run("lru", path, args.steps, args.step_px, args.pause_ms / 1e3, prefetch=False)
+        run("lru+prefetch", path, args.steps, args.step_px, args.pause_ms / 1e3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Peak RSS and time of rescaling a large raster to 8-bit: the previous
+full-image path (tif.asarray(), astype(float32), nanmin, nanmax, one big
+expression, nan_to_num) vs normalize.py (one streaming stats pass over
+windows, then block rescale into a preallocated uint8 output).
+
+Each variant runs in its own subprocess so ru_maxrss is not shared. A last
+line times the display-range estimate GeoTiffOverlay makes on first open
+(compute_stats with the default STATS_MAX_PIXELS sample) against the full
+pass and shows both ranges; the raster's brightest pixels sit in its
+bottom-right quarter, so a sample that misses the lower rows shows up there.
+
+    python benchmarks/bench_normalize.py [--size 6000] [--bands 1] [--dtype float32] [--stretch]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import numpy as np  # noqa: E402
+import tifffile  # noqa: E402
+
+WINDOW = 1024
+
+
+def peak_rss_mib():
+    # VmHWM restarts at exec; ru_maxrss can carry over the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def run_full(path, stretch):
+    with tifffile.TiffFile(path) as tif:
+        img = tif.asarray()
+    data = img.astype(np.float32)
+    if stretch:
+        lo, hi = np.nanpercentile(data, (2, 98))
+    else:
+        lo, hi = np.nanmin(data), np.nanmax(data)
+    data = 255 * (data - lo) / (hi - lo)
+    return np.nan_to_num(np.clip(data, 0, 255)).astype(np.uint8)
+
+
+def run_chunked(path, stretch):
+    from normalize import compute_stats, rescale_to_ubyte
+    from tiff_tiles import TiledTiffReader
+
+    reader = TiledTiffReader(path)
+    level = reader.levels[0]
+    ranges = compute_stats(level, max_pixels=None).ranges((2, 98) if stretch else None)
+    out = np.empty((level.height, level.width, len(ranges)), dtype=np.uint8)
+    for y in range(0, level.height, WINDOW):
+        for x in range(0, level.width, WINDOW):
+            block = level.read(y, x, y + WINDOW, x + WINDOW)
+            rescale_to_ubyte(block, ranges, out=out[y:y + WINDOW, x:x + WINDOW])
+    reader.close()
+    return out
+
+
+def child(mode, path, stretch):
+    base = peak_rss_mib()
+    t0 = time.perf_counter()
+    out = (run_full if mode == "full" else run_chunked)(path, stretch)
+    elapsed = time.perf_counter() - t0
+    print(f"{mode:8s} {elapsed:7.2f} s  peak RSS +{peak_rss_mib() - base:8.1f} MiB  "
+          f"(output {out.nbytes / 2**20:.1f} MiB)")
+
+
+def make_raster(path, size, bands, dtype):
+    rng = np.random.default_rng(0)
+    shape = (size, size) if bands == 1 else (size, size, bands)
+    if np.dtype(dtype).kind == "f":
+        img = rng.normal(100, 30, shape).astype(dtype)
+        img[::97, ::89] = np.nan
+    else:
+        img = rng.integers(0, np.iinfo(dtype).max // 4, shape, dtype=dtype)
+    img[size // 2:, size // 2:] *= 2  # brighter away from the top strip
+    tifffile.imwrite(path, img, tile=(256, 256), photometric="rgb" if bands == 3 else "minisblack")
+    return img.nbytes
+
+
+def sampled_stats(path, stretch):
+    from normalize import compute_stats
+    from tiff_tiles import TiledTiffReader
+
+    reader = TiledTiffReader(path)
+    level = reader.levels[0]
+    percentiles = (2, 98) if stretch else None
+    t0 = time.perf_counter()
+    full = compute_stats(level, max_pixels=None).ranges(percentiles)
+    t1 = time.perf_counter()
+    sampled = compute_stats(level).ranges(percentiles)
+    t2 = time.perf_counter()
+    reader.close()
+    fmt = ", ".join
+    print(f"stats    full pass {t1 - t0:5.2f} s {fmt(f'({lo:.0f}, {hi:.0f})' for lo, hi in full)}; "
+          f"sampled {t2 - t1:5.2f} s {fmt(f'({lo:.0f}, {hi:.0f})' for lo, hi in sampled)}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size", type=int, default=6000)
+    ap.add_argument("--bands", type=int, default=1, choices=(1, 3))
+    ap.add_argument("--dtype", default="float32")
+    ap.add_argument("--stretch", action="store_true", help="2-98%% percentile stretch instead of min/max")
+    ap.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.stretch)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "raster.tif")
+        nbytes = make_raster(path, args.size, args.bands, args.dtype)
+        print(f"raster {args.size}x{args.size}x{args.bands} {args.dtype} ({nbytes / 2**20:.1f} MiB, tiled)")
+        for mode in ("full", "chunked"):
+            cmd = [sys.executable, __file__, "--child", mode, path]
+            if args.stretch:
+                cmd.append("--stretch")
+            subprocess.run(cmd, check=True)
+        sampled_stats(path, args.stretch)
+
+
+if __name__ == "__main__":
+    main()
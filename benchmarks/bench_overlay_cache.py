@@ -0,0 +1,98 @@
+"""
+Time to open a GeoTIFF overlay until every visible tile is on screen: cold
+(no overlay cache: stats pass, decode and normalize every tile) vs reopening
+the same file with a warm overlay_cache (ranges, bounds and tiles memory-mapped
+from disk).
+
+Needs Kivy with a window (an offscreen/software GL context is fine). No map
+tiles are downloaded.
+
+    python benchmarks/bench_overlay_cache.py [--size 8000] [--dtype float32] [--zoom 15]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import numpy as np  # noqa: E402
+import tifffile  # noqa: E402
+from kivy.base import EventLoop  # noqa: E402
+from kivy.core.window import Window  # noqa: E402
+from kivy_garden.mapview import MapSource, MapView  # noqa: E402
+
+import load_tif  # noqa: E402
+from georef import lonlat_to_webmercator  # noqa: E402
+from load_tif import GeoTiffOverlay  # noqa: E402
+from overlay_cache import OverlayCache  # noqa: E402
+from tiff_tiles import TiledTiffReader  # noqa: E402
+
+LAT, LON = 49.0, -123.0
+PIXEL_M = 0.5
+
+
+class BlankSource(MapSource):
+    def fill_tile(self, tile):
+        tile.state = "done"
+
+
+def make_tiff(path, size, dtype):
+    x0, y0 = lonlat_to_webmercator(LON, LAT)
+    rng = np.random.default_rng(0)
+    img = (rng.normal(100, 30, (size, size)) if np.dtype(dtype).kind == "f"
+           else rng.integers(0, 4000, (size, size))).astype(dtype)
+    tifffile.imwrite(path, img, tile=(256, 256), compression="zlib", extratags=[
+        (33922, "d", 6, (0, 0, 0, x0 - size * PIXEL_M / 2, y0 + size * PIXEL_M / 2, 0)),
+        (33550, "d", 3, (PIXEL_M, PIXEL_M, 0)),
+    ])
+    reader = TiledTiffReader(path)
+    reader.build_overviews()  # same pyramid for every run
+    reader.close()
+
+
+def open_overlay(path, zoom, cache):
+    mapview = MapView(lat=LAT, lon=LON, zoom=zoom, map_source=BlankSource())
+    Window.add_widget(mapview)
+    t0 = time.perf_counter()
+    overlay = GeoTiffOverlay(path, mapview, cache=cache)
+    mapview.add_widget(overlay)
+    deadline = time.time() + 300
+    while time.time() < deadline and not (overlay.wgs_bounds and overlay._rects and not overlay._pending):
+        EventLoop.idle()
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - t0
+    tiles = len(overlay._rects)
+    overlay.close()
+    Window.remove_widget(mapview)
+    return elapsed, tiles
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size", type=int, default=8000)
+    ap.add_argument("--dtype", default="float32")
+    ap.add_argument("--zoom", type=int, default=15)
+    args = ap.parse_args()
+
+    EventLoop.ensure_window()
+    load_tif.print = lambda *a, **k: None  # keep the output to the results
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ortho.tif")
+        make_tiff(path, args.size, args.dtype)
+        cache = OverlayCache(os.path.join(tmp, "overlay_cache"))
+        print(f"raster {args.size}x{args.size} {args.dtype} (zlib, tiled), zoom {args.zoom}")
+        open_overlay(path, args.zoom, None)  # warm up imports, GL and the OS file cache
+        for label, run_cache in (("no cache", None), ("cold", cache), ("warm", cache)):
+            elapsed, tiles = open_overlay(path, args.zoom, run_cache)
+            print(f"{label:9s} {elapsed * 1e3:9.1f} ms until {tiles} visible tiles drawn")
+        print(f"cache on disk: {cache.nbytes() / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Frame time while continuously panning a MapView with several GeoTIFF
+overlays: per-event placement (update_position bound straight to zoom, lat
+and lon; widget pos/size/opacity set and every tile rectangle rewritten on
+each call, as before) vs the coalesced transform-based placement.
+
+Needs Kivy with a window (an offscreen/software GL context is fine). No map
+tiles are downloaded.
+
+    python benchmarks/bench_overlay_pan.py [--overlays 4] [--frames 300]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+import numpy as np  # noqa: E402
+import tifffile  # noqa: E402
+from kivy.config import Config  # noqa: E402
+
+Config.set("graphics", "maxfps", "0")  # measure work, not the frame-rate cap
+
+from kivy.base import EventLoop  # noqa: E402
+from kivy.core.window import Window  # noqa: E402
+from kivy.graphics.transformation import Matrix  # noqa: E402
+from kivy_garden.mapview import MapSource, MapView  # noqa: E402
+
+from config import R  # noqa: E402
+import load_tif  # noqa: E402
+from load_tif import GeoTiffOverlay  # noqa: E402
+from tiff_tiles import TiledTiffReader  # noqa: E402
+
+LAT, LON, ZOOM = 49.0, -123.0, 17
+PIXEL_M = 0.25
+SIZE = 2048
+
+
+class BlankSource(MapSource):
+    def fill_tile(self, tile):
+        tile.state = "done"
+
+
+class CountedOverlay(GeoTiffOverlay):
+    placements = 0
+    placement_time = 0.0
+
+    def update_position(self, *args):
+        t0 = time.perf_counter()
+        CountedOverlay.placements += 1
+        super().update_position(*args)
+        CountedOverlay.placement_time += time.perf_counter() - t0
+
+
+class PerEventOverlay(CountedOverlay):
+    """The previous placement: one full update per property change."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mapview.unbind(zoom=self._reposition, lat=self._reposition,
+                            lon=self._reposition, size=self._reposition, pos=self._reposition)
+        self.mapview.bind(zoom=self.update_position, lat=self.update_position, lon=self.update_position)
+
+    def update_position(self, *args):
+        super().update_position()
+        if self.wgs_bounds is None:
+            return
+        x1, y1, x2, y2 = self._screen
+        self.pos = (x1, y1)
+        self.size = (x2 - x1, y2 - y1)
+        self.opacity = 0.6
+        for rect in self._rects.values():
+            rect.pos, rect.size = tuple(rect.pos), tuple(rect.size)
+        self.canvas.ask_update()
+
+
+def make_tiffs(tmp, count):
+    """count adjacent uint8 RGB orthophotos in Web Mercator around (LAT, LON)."""
+    x0 = math_x(LON)
+    y0 = math_y(LAT)
+    paths = []
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        path = os.path.join(tmp, f"ortho{i}.tif")
+        img = rng.integers(0, 255, (SIZE, SIZE, 3), dtype=np.uint8)
+        left = x0 + (i - count / 2) * SIZE * PIXEL_M
+        tifffile.imwrite(path, img, tile=(256, 256), photometric="rgb", extratags=[
+            (33922, "d", 6, (0, 0, 0, left, y0 + SIZE * PIXEL_M / 2, 0)),
+            (33550, "d", 3, (PIXEL_M, PIXEL_M, 0)),
+        ])
+        reader = TiledTiffReader(path)
+        reader.build_overviews()  # same pyramid for both runs
+        reader.close()
+        paths.append(path)
+    return paths
+
+
+def math_x(lon):
+    return R * np.radians(lon)
+
+
+def math_y(lat):
+    return R * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def frame():
+    t0 = time.perf_counter()
+    EventLoop.idle()
+    return time.perf_counter() - t0
+
+
+def run(label, cls, paths, frames):
+    mapview = MapView(lat=LAT, lon=LON, zoom=ZOOM, map_source=BlankSource())
+    Window.add_widget(mapview)
+    overlays = [cls(path, mapview) for path in paths]
+    for overlay in overlays:
+        mapview.add_widget(overlay)
+    # let the workers open the files and decode the visible tiles
+    deadline = time.time() + 30
+    while time.time() < deadline and not all(o.wgs_bounds and o._rects and not o._pending for o in overlays):
+        frame()
+        time.sleep(0.01)
+
+    CountedOverlay.placements = 0
+    CountedOverlay.placement_time = 0.0
+    times = []
+    for i in range(frames):
+        step = 6 if (i // 60) % 2 == 0 else -6
+        mapview._scatter.apply_transform(Matrix().translate(step, step / 3, 0))
+        times.append(frame())
+    times.sort()
+    print(f"{label:10s} {len(overlays)} overlays, {frames} frames: "
+          f"frame median {statistics.median(times) * 1e3:6.2f} ms, p95 {times[int(len(times) * 0.95)] * 1e3:6.2f} ms; "
+          f"{CountedOverlay.placements / frames:5.2f} placements/frame, "
+          f"{CountedOverlay.placement_time / frames * 1e3:6.3f} ms/frame placing")
+    for overlay in overlays:
+        overlay.close()
+    Window.remove_widget(mapview)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--overlays", type=int, default=4)
+    ap.add_argument("--frames", type=int, default=300)
+    args = ap.parse_args()
+
+    EventLoop.ensure_window()
+    load_tif.print = lambda *a, **k: None  # keep the output to the results
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_tiffs(tmp, args.overlays)
+        run("per-event", PerEventOverlay, paths, args.frames)
+        run("coalesced", CountedOverlay, paths, args.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Cold start of the app: `python -X importtime -c "import main"` (total import
+time, the heaviest modules, and which optional subsystems got loaded), then
+the time from process start to the first rendered frame of TreeApp, for a
+new device (login screen) and a device with a user (map screen).
+
+Each run is a fresh interpreter with HOME pointed at a temporary directory,
+so the database and user_data_dir start empty; the best of --runs is shown.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 12]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+GOMAPP = Path(__file__).resolve().parent.parent / "gomapp"
+DEFERRED = ("numpy", "tifffile", "plyer", "pyobjus", "load_tif", "load_mbtiles", "overlay_manager",
+            "overlay_cache", "basemap_pack", "file_picker")
+
+IMPORT_MAIN = f"""
+import sys
+import main
+print("LOADED", ",".join(m for m in {DEFERRED!r} if m in sys.modules))
+"""
+
+FIRST_FRAME = """
+import time
+t0 = time.perf_counter()
+import main
+from kivy.clock import Clock
+from kivy.base import stopTouchApp
+
+if {with_user}:
+    from db_users import init_db, create_user_profile
+    init_db()
+    create_user_profile("Bench User", "", "bench")
+
+class BenchApp(main.TreeApp):
+    def load_kv(self, filename=None):
+        pass  # defined in -c code, so no file to look for a .kv next to (the app has none)
+
+    def on_start(self):
+        super().on_start()
+        Clock.schedule_once(self.report, 0)  # runs after the first frame is drawn
+
+    def report(self, dt):
+        with open("{result}", "w") as f:  # not stdout: the tile threads print there too
+            f.write(f"{{time.perf_counter() - t0}} {{self.root.current}} {{len(self.root.screens)}}")
+        stopTouchApp()
+
+BenchApp().run()
+"""
+
+
+def run(code, home, importtime=False):
+    env = dict(os.environ, HOME=home, KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1", KIVY_HOME=os.path.join(home, ".kivy"))
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    proc = subprocess.run(cmd, cwd=GOMAPP, env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError((proc.stdout + proc.stderr)[-2000:])
+    return proc.stdout, proc.stderr
+
+
+def parse_importtime(stderr):
+    """(total_us, [(cumulative_us, module)] for the modules main imports itself)."""
+    total = 0
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # nested imports are indented by two
+        if depth == 0:
+            total += int(cumulative)
+        elif depth == 1:
+            rows.append((int(cumulative), name.strip()))
+    return total, rows
+
+
+def fresh_home(tmp, i):
+    home = os.path.join(tmp, f"home{i}")
+    os.makedirs(os.path.join(home, "Documents"))  # config.DB_PATH lives here
+    os.makedirs(os.path.join(home, ".config"))  # App.user_data_dir on Linux
+    return home
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=12)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        best = None
+        for i in range(args.runs):
+            out, err = run(IMPORT_MAIN, fresh_home(tmp, f"i{i}"), importtime=True)
+            total, rows = parse_importtime(err)
+            if best is None or total < best[0]:
+                best = (total, rows, out)
+        total, rows, out = best
+        loaded = out.split("LOADED", 1)[1].strip()
+        print(f"import main   {total / 1e3:7.1f} ms (best of {args.runs}), heaviest imports of main:")
+        for cumulative, name in sorted(rows, reverse=True)[:args.top]:
+            print(f"  {cumulative / 1e3:7.1f} ms  {name}")
+        print(f"  optional subsystems loaded at import: {loaded or 'none'}")
+
+        for label, with_user in (("login screen", False), ("map screen", True)):
+            times = []
+            for i in range(args.runs):
+                home = fresh_home(tmp, f"{label[0]}{i}")
+                result = os.path.join(home, "first_frame.txt")
+                run(FIRST_FRAME.format(with_user=with_user, result=result), home)
+                with open(result) as f:
+                    seconds, current, screens = f.read().split()
+                times.append(float(seconds))
+            print(f"first frame   {min(times) * 1e3:7.1f} ms  {label} ({current}, {screens} screen(s) built)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Repeat visits through tile_cache.CachedMapSource against the local fake tile
+server: network requests and time per visit for a cold cache, a repeat visit
+after an app restart (fresh tiles: no network), a visit after the tiles have
+expired (ETag revalidation: 304s, no bodies), and the size cap with a small
+byte budget.
+
+    python benchmarks/bench_tile_cache.py [--zooms 11-15] [--latency 0.03]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from basemap_pack import iter_tiles, tms_row  # noqa: E402
+from fake_tile_server import start_server  # noqa: E402
+from tile_cache import CachedMapSource, TileCache  # noqa: E402
+
+BBOX = (-123.2, 49.2, -123.0, 49.3)  # west, south, east, north
+WORKERS = 4  # as many as the mapview Downloader uses by default
+
+
+def visit(label, server, path, url, tiles, max_bytes=None):
+    cache = TileCache(path) if max_bytes is None else TileCache(path, max_bytes=max_bytes)
+    source = CachedMapSource(cache, url=url, cache_key="bench", subdomains="")
+    before, before_304 = server.requests, server.not_modified
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(WORKERS) as pool:
+        list(pool.map(lambda t: source.get_tile_data(t[0], t[1], tms_row(t[0], t[2])), tiles))
+    elapsed = time.perf_counter() - t0
+    stats = cache.stats()
+    print(f"{label:12s} {elapsed:6.2f} s  {server.requests - before:4d} requests "
+          f"({server.not_modified - before_304} x 304)  hits {stats['hits']}, revalidated {stats['revalidated']}, "
+          f"downloaded {stats['downloaded']}, evicted {stats['evicted']}; "
+          f"cache {stats['bytes'] / 2**20:.2f} MiB in one {os.path.getsize(path) / 2**20:.2f} MiB file")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--zooms", default="11-15")
+    ap.add_argument("--latency", type=float, default=0.03)
+    args = ap.parse_args()
+    lo, hi = map(int, args.zooms.split("-"))
+    tiles = list(iter_tiles(BBOX, range(lo, hi + 1)))
+
+    server, url = start_server(latency=args.latency, missing=0.0, distinct=64, max_age=3600)
+    print(f"{len(tiles)} tiles, zooms {lo}-{hi}, {args.latency * 1e3:.0f} ms latency")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tile_cache.sqlite")
+        visit("cold", server, path, url, tiles)
+        visit("restart", server, path, url, tiles)
+        with sqlite3.connect(path) as conn:
+            conn.execute("UPDATE tiles SET expires=0")  # an hour later: every tile is stale
+        visit("revalidate", server, path, url, tiles)
+        visit("restart", server, path, url, tiles)
+        small = os.path.join(tmp, "small.sqlite")
+        visit("capped", server, small, url, tiles, max_bytes=64 * 1024)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
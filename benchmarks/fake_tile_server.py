@@ -0,0 +1,120 @@
+"""
+Local stand-in XYZ tile server for exercising basemap_pack without the network.
+
+GET /{z}/{x}/{y}.png returns one of a few PNG tiles (so a pack has plenty of
+duplicates to dedupe, like open water or empty land), 404 for a fraction of
+the tiles, and optionally 503 for a fraction of requests to exercise retries.
+Tiles carry an ETag (answered with 304 on If-None-Match) and, with max_age,
+a Cache-Control max-age.
+Every response waits `latency` seconds, like a real round trip.
+
+    python benchmarks/fake_tile_server.py [--port 8765] [--latency 0.03]
+
+or from code:
+
+    server, url = start_server(latency=0.03)   # url = "http://127.0.0.1:PORT/{z}/{x}/{y}.png"
+    ...
+    server.shutdown()
+"""
+
+import argparse
+import hashlib
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TILE_RE = re.compile(r"^/(\d+)/(\d+)/(\d+)\.png$")
+
+
+def solid_png(rgb, size=256):
+    raw = (b"\x00" + bytes(rgb) * size) * size
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+class TileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, distinct=8, missing=0.05, errors=0.0, max_age=None):
+        super().__init__(address, TileHandler)
+        self.latency = latency
+        self.missing = missing
+        self.errors = errors
+        self.max_age = max_age
+        self.tiles = [solid_png((i * 37 % 256, i * 91 % 256, i * 53 % 256)) for i in range(distinct)]
+        self.etags = ['"{}"'.format(hashlib.sha1(t).hexdigest()[:16]) for t in self.tiles]
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_GET(self):
+        server = self.server
+        with server._lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        m = TILE_RE.match(self.path)
+        if m is None:
+            return self._send(404, b"")
+        z, x, y = map(int, m.groups())
+        rnd = random.Random(z * 1_000_003 + x * 7919 + y)  # the same answer for the same tile
+        if server.errors and random.random() < server.errors:
+            return self._send(503, b"")
+        if rnd.random() < server.missing:
+            return self._send(404, b"")
+        i = rnd.randrange(len(server.tiles))
+        if self.headers.get("If-None-Match") == server.etags[i]:
+            with server._lock:
+                server.not_modified += 1
+            return self._send(304, b"", etag=server.etags[i])
+        self._send(200, server.tiles[i], "image/png", etag=server.etags[i])
+
+    def _send(self, status, body, content_type="text/plain", etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+            if self.server.max_age is not None:
+                self.send_header("Cache-Control", f"max-age={self.server.max_age}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port=0, **kwargs):
+    """Serve in a background thread; return (server, url_template)."""
+    server = TileServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-tile-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/{{z}}/{{x}}/{{y}}.png"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.03)
+    ap.add_argument("--missing", type=float, default=0.05)
+    ap.add_argument("--errors", type=float, default=0.0)
+    args = ap.parse_args()
+    server = TileServer(("127.0.0.1", args.port), latency=args.latency, missing=args.missing, errors=args.errors)
+    print(f"Serving http://127.0.0.1:{args.port}/{{z}}/{{x}}/{{y}}.png")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Off-device replay of the GPS pipeline (gps_filter.GpsFilter plus the app's
+once-per-frame marker trigger).
+
+Without arguments a synthetic field day is generated: standing, walking the
+block and driving between blocks, sampled at 1 Hz with realistic noise, a few
+low-accuracy fixes, multipath jumps and re-delivered fixes. The platform's
+minTime/minDistance gating is simulated, and the old pipeline (every fix at
+1 s / 1 m straight to the marker) is compared with the filtered, adaptive one
+against the true track: fixes delivered, marker updates, position error and
+marker jitter while standing still.
+
+With a file recorded on a device (config.GPS_LOG_FILE) the recorded fixes are
+replayed through the filter as delivered, and the drops and path lengths are
+shown.
+
+    python benchmarks/gps_replay.py [gps_log.csv] [--seed 1]
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+from config import R  # noqa: E402
+from gps_filter import GpsFilter, distance_m, read_fixes  # noqa: E402
+
+START = (49.25, -123.10)
+DAY = (  # (seconds, speed m/s)
+    (900, 0.0), (1800, 1.1), (600, 0.0), (1200, 1.3), (600, 13.0), (1200, 0.0), (900, 1.0), (300, 0.0),
+)
+FPS = 60
+OLD_REQUEST = (1000, 1)  # what start_gps asked for before the filter
+
+
+def offset(lat, lon, north_m, east_m):
+    return (lat + math.degrees(north_m / R),
+            lon + math.degrees(east_m / (R * math.cos(math.radians(lat)))))
+
+
+def synthetic_day(seed):
+    """[(t, true_lat, true_lon, true_speed, lat, lon, accuracy, speed)] at 1 Hz."""
+    rnd = random.Random(seed)
+    lat, lon = START
+    heading = 0.0
+    samples = []
+    t = 0
+    for seconds, speed in DAY:
+        for _ in range(seconds):
+            if speed:
+                heading += rnd.gauss(0, 0.15)
+                lat, lon = offset(lat, lon, speed * math.cos(heading), speed * math.sin(heading))
+            accuracy = rnd.uniform(4, 12)
+            r = rnd.random()
+            if r < 0.03:
+                accuracy = rnd.uniform(40, 100)  # under canopy / cold start
+            noise = accuracy / 2
+            mlat, mlon = offset(lat, lon, rnd.gauss(0, noise), rnd.gauss(0, noise))
+            if 0.03 <= r < 0.04:
+                mlat, mlon = offset(lat, lon, rnd.uniform(-400, 400), rnd.uniform(-400, 400))  # multipath
+            reported = max(0.0, speed + rnd.gauss(0, 0.3)) if speed or rnd.random() < 0.5 else None
+            samples.append((t, lat, lon, speed, mlat, mlon, accuracy, reported))
+            t += 1
+    return samples
+
+
+def deliver(samples, request, seed):
+    """Yield the samples the platform would deliver for request(); repeats a few, as platforms do."""
+    rnd = random.Random(seed + 1)
+    last = None
+    for sample in samples:
+        t, _tlat, _tlon, _tspeed, lat, lon, _acc, _speed = sample
+        min_time, min_distance = request()
+        if last is not None and (
+                (t - last[0]) * 1000 < min_time or distance_m(last[4], last[5], lat, lon) < min_distance):
+            continue
+        last = sample
+        yield sample
+        if rnd.random() < 0.04:
+            yield (t + 0.005,) + sample[1:]  # the same fix again from a second provider
+
+
+def run(samples, seed, filtered):
+    gps_filter = GpsFilter()
+    request = (lambda: gps_filter.request) if filtered else (lambda: OLD_REQUEST)
+    delivered = 0
+    frames = set()
+    marker = None
+    errors = []
+    jitter = 0.0
+    filter_s = 0.0
+    for t, tlat, tlon, tspeed, lat, lon, accuracy, speed in deliver(samples, request, seed):
+        delivered += 1
+        if filtered:
+            t0 = time.perf_counter()
+            fix = gps_filter.update(lat, lon, accuracy, speed, t=t)
+            filter_s += time.perf_counter() - t0
+        else:
+            fix = (lat, lon)
+        if fix is None:
+            continue
+        frames.add(int(t * FPS))  # one marker update per frame, however many fixes arrived in it
+        if marker is not None and tspeed == 0:
+            jitter += distance_m(marker[0], marker[1], fix[0], fix[1])
+        marker = fix
+        errors.append(distance_m(tlat, tlon, fix[0], fix[1]))
+    errors.sort()
+    return {
+        "delivered": delivered,
+        "updates": len(frames) if filtered else delivered,  # the old code moved the marker for every fix
+        "rms": math.sqrt(sum(e * e for e in errors) / len(errors)),
+        "p95": errors[int(len(errors) * 0.95)],
+        "max": errors[-1],
+        "jitter": jitter,
+        "us_per_fix": filter_s / max(delivered, 1) * 1e6,
+        "stats": gps_filter.stats() if filtered else None,
+    }
+
+
+def replay_file(path):
+    gps_filter = GpsFilter()
+    raw = smooth = 0.0
+    prev_raw = prev_smooth = None
+    for fix in read_fixes(path):
+        if prev_raw is not None and fix["lat"] is not None:
+            raw += distance_m(prev_raw[0], prev_raw[1], fix["lat"], fix["lon"])
+        if fix["lat"] is not None:
+            prev_raw = (fix["lat"], fix["lon"])
+        out = gps_filter.update(fix["lat"], fix["lon"], fix["accuracy"], fix["speed"], t=fix["t"])
+        if out is not None:
+            if prev_smooth is not None:
+                smooth += distance_m(prev_smooth[0], prev_smooth[1], out[0], out[1])
+            prev_smooth = out
+    print(f"{path}: {gps_filter.stats()}")
+    print(f"path length raw {raw:.0f} m, smoothed {smooth:.0f} m")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("log", nargs="?", help="CSV recorded with config.GPS_LOG_FILE")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    if args.log:
+        replay_file(args.log)
+        return
+
+    samples = synthetic_day(args.seed)
+    print(f"synthetic day: {len(samples) / 3600:.1f} h of 1 Hz samples, "
+          f"{sum(s for s, v in DAY if v == 0) / 60:.0f} min standing")
+    for label, filtered in (("1 s / 1 m, raw", False), ("filtered, adaptive", True)):
+        r = run(samples, args.seed, filtered)
+        print(f"{label:20s} {r['delivered']:6d} fixes  {r['updates']:6d} marker updates  "
+              f"error rms {r['rms']:5.1f} m, p95 {r['p95']:5.1f} m, max {r['max']:6.1f} m  "
+              f"standing jitter {r['jitter'] / 1000:5.2f} km")
+        if r["stats"]:
+            s = r["stats"]
+            print(f"{'':20s} dropped {s['inaccurate']} inaccurate, {s['duplicates']} duplicates, "
+                  f"{s['jumps']} jumps ({s['resets']} resets); {r['us_per_fix']:.1f} us per fix")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Offline basemap packs: harvest the tiles covering a bbox and zoom range from
+an online XYZ tile source into an MBTiles file for SafeMBTilesSource.
+
+Tiles are fetched by a bounded pool of worker threads (one keep-alive
+requests.Session each, retries with backoff) and written by the building
+thread in batched transactions. The file uses the deduplicating MBTiles
+layout: "images" holds each distinct tile blob once, keyed by its SHA-1;
+"map" points every (zoom, column, row) at an image; the "tiles" view joins
+them for readers. Rows are TMS (y flipped), as MBTiles requires.
+
+Builds are resumable: every tile already in "map" (including tiles the
+server had no image for, kept with a NULL tile_id) is skipped, so re-running
+an interrupted build only fetches what is missing.
+
+    builder = PackBuilder(path, url, bbox=(west, south, east, north), zooms=range(10, 16))
+    stats = builder.build()
+"""
+
+import hashlib
+import math
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import (BASEMAP_BATCH_SIZE, BASEMAP_MAX_TILES, BASEMAP_RETRIES, BASEMAP_TIMEOUT,
+                    BASEMAP_USER_AGENT, BASEMAP_WORKERS)
+
+MAX_LAT = 85.05112878
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB)",
+    "CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT,"
+    " PRIMARY KEY (zoom_level, tile_column, tile_row)) WITHOUT ROWID",
+    "CREATE VIEW IF NOT EXISTS tiles AS SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,"
+    " map.tile_row AS tile_row, images.tile_data AS tile_data FROM map JOIN images ON images.tile_id = map.tile_id",
+)
+
+
+class PackCancelled(Exception):
+    pass
+
+
+class TooManyTiles(ValueError):
+    pass
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """XYZ tile (x, y) containing lon/lat at zoom."""
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_ranges(bbox, zooms):
+    """[(zoom, x0, x1, y0, y1)] (XYZ, inclusive) covering bbox = (west, south, east, north)."""
+    west, south, east, north = bbox
+    ranges = []
+    for zoom in zooms:
+        x0, y0 = lonlat_to_tile(west, north, zoom)
+        x1, y1 = lonlat_to_tile(east, south, zoom)
+        ranges.append((zoom, x0, x1, y0, y1))
+    return ranges
+
+
+def count_tiles(bbox, zooms):
+    return sum((x1 - x0 + 1) * (y1 - y0 + 1) for _z, x0, x1, y0, y1 in tile_ranges(bbox, zooms))
+
+
+def iter_tiles(bbox, zooms):
+    """Yield (zoom, x, y) XYZ tiles covering bbox, coarsest zoom first."""
+    for zoom, x0, x1, y0, y1 in tile_ranges(bbox, zooms):
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                yield zoom, x, y
+
+
+def tms_row(zoom, y):
+    return (1 << zoom) - 1 - y
+
+
+def tile_url(template, zoom, x, y, subdomains="abc"):
+    return template.format(z=zoom, x=x, y=y, s=random.choice(subdomains) if subdomains else "")
+
+
+def open_pack(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    return conn
+
+
+class PackBuilder:
+    def __init__(self, path, url, bbox, zooms, subdomains="abc", workers=BASEMAP_WORKERS,
+                 batch_size=BASEMAP_BATCH_SIZE, max_tiles=BASEMAP_MAX_TILES, name="Offline basemap",
+                 cancel=None, progress=None):
+        self.path = str(path)
+        self.url = url
+        self.bbox = bbox
+        self.zooms = list(zooms)
+        self.subdomains = subdomains
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_tiles = max_tiles
+        self.name = name
+        self.cancel = cancel or threading.Event()
+        self.progress = progress  # called with the stats dict after every batch
+        self.stats = {"total": 0, "skipped": 0, "fetched": 0, "duplicates": 0, "missing": 0, "failed": 0,
+                      "bytes": 0}
+        self._local = threading.local()
+
+    # --- worker threads ---
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+            session.headers["User-Agent"] = BASEMAP_USER_AGENT
+        return session
+
+    def _fetch(self, zoom, x, y):
+        """(zoom, x, y, data or None); data is None when the server has no tile (404/204)."""
+        url = tile_url(self.url, zoom, x, y, self.subdomains)
+        for attempt in range(BASEMAP_RETRIES + 1):
+            if self.cancel.is_set():
+                raise PackCancelled()
+            try:
+                response = self._session().get(url, timeout=BASEMAP_TIMEOUT)
+                if response.status_code in (204, 404):
+                    return zoom, x, y, None
+                response.raise_for_status()
+                return zoom, x, y, response.content
+            except Exception:
+                if attempt == BASEMAP_RETRIES:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    # --- building thread ---
+
+    def _existing(self, conn):
+        """Set of (zoom, column, tms_row) already in the pack."""
+        done = set()
+        for zoom in self.zooms:
+            done.update((zoom, c, r) for c, r in conn.execute(
+                "SELECT tile_column, tile_row FROM map WHERE zoom_level=?", (zoom,)))
+        return done
+
+    def _write_metadata(self, conn, fmt):
+        """Metadata for the pack, widened to cover earlier builds into the same file."""
+        west, south, east, north = self.bbox
+        minzoom, maxzoom = min(self.zooms), max(self.zooms)
+        old = dict(conn.execute("SELECT name, value FROM metadata"))
+        try:
+            w, s, e, n = map(float, old["bounds"].split(","))
+            west, south, east, north = min(west, w), min(south, s), max(east, e), max(north, n)
+            minzoom, maxzoom = min(minzoom, int(old["minzoom"])), max(maxzoom, int(old["maxzoom"]))
+        except (KeyError, ValueError):
+            pass
+        metadata = {
+            "name": self.name,
+            "type": "baselayer",
+            "version": "1",
+            "format": fmt,
+            "bounds": f"{west},{south},{east},{north}",
+            "center": f"{(west + east) / 2},{(south + north) / 2},{minzoom}",
+            "minzoom": str(minzoom),
+            "maxzoom": str(maxzoom),
+        }
+        conn.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+
+    def _flush(self, conn, batch):
+        images = {}
+        rows = []
+        for zoom, x, y, data in batch:
+            tile_id = None
+            if data is not None:
+                tile_id = hashlib.sha1(data).hexdigest()
+                images[tile_id] = data
+            rows.append((zoom, x, tms_row(zoom, y), tile_id))
+        conn.execute("BEGIN")
+        try:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)", images.items())
+            added = conn.total_changes - before
+            conn.executemany("INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id)"
+                             " VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        fetched = sum(1 for *_k, data in batch if data is not None)
+        self.stats["duplicates"] += fetched - added
+        batch.clear()
+        if self.progress:
+            self.progress(dict(self.stats))
+
+    def build(self):
+        """Fetch every missing tile; return the stats dict. Raises PackCancelled if cancelled."""
+        total = count_tiles(self.bbox, self.zooms)
+        if total > self.max_tiles:
+            raise TooManyTiles(f"{total} tiles is more than the limit of {self.max_tiles}")
+        self.stats["total"] = total
+        conn = open_pack(self.path)
+        try:
+            done = self._existing(conn)
+            fmt = None
+            batch = []
+            in_flight = set()
+            todo = (t for t in iter_tiles(self.bbox, self.zooms) if (t[0], t[1], tms_row(t[0], t[2])) not in done)
+            self.stats["skipped"] = len(done)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gomapp-pack") as pool:
+                try:
+                    while True:
+                        # keep a bounded number of requests outstanding
+                        for tile in todo:
+                            in_flight.add(pool.submit(self._fetch, *tile))
+                            if len(in_flight) >= self.workers * 2:
+                                break
+                        if not in_flight:
+                            break
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            try:
+                                zoom, x, y, data = future.result()
+                            except PackCancelled:
+                                continue
+                            except Exception as e:
+                                self.stats["failed"] += 1
+                                print(f"⚠️ Tile download failed: {e}")
+                                continue
+                            if data is None:
+                                self.stats["missing"] += 1
+                            else:
+                                self.stats["fetched"] += 1
+                                self.stats["bytes"] += len(data)
+                                fmt = fmt or ("jpg" if data[:2] == b"\xff\xd8" else "png")
+                            batch.append((zoom, x, y, data))
+                        if len(batch) >= self.batch_size:
+                            self._flush(conn, batch)
+                        if self.cancel.is_set():
+                            raise PackCancelled()
+                finally:
+                    if self.cancel.is_set():
+                        for future in in_flight:
+                            future.cancel()
+                    if batch:
+                        self._flush(conn, batch)
+            if fmt or not conn.execute("SELECT 1 FROM metadata WHERE name='format'").fetchone():
+                self._write_metadata(conn, fmt or "png")
+        finally:
+            # leave a single self-contained file: readers open it immutable, ignoring any -wal
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.close()
+        return self.stats
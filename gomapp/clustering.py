@@ -0,0 +1,87 @@
+"""
+Zoom-dependent clustering of trial points.
+
+ClusterIndex keeps, for every zoom level below max_zoom, a grid of
+cell_px x cell_px screen-pixel cells holding (count, sum_lat, sum_lon).
+Points are added and removed incrementally (one cell per level), and the
+clusters for a view are read straight from the cells the viewport covers,
+so a zoom change costs the number of visible clusters.
+"""
+
+import math
+
+CLUSTER_MAX_ZOOM = 14   # from this zoom up, individual markers are shown
+CLUSTER_CELL_PX = 80
+TILE_SIZE = 256
+MAX_LAT = 85.05112878
+
+
+def lonlat_to_pixel(lat, lon, zoom):
+    """Web Mercator world pixel (x right, y down) at an integer zoom."""
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    size = TILE_SIZE * (1 << zoom)
+    x = (lon + 180.0) / 360.0 * size
+    s = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * size
+    return x, y
+
+
+class ClusterIndex:
+    def __init__(self, max_zoom=CLUSTER_MAX_ZOOM, cell_px=CLUSTER_CELL_PX):
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self.levels = [{} for _ in range(max_zoom)]  # zoom -> {(cx, cy): [count, sum_lat, sum_lon]}
+        self._points = {}  # key -> (lat, lon)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cells(self, lat, lon):
+        for zoom in range(self.max_zoom):
+            x, y = lonlat_to_pixel(lat, lon, zoom)
+            yield zoom, (int(x // self.cell_px), int(y // self.cell_px))
+
+    def insert(self, key, lat, lon):
+        """Add key at (lat, lon), moving it if it is already indexed."""
+        self.remove(key)
+        if lat is None or lon is None:
+            return
+        self._points[key] = (lat, lon)
+        for zoom, cell in self._cells(lat, lon):
+            acc = self.levels[zoom].get(cell)
+            if acc is None:
+                self.levels[zoom][cell] = [1, lat, lon]
+            else:
+                acc[0] += 1
+                acc[1] += lat
+                acc[2] += lon
+
+    def remove(self, key):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        lat, lon = point
+        for zoom, cell in self._cells(lat, lon):
+            acc = self.levels[zoom][cell]
+            acc[0] -= 1
+            if acc[0] <= 0:
+                del self.levels[zoom][cell]
+            else:
+                acc[1] -= lat
+                acc[2] -= lon
+
+    def clusters(self, zoom, lat_min, lon_min, lat_max, lon_max):
+        """Yield (cell, count, lat, lon) for the clusters inside the bbox at zoom."""
+        zoom = max(0, min(int(zoom), self.max_zoom - 1))
+        level = self.levels[zoom]
+        x0, y1 = lonlat_to_pixel(lat_min, lon_min, zoom)
+        x1, y0 = lonlat_to_pixel(lat_max, lon_max, zoom)
+        cx0, cx1 = int(x0 // self.cell_px), int(x1 // self.cell_px)
+        cy0, cy1 = int(y0 // self.cell_px), int(y1 // self.cell_px)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(level):
+            cells = [c for c in level if cx0 <= c[0] <= cx1 and cy0 <= c[1] <= cy1]
+        else:
+            cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) in level]
+        for cell in cells:
+            count, sum_lat, sum_lon = level[cell]
+            yield cell, count, sum_lat / count, sum_lon / count
@@ -6,3 +6,35 @@ USER_RE  = re.compile(r"^[A-Za-z0-9_]{3,32}$")
 DB_PATH = Path.home() / "Documents" / "gomapp_data.db"
 API_URL = "http://178.128.233.227"
 R = 6378137.0  # Earth radius in meters
+UPLOAD_BATCH_SIZE = 200  # trials per POST during sync
+DOWNLOAD_BATCH_SIZE = 500  # rows per executemany when applying downloads
+DOWNLOAD_PAGE_SIZE = 5000  # rows requested per /trials or /assessments page
+SYNC_STOP_TIMEOUT = 12  # s to wait on exit for a cancelled sync (a request may take up to 10)
+OVERLAY_TILE_PX = 512  # GeoTIFF overlay texture tile edge, in raster pixels
+OVERLAY_TEXTURE_BYTES = 128 * 1024 * 1024  # GeoTIFF overlay texture budget, shared by all overlays
+OVERLAY_CACHE_DIR = "overlay_cache"  # under App.user_data_dir
+OVERLAY_CACHE_BYTES = 1024 * 1024 * 1024  # on-disk overlay tile cache budget
+OVERLAY_STRETCH = None  # None: min/max; (low, high) percentiles, e.g. (2, 98), for a percentile stretch
+MBTILES_CACHE_BYTES = 64 * 1024 * 1024  # decoded MBTiles tile LRU budget
+MBTILES_PREFETCH = True  # decode neighbouring / next-zoom MBTiles tiles ahead
+MBTILES_PREFETCH_QUEUE = 256  # pending prefetches kept; older ones are dropped
+BASEMAP_WORKERS = 4  # concurrent tile requests when building an offline basemap pack
+BASEMAP_BATCH_SIZE = 200  # tiles per transaction when writing a basemap pack
+BASEMAP_MAX_TILES = 20000  # refuse larger offline basemap areas
+BASEMAP_RETRIES = 2  # extra attempts per tile download
+BASEMAP_TIMEOUT = 10  # seconds per tile request
+BASEMAP_USER_AGENT = "GOMApp offline basemap"
+TILE_CACHE_FILE = "tile_cache.sqlite"  # under App.user_data_dir
+TILE_CACHE_BYTES = 256 * 1024 * 1024  # online basemap tile cache budget
+TILE_CACHE_TTL = 7 * 24 * 3600  # s a tile stays fresh when the server sends no expiry
+GPS_MAX_ACCURACY = 25  # m; fixes reporting worse accuracy are dropped
+GPS_DEFAULT_ACCURACY = 10  # m; assumed when a platform reports none
+GPS_MAX_SPEED = 60  # m/s; fixes implying a faster jump are dropped as outliers
+GPS_PROCESS_NOISE = 1.0  # m/s the smoothed position may drift between fixes when standing
+GPS_TIERS = (  # (up to speed m/s, minTime ms, minDistance m) requested from gps.start
+    (0.4, 10000, 5),  # standing: measuring, assessing
+    (2.5, 2000, 2),  # walking the block
+    (float("inf"), 1000, 10),  # driving between blocks
+)
+GPS_TIER_HOLD = 5  # fixes in a row before dropping to a slower tier
+GPS_LOG_FILE = None  # e.g. "gps_log.csv" under App.user_data_dir to record raw fixes for gps_replay.py
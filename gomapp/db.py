@@ -0,0 +1,147 @@
+"""
+Shared SQLite access for the app.
+
+Every thread gets one long-lived connection to DB_PATH (the Kivy main thread
+and the sync worker each hold their own), opened in WAL mode so readers never
+block on the writer. Writes are serialised through a process-wide lock so the
+two threads never race each other into SQLITE_BUSY.
+
+Usage:
+    from db import query_one, query_all, execute, transaction
+
+    row = query_one("SELECT value FROM app_state WHERE key=?", ("k",))
+    with transaction() as conn:
+        conn.execute("UPDATE trials SET synced=1 WHERE uuid=?", (uuid,))
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from config import DB_PATH
+
+# Tuned for a single-user app on flash storage: WAL + NORMAL is durable
+# across app crashes (only an OS crash can lose the last commits).
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",        # ~8 MB page cache
+    "PRAGMA mmap_size=67108864",      # 64 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+)
+CACHED_STATEMENTS = 256  # per-connection prepared statement cache
+
+_db_path = DB_PATH
+_generation = 0  # bumped by close_all() so other threads reopen
+_local = threading.local()
+_write_lock = threading.RLock()
+_all_conns = set()
+_all_conns_lock = threading.Lock()
+
+
+def set_db_path(path):
+    """Point the module at another database file (closes open connections)."""
+    global _db_path
+    _db_path = path
+    close_all()
+
+
+def _open(path):
+    conn = sqlite3.connect(
+        path,
+        isolation_level=None,           # we manage transactions explicitly
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,        # only so close_all() can close it
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_conn():
+    """Return this thread's connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.gen != _generation:
+        conn = _open(_db_path)
+        _local.conn = conn
+        _local.gen = _generation
+        _local.depth = 0
+        with _all_conns_lock:
+            _all_conns.add(conn)
+    return conn
+
+
+def close_thread_connection():
+    """Close the calling thread's connection (call at the end of worker threads)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    with _all_conns_lock:
+        _all_conns.discard(conn)
+    conn.close()
+
+
+def close_all():
+    """Close every connection opened through this module."""
+    global _generation
+    with _all_conns_lock:
+        _generation += 1
+        conns = list(_all_conns)
+        _all_conns.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """
+    BEGIN IMMEDIATE ... COMMIT on this thread's connection, rolled back on error.
+    Nested use joins the outer transaction.
+    """
+    conn = get_conn()
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        _local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            _local.depth = 0
+            conn.execute("ROLLBACK")
+            raise
+        _local.depth = 0
+        conn.execute("COMMIT")
+
+
+def execute(sql, params=()):
+    """Run a single write statement in its own transaction; returns the cursor."""
+    with transaction() as conn:
+        return conn.execute(sql, params)
+
+
+def query_one(sql, params=()):
+    return get_conn().execute(sql, params).fetchone()
+
+
+def query_all(sql, params=()):
+    return get_conn().execute(sql, params).fetchall()
+
+
+def query_dicts(sql, params=()):
+    cur = get_conn().execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
@@ -1,117 +1,255 @@
-import sqlite3
-from config import DB_PATH, API_URL
+from config import DB_PATH, API_URL, UPLOAD_BATCH_SIZE, DOWNLOAD_BATCH_SIZE, DOWNLOAD_PAGE_SIZE
+from db import transaction, query_one, query_all, query_dicts, execute
 from db_users import get_active_user
+from json_stream import iter_records
+from sync_state import DOWNLOAD, get_cursor, set_cursor
 import requests
 from datetime import datetime, timezone
 import json
+import time
 import uuid
 
-def upload_trials():
-    user = get_active_user()["username"]
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute("SELECT * FROM trials WHERE synced=0 AND user_id = ?", (user,))
-    trials = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    print(f"There are {len(trials)} records")
-    if not trials:
-        print("✅ No local records to upload.")
-        return
-
+def _post_chunk(path, rows):
+    """POST one chunk of rows; True only when the server confirmed it."""
     try:
-        r = requests.post(f"{API_URL}/trials", json=trials, timeout=10)
-        if r.status_code == 200:
-            dbcon = sqlite3.connect(DB_PATH)
-            cur = dbcon.cursor()
-            for t in trials:
-                cur.execute("UPDATE trials SET synced=1 WHERE uuid=?", (t["uuid"],))
-            dbcon.commit()
-            dbcon.close()
-            print(f"⬆️  Uploaded {len(trials)} records")
-        else:
-            print("⚠️ Upload failed:", r.status_code, r.text)
+        r = requests.post(f"{API_URL}/{path}", json=rows, timeout=10)
     except Exception as e:
         print("⚠️ Upload error:", e)
-        
-def upload_assess():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    cur.execute("SELECT timestamp, growth_grid FROM trials WHERE assess_updated = 1")
-    trials = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    print(f"There are {len(trials)} new assessments")
-    if not trials:
+        return False
+    if r.status_code != 200:
+        print("⚠️ Upload failed:", r.status_code, r.text)
+        return False
+    return True
+
+def upload_trials(batch_size=UPLOAD_BATCH_SIZE, progress=None, cancel=None):
+    """
+    Upload unsynced trials in chunks of batch_size. Each confirmed chunk is
+    marked synced in one transaction, so after a failure part-way through the
+    next pass only sends what is still synced=0.
+
+    progress(event, *args) is called with ("uploading", done, total); setting
+    the cancel Event stops the upload before the next chunk.
+    """
+    user = get_active_user()["username"]
+    pending = query_one("SELECT COUNT(*) FROM trials WHERE synced=0 AND user_id = ?", (user,))[0]
+    print(f"There are {pending} records")
+    if not pending:
         print("✅ No local records to upload.")
-        return
+        return 0
+
+    uploaded = 0
+    last_id = 0
+    while not (cancel and cancel.is_set()):
+        if progress:
+            progress("uploading", uploaded, pending)
+        trials = query_dicts("""
+            SELECT * FROM trials
+            WHERE synced=0 AND user_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (user, last_id, batch_size))
+        if not trials:
+            break
+        last_id = trials[-1]["id"]
+
+        # Grids travel as /assessments rows; don't resend the legacy column.
+        if not _post_chunk("trials", [{k: v for k, v in t.items() if k != "growth_grid"} for t in trials]):
+            break
+        # Rows edited while the chunk was in flight keep synced=0.
+        with transaction() as conn:
+            conn.executemany("UPDATE trials SET synced=1 WHERE uuid=? AND timestamp IS ?",
+                             [(t["uuid"], t["timestamp"]) for t in trials])
+        uploaded += len(trials)
+        print(f"⬆️  Uploaded {uploaded}/{pending} records")
+    return uploaded
+        
+def upload_assess(batch_size=UPLOAD_BATCH_SIZE, progress=None, cancel=None):
+    """
+    Upload unsynced assessments to /assessments in chunks of batch_size, as
+    compact rows (trial_uuid, assessed_on, packed grid, user_id, updated_at).
+    Each confirmed chunk is marked synced unless it was edited while in
+    flight. progress/cancel work as in upload_trials.
+    """
+    pending = query_one("SELECT COUNT(*) FROM assessments WHERE synced = 0")[0]
+    print(f"There are {pending} new assessments")
+    if not pending:
+        print("✅ No local assessments to upload.")
+        return 0
+
+    uploaded = 0
+    last_id = 0
+    while not (cancel and cancel.is_set()):
+        if progress:
+            progress("uploading", uploaded, pending)
+        rows = query_dicts("""
+            SELECT id, trial_uuid, assessed_on, grid, user_id, updated_at FROM assessments
+            WHERE synced = 0 AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, batch_size))
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
 
+        if not _post_chunk("assessments", [{k: v for k, v in r.items() if k != "id"} for r in rows]):
+            break
+        with transaction() as conn:
+            conn.executemany("UPDATE assessments SET synced=1 WHERE id=? AND updated_at IS ?",
+                             [(r["id"], r["updated_at"]) for r in rows])
+        uploaded += len(rows)
+        print(f"⬆️  Uploaded {uploaded}/{pending} assessments")
+    return uploaded
+        
+UPSERT_TRIAL_SQL = """
+    INSERT INTO trials (uuid, species, seedlings, seedlot, lat, lon,
+                        timestamp, synced)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT(uuid) DO UPDATE SET
+        species=excluded.species,
+        seedlings=excluded.seedlings,
+        seedlot=excluded.seedlot,
+        lat=excluded.lat,
+        lon=excluded.lon,
+        timestamp=excluded.timestamp,
+        synced=1
+"""
+
+# A server copy never overwrites an assessment that has not been uploaded yet.
+UPSERT_ASSESSMENT_SQL = """
+    INSERT INTO assessments (trial_uuid, assessed_on, grid, user_id, updated_at, synced)
+    VALUES (?, ?, ?, ?, ?, 1)
+    ON CONFLICT(trial_uuid, assessed_on) DO UPDATE SET
+        grid=excluded.grid,
+        user_id=excluded.user_id,
+        updated_at=excluded.updated_at
+    WHERE assessments.synced = 1
+"""
+
+def _batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _initial_download_cursor():
+    # One-off migration from the old MAX(timestamp) watermark.
+    last_sync = query_one("SELECT MAX(timestamp) FROM trials WHERE synced <> 0")[0]
+    return {"since": last_sync or "1970-01-01T00:00:00Z", "uuid": ""}
+
+def download_trials(batch_size=DOWNLOAD_BATCH_SIZE, page_size=DOWNLOAD_PAGE_SIZE, progress=None, cancel=None):
+    """
+    Page through /trials after the stored download cursor, ordered by
+    (timestamp, uuid). Each page is streamed (JSON array or NDJSON) and
+    upserted in executemany batches of batch_size; every batch commits
+    together with the cursor, so an interrupted sync resumes from the last
+    committed batch and memory stays flat however large the table is.
+
+    progress(event, *args) is called with ("downloading", done) before each
+    page and ("applied", n) after each batch; setting the cancel Event stops
+    the download after the current batch.
+    """
+    user = get_active_user()["username"]
+    cursor = get_cursor(DOWNLOAD, "trials", user) or _initial_download_cursor()
+    print(f"Downloading after {cursor['since']} {cursor['uuid']}")
+
+    t0 = time.perf_counter()
+    applied = 0
     try:
-        r = requests.post(f"{API_URL}/trials", json=trials, timeout=10)
-        if r.status_code == 200:
-            dbcon = sqlite3.connect(DB_PATH)
-            cur = dbcon.cursor()
-            for t in trials:
-                cur.execute("UPDATE trials SET synced=1 WHERE uuid=?", (t["uuid"],))
-            dbcon.commit()
-            dbcon.close()
-            print(f"⬆️  Uploaded {len(trials)} records")
-        else:
-            print("⚠️ Upload failed:", r.status_code, r.text)
+        while not (cancel and cancel.is_set()):
+            if progress:
+                progress("downloading", applied)
+            params = {"since": cursor["since"], "after_uuid": cursor["uuid"], "limit": page_size}
+            with requests.get(f"{API_URL}/trials", params=params,
+                              headers={"Accept": "application/x-ndjson, application/json"},
+                              stream=True, timeout=10) as r:
+                if r.status_code != 200:
+                    print("⚠️ Download failed:", r.status_code, r.text)
+                    break
+
+                page_rows = 0
+                for batch in _batched(iter_records(r), batch_size):
+                    cursor = {"since": batch[-1]["timestamp"], "uuid": batch[-1]["uuid"]}
+                    with transaction() as conn:
+                        conn.executemany(UPSERT_TRIAL_SQL, [
+                            (t["uuid"], t["species"], t["seedlings"], t["seedlot"],
+                             t["lat"], t["lon"], t["timestamp"])
+                            for t in batch
+                        ])
+                        set_cursor(conn, DOWNLOAD, "trials", user, cursor)
+                    page_rows += len(batch)
+                    applied += len(batch)
+                    if progress:
+                        progress("applied", applied)
+                    if cancel and cancel.is_set():
+                        break
+            if page_rows < page_size:
+                break
     except Exception as e:
-        print("⚠️ Upload error:", e)
-        
-def download_trials():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(timestamp) FROM trials WHERE synced <> 0")
-    last_sync = cur.fetchone()[0] or "1970-01-01T00:00:00Z"
-    print(last_sync)
-    conn.close()
+        print("⚠️ Download error:", e)
+
+    elapsed = max(time.perf_counter() - t0, 1e-6)
+    print(f"⬇️  Downloaded {applied} records ({applied / elapsed:.0f} rows/s)")
+    return applied
+
+def download_assessments(batch_size=DOWNLOAD_BATCH_SIZE, page_size=DOWNLOAD_PAGE_SIZE, progress=None, cancel=None):
+    """
+    Page through /assessments after the stored download cursor, ordered by
+    (updated_at, trial_uuid, assessed_on), and upsert them with
+    UPSERT_ASSESSMENT_SQL. Batches commit together with the cursor as in
+    download_trials; progress/cancel work the same way.
+    """
+    user = get_active_user()["username"]
+    cursor = get_cursor(DOWNLOAD, "assessments", user) or {"since": "", "uuid": "", "date": ""}
+    print(f"Downloading assessments after {cursor['since']} {cursor['uuid']} {cursor['date']}")
 
+    applied = 0
     try:
-        r = requests.get(f"{API_URL}/trials", params={"since": last_sync}, timeout=10) ##update API to use assessment table #params={"since": last_sync},
-        if r.status_code != 200:
-            print("⚠️ Download failed:", r.status_code, r.text)
-            return
-
-        remote_trials = r.json()
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-
-        for t in remote_trials:
-            cur.execute("""
-                INSERT INTO trials (uuid, species, seedlings, seedlot, lat, lon,
-                                    timestamp, synced, growth_grid)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
-                ON CONFLICT(uuid) DO UPDATE SET
-                    species=excluded.species,
-                    seedlings=excluded.seedlings,
-                    seedlot=excluded.seedlot,
-                    lat=excluded.lat,
-                    lon=excluded.lon,
-                    timestamp=excluded.timestamp,
-                    synced=1,
-                    growth_grid=excluded.growth_grid
-            """, (t["uuid"], t["species"], t["seedlings"], t["seedlot"],
-                  t["lat"], t["lon"], t["timestamp"], t["growth_grid"]))
-        conn.commit()
-        conn.close()
-        print(f"⬇️  Downloaded {len(remote_trials)} records")
+        while not (cancel and cancel.is_set()):
+            if progress:
+                progress("downloading", applied)
+            params = {"since": cursor["since"], "after_uuid": cursor["uuid"], "after_date": cursor["date"],
+                      "limit": page_size}
+            with requests.get(f"{API_URL}/assessments", params=params,
+                              headers={"Accept": "application/x-ndjson, application/json"},
+                              stream=True, timeout=10) as r:
+                if r.status_code != 200:
+                    print("⚠️ Download failed:", r.status_code, r.text)
+                    break
+
+                page_rows = 0
+                for batch in _batched(iter_records(r), batch_size):
+                    last = batch[-1]
+                    cursor = {"since": last["updated_at"], "uuid": last["trial_uuid"], "date": last["assessed_on"]}
+                    with transaction() as conn:
+                        conn.executemany(UPSERT_ASSESSMENT_SQL, [
+                            (a["trial_uuid"], a["assessed_on"], int(a["grid"]), a["user_id"], a["updated_at"])
+                            for a in batch
+                        ])
+                        set_cursor(conn, DOWNLOAD, "assessments", user, cursor)
+                    page_rows += len(batch)
+                    applied += len(batch)
+                    if progress:
+                        progress("applied", applied)
+                    if cancel and cancel.is_set():
+                        break
+            if page_rows < page_size:
+                break
     except Exception as e:
         print("⚠️ Download error:", e)
 
+    print(f"⬇️  Downloaded {applied} assessments")
+    return applied
+
 def utc_now_iso():
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 def update_trial(uuid, data): ## Question: should we record who updated the trial?
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
     ts = utc_now_iso()
-    cur.execute("""
+    execute("""
         UPDATE trials
         SET species=?,
             seedlings=?,
@@ -125,25 +263,93 @@ def update_trial(uuid, data): ## Question: should we record who updated the tria
             timestamp=?,
             synced=0
         WHERE uuid=?
-    """, (data["species"], data["seedlings"], data["seedlot"], data["spacing"],  ts, uuid, data["site_series"], data["smr"], data["snr"], data["site_factors"], data["site_prep"]))
-
-    conn.commit()
-    conn.close()
+    """, (data["species"], data["seedlings"], data["seedlot"], data["spacing"], data["site_series"], data["smr"], data["snr"], data["site_factors"], data["site_prep"], ts, uuid))
     return ts
     
 def get_trial_row(uuid):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
+    row = query_one("""
         SELECT uuid, species, seedlings, seedlot, spacing, site_series, smr, snr, site_fact, site_prep
         FROM trials
         WHERE uuid=?
     """, (uuid,))
-    row = cur.fetchone()
-    conn.close()
 
     if not row:
         return None
 
     keys = ["uuid","species","seedlings","seedlot","spacing", "site_series", "smr", "snr", "site_factors", "site_prep"]
     return dict(zip(keys, row))
+
+def insert_trial(data, user_id):
+    execute("""
+        INSERT INTO trials (uuid, species, seedlings, seedlot, spacing, lat, lon, user_id, site_series, smr, snr, site_fact, site_prep)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (data["uuid"], data["species"], data["seedlings"], data["seedlot"],
+          data["spacing"], data["lat"], data["lon"], user_id, data["site_series"], data["smr"], data["snr"], data["site_factors"], data["site_prep"]))
+
+def load_trial_rows():
+    return query_all("SELECT uuid, id, species, seedlings, seedlot, spacing, lat, lon FROM trials")
+
+def load_trial_changes(since_version=0):
+    """
+    Trials changed after since_version: returns (rows, deleted_uuids, version)
+    where rows are shaped like load_trial_rows() and version is the
+    high-water mark to pass next time.
+    """
+    version = query_one("SELECT value FROM change_seq WHERE id = 1")[0]
+    rows = query_all("""
+        SELECT uuid, id, species, seedlings, seedlot, spacing, lat, lon
+        FROM trials
+        WHERE row_version > ? AND row_version <= ?
+    """, (since_version, version))
+    deleted = [r[0] for r in query_all("""
+        SELECT uuid FROM trial_tombstones
+        WHERE row_version > ? AND row_version <= ?
+    """, (since_version, version))]
+    return rows, deleted, version
+
+def delete_trial_row(trial_id):
+    execute("DELETE FROM trials WHERE id = ?", (trial_id,))
+
+def save_assessment(trial_uuid, grid, user_id=None, assessed_on=None):
+    """
+    Store a 5×5 grid as the trial's assessment for assessed_on (default:
+    today, UTC). Saving again the same day replaces that day's grid; earlier
+    days are kept as history. Returns the packed code.
+    """
+    from grid_codec import encode_grid
+
+    code = encode_grid(grid)
+    ts = utc_now_iso()
+    execute("""
+        INSERT INTO assessments (trial_uuid, assessed_on, grid, user_id, updated_at, synced)
+        VALUES (?, ?, ?, ?, ?, 0)
+        ON CONFLICT(trial_uuid, assessed_on) DO UPDATE SET
+            grid=excluded.grid,
+            user_id=excluded.user_id,
+            updated_at=excluded.updated_at,
+            synced=0
+    """, (trial_uuid, assessed_on or ts[:10], code, user_id, ts))
+    return code
+
+def get_latest_assessment(trial_uuid):
+    """The trial's most recent grid as a 5×5 list of letters, or None."""
+    row = query_one("""
+        SELECT grid FROM assessments
+        WHERE trial_uuid=?
+        ORDER BY assessed_on DESC
+        LIMIT 1
+    """, (trial_uuid,))
+    if row is None:
+        return None
+    from grid_codec import decode_grid
+
+    return decode_grid(row[0])
+
+def get_assessment_history(trial_uuid):
+    """(dates, codes): the trial's assessments, oldest first; decode with grid_codec.decode_grids / cell_counts."""
+    rows = query_all("""
+        SELECT assessed_on, grid FROM assessments
+        WHERE trial_uuid=?
+        ORDER BY assessed_on
+    """, (trial_uuid,))
+    return [r[0] for r in rows], [r[1] for r in rows]
@@ -1,106 +1,46 @@
-import sqlite3
 from config import DB_PATH, API_URL
+from db import transaction, query_one, query_all, execute
+from migrations import migrate
 import datetime
 import json
 import uuid
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS trials (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            uuid TEXT UNIQUE,
-            species TEXT,
-            seedlings INTEGER,
-            seedlot TEXT,
-            spacing TEXT,
-            lat REAL,
-            lon REAL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            user_id TEXT,
-            request_key TEXT,
-            notes TEXT,
-            site_series TEXT,
-            smr TEXT,
-            snr TEXT,
-            site_fact TEXT,
-            site_prep TEXT,
-            trial_company TEXT,
-            trial_obj TEXT,
-            synced BOOLEAN DEFAULT 0,
-            assess_updated BOOLEAN DEFAULT 0, 
-            growth_grid TEXT
-        )
-    """)
-    
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_uuid TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            username TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS app_state (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    """Create or upgrade the local schema (see migrations.py)."""
+    return migrate()
 
 def list_users():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
+    rows = query_all("""
         SELECT user_uuid, name, email, username, created_at
         FROM users
         ORDER BY datetime(created_at) DESC
     """)
-    rows = c.fetchall()
-    conn.close()
     return [
         {"user_uuid": r[0], "name": r[1], "email": r[2], "username": r[3], "created_at": r[4]}
         for r in rows
     ]
 
 def get_current_user_uuid():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT value FROM app_state WHERE key='current_user_uuid' LIMIT 1")
-    row = c.fetchone()
-    conn.close()
+    row = query_one("SELECT value FROM app_state WHERE key='current_user_uuid' LIMIT 1")
     return row[0] if row else None
 
 def set_current_user_uuid(user_uuid: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
+    execute("""
         INSERT INTO app_state(key, value) VALUES('current_user_uuid', ?)
         ON CONFLICT(key) DO UPDATE SET value=excluded.value
     """, (user_uuid,))
-    conn.commit()
-    conn.close()
 
 def load_current_user_profile():
     user_uuid = get_current_user_uuid()
     if not user_uuid:
         return None
 
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
+    row = query_one("""
         SELECT user_uuid, name, email, username, created_at
         FROM users
         WHERE user_uuid = ?
         LIMIT 1
     """, (user_uuid,))
-    row = c.fetchone()
-    conn.close()
 
     if not row:
         return None
@@ -114,16 +54,12 @@ def create_user_profile(name, email, username):
         "email": email.strip(),
         "username": username.strip(),
     }
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO users (user_uuid, name, email, username)
-        VALUES (?, ?, ?, ?)
-    """, (profile["user_uuid"], profile["name"], profile["email"], profile["username"]))
-    conn.commit()
-    conn.close()
-
-    set_current_user_uuid(profile["user_uuid"])
+    with transaction() as c:
+        c.execute("""
+            INSERT INTO users (user_uuid, name, email, username)
+            VALUES (?, ?, ?, ?)
+        """, (profile["user_uuid"], profile["name"], profile["email"], profile["username"]))
+        set_current_user_uuid(profile["user_uuid"])
     return profile
 
 def get_active_user():
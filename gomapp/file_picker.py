@@ -11,6 +11,7 @@
 #   pick_files(exts=(".mbtiles",), callback=self._on_mbtiles, subdir="mbtiles")
 
 import shutil
+from functools import lru_cache
 from pathlib import Path
 
 from kivy.app import App
@@ -19,14 +20,24 @@ from kivy.clock import mainthread
 from pyobjus import autoclass, protocol, objc_str
 from pyobjus.dylib_manager import load_framework
 
-# Frameworks
-load_framework("/System/Library/Frameworks/UIKit.framework")
-load_framework("/System/Library/Frameworks/Foundation.framework")
+# Frameworks (loaded on the first pick, not at import, to keep app start fast)
+FRAMEWORKS = (
+    "/System/Library/Frameworks/UIKit.framework",
+    "/System/Library/Frameworks/Foundation.framework",
+)
 
-UIApplication = autoclass("UIApplication")
-UIDocumentPickerViewController = autoclass("UIDocumentPickerViewController")
-NSArray = autoclass("NSArray")
-NSData = autoclass("NSData")
+
+@lru_cache(maxsize=None)
+def _objc_class(name):
+    """autoclass(name), loading the frameworks the first time round."""
+    _load_frameworks()
+    return autoclass(name)
+
+
+@lru_cache(maxsize=1)
+def _load_frameworks():
+    for framework in FRAMEWORKS:
+        load_framework(framework)
 
 
 # Keep references so delegate/picker don't get GC'd while visible
@@ -90,7 +101,7 @@ def _top_view_controller():
     Find the topmost UIViewController to present from.
     Works with Kivy's SDL_uikitviewcontroller.
     """
-    app = UIApplication.sharedApplication()
+    app = _objc_class("UIApplication").sharedApplication()
 
     window = _objc_get(app, "keyWindow")  # sometimes callable, sometimes property
     if window is None:
@@ -122,7 +133,7 @@ def _copy_to_app_storage_from_url(nsurl, subdir: str) -> str:
     name = str(_objc_get(nsurl, "lastPathComponent")) or "imported_file"
     dst = dst_dir / name
 
-    data = NSData.dataWithContentsOfURL_(nsurl)
+    data = _objc_class("NSData").dataWithContentsOfURL_(nsurl)
     if data is None:
         raise RuntimeError("NSData.dataWithContentsOfURL_ returned None (provider file not readable)")
 
@@ -169,10 +180,10 @@ class IOSFilesChooser:
         self._subdir = subdir
 
         # Ask for broad document type so iOS shows Files; we filter extensions ourselves.
-        doc_types = NSArray.arrayWithObject_(objc_str("public.data"))
+        doc_types = _objc_class("NSArray").arrayWithObject_(objc_str("public.data"))
         mode_import = 0  # UIDocumentPickerModeImport
 
-        picker = UIDocumentPickerViewController.alloc().initWithDocumentTypes_inMode_(doc_types, mode_import)
+        picker = _objc_class("UIDocumentPickerViewController").alloc().initWithDocumentTypes_inMode_(doc_types, mode_import)
 
         # Multiple selection (optional)
         try:
@@ -0,0 +1,271 @@
+"""
+GeoTIFF georeferencing and reprojection to Web Mercator.
+
+read_georef() takes the pixel-to-map mapping from ModelTiepoint +
+ModelPixelScale (or an unrotated ModelTransformation) and the EPSG code from
+the GeoKey directory (ProjectedCSType, else GeographicType). Rasters that are
+not already in Web Mercator (e.g. BC Albers EPSG:3005, UTM, WGS84) get a
+one-time warped EPSG:3857 copy written beside them by warp_to_webmercator,
+which later loads open directly.
+
+Transformers are cached per (src, dst). pyproj is optional: without it only
+Web Mercator and WGS84 rasters can be placed.
+"""
+
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+from tifffile import TiffWriter
+
+from config import R
+
+try:
+    from pyproj import Transformer
+except ImportError:  # pragma: no cover - optional dependency
+    Transformer = None
+
+WEB_MERCATOR = 3857
+WGS84 = 4326
+WEB_MERCATOR_CODES = {3857, 3785, 900913, 102100, 102113}
+WARPED_SUFFIX = ".3857.tif"
+WARP_TILE_PX = 256
+WARP_GRID_PX = 16  # reproject every 16th pixel exactly, interpolate in between
+EDGE_POINTS = 21  # points per edge when reprojecting bounds
+
+# GeoKey ids (GeoTIFF spec 6.2)
+GT_MODEL_TYPE = 1024
+GT_RASTER_TYPE = 1025
+GEOGRAPHIC_TYPE = 2048
+PROJECTED_CS_TYPE = 3072
+USER_DEFINED = 32767
+MODEL_TYPE_GEOGRAPHIC = 2
+
+
+class WarpCancelled(Exception):
+    pass
+
+
+def webmercator_to_lonlat(x, y):
+    """Convert x/y (meters) → lon/lat (degrees, EPSG:4326)."""
+    lon = np.degrees(np.asarray(x) / R)
+    lat = np.degrees(2 * np.arctan(np.exp(np.asarray(y) / R)) - math.pi / 2)
+    return lon, lat
+
+
+def lonlat_to_webmercator(lon, lat):
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878)
+    x = R * np.radians(lon)
+    y = R * np.log(np.tan(math.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+
+@lru_cache(maxsize=16)
+def get_transformer(src_epsg, dst_epsg):
+    if Transformer is None:
+        raise RuntimeError(f"Reprojecting EPSG:{src_epsg} needs pyproj")
+    return Transformer.from_crs(f"EPSG:{src_epsg}", f"EPSG:{dst_epsg}", always_xy=True)
+
+
+def transform(xs, ys, src_epsg, dst_epsg):
+    """Reproject x/y (arrays) between EPSG codes; x is easting/longitude."""
+    src = WEB_MERCATOR if src_epsg in WEB_MERCATOR_CODES else src_epsg
+    dst = WEB_MERCATOR if dst_epsg in WEB_MERCATOR_CODES else dst_epsg
+    if src == dst:
+        return np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    if (src, dst) == (WGS84, WEB_MERCATOR):
+        return lonlat_to_webmercator(xs, ys)
+    if (src, dst) == (WEB_MERCATOR, WGS84):
+        return webmercator_to_lonlat(xs, ys)
+    return get_transformer(src, dst).transform(np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+
+
+def geokeys(tags):
+    """{GeoKey id: value} for the SHORT-valued keys of the GeoKeyDirectoryTag."""
+    tag = tags.get("GeoKeyDirectoryTag")
+    if tag is None:
+        return {}
+    values = list(tag.value)
+    keys = {}
+    for i in range(4, 4 + 4 * values[3], 4):
+        key_id, location, _count, value = values[i:i + 4]
+        if location == 0:
+            keys[key_id] = value
+    return keys
+
+
+def epsg_from_geokeys(keys):
+    projected = keys.get(PROJECTED_CS_TYPE)
+    if projected and projected != USER_DEFINED:
+        return projected
+    geographic = keys.get(GEOGRAPHIC_TYPE)
+    if geographic and geographic != USER_DEFINED:
+        return geographic
+    if keys.get(GT_MODEL_TYPE) == MODEL_TYPE_GEOGRAPHIC:
+        return WGS84
+    if projected == USER_DEFINED or geographic == USER_DEFINED:
+        raise ValueError("user-defined CRS is not supported")
+    return WEB_MERCATOR  # no CRS keys: keep the old Web Mercator assumption
+
+
+class Georef:
+    """Unrotated pixel → map mapping: x = left + col * pixel_x, y = top - row * pixel_y."""
+
+    def __init__(self, epsg, left, top, pixel_x, pixel_y, width, height):
+        self.epsg = epsg
+        self.left, self.top = left, top
+        self.pixel_x, self.pixel_y = pixel_x, pixel_y
+        self.width, self.height = width, height
+
+    @property
+    def is_webmercator(self):
+        return self.epsg in WEB_MERCATOR_CODES
+
+    @property
+    def bounds(self):
+        """(left, bottom, right, top) in the raster's CRS."""
+        return (self.left, self.top - self.height * self.pixel_y,
+                self.left + self.width * self.pixel_x, self.top)
+
+    def webmercator_bounds(self):
+        left, bottom, right, top = self.bounds
+        if self.is_webmercator:
+            return self.bounds
+        # follow the edges, which are curved once reprojected
+        t = np.linspace(0.0, 1.0, EDGE_POINTS)
+        xs = np.concatenate([left + (right - left) * t, np.full_like(t, right),
+                             left + (right - left) * t, np.full_like(t, left)])
+        ys = np.concatenate([np.full_like(t, bottom), bottom + (top - bottom) * t,
+                             np.full_like(t, top), bottom + (top - bottom) * t])
+        mx, my = transform(xs, ys, self.epsg, WEB_MERCATOR)
+        return (float(np.min(mx)), float(np.min(my)), float(np.max(mx)), float(np.max(my)))
+
+    def lonlat_bounds(self):
+        """(west, south, east, north) in degrees."""
+        left, bottom, right, top = self.webmercator_bounds()
+        west, south = webmercator_to_lonlat(left, bottom)
+        east, north = webmercator_to_lonlat(right, top)
+        return (float(west), float(south), float(east), float(north))
+
+
+def read_georef(tags, width, height):
+    """Georef of a GeoTIFF page from its tags."""
+    epsg = epsg_from_geokeys(geokeys(tags))
+    tiepoint = tags.get("ModelTiepointTag")
+    scale = tags.get("ModelPixelScaleTag")
+    if tiepoint and scale:
+        tp, sc = tiepoint.value, scale.value
+        # tiepoint maps raster (i, j) to model (x, y); usually (0, 0)
+        left = tp[3] - tp[0] * sc[0]
+        top = tp[4] + tp[1] * sc[1]
+        return Georef(epsg, left, top, sc[0], sc[1], width, height)
+    matrix = tags.get("ModelTransformationTag")
+    if matrix:
+        m = matrix.value
+        if m[1] or m[4]:
+            raise ValueError("rotated GeoTIFFs are not supported")
+        return Georef(epsg, m[3], m[7], m[0], -m[5], width, height)
+    raise ValueError("no ModelTiepointTag/ModelPixelScaleTag or ModelTransformationTag")
+
+
+def warped_path(path):
+    return str(path) + WARPED_SUFFIX
+
+
+def is_fresh(derived, source):
+    """True if the file derived from source exists and is newer than it."""
+    try:
+        return os.path.getmtime(derived) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def _color_bands(level):
+    return 3 if level.bands - level.alpha >= 3 else 1
+
+
+def _source_coords(georef, left, top, res, tile_px, step=WARP_GRID_PX):
+    """
+    Source-CRS x/y of the centres of a tile_px x tile_px EPSG:3857 tile whose
+    top-left corner is (left, top): exact on a step-pixel grid, bilinear in
+    between (the projections involved are smooth at this scale).
+    """
+    n = -(-tile_px // step)
+    grid = np.arange(n + 1) * step
+    gx, gy = transform(*np.meshgrid(left + grid * res, top - grid * res), WEB_MERCATOR, georef.epsg)
+    u = (np.arange(tile_px) + 0.5) / step
+    i = np.minimum(u.astype(np.int64), n - 1)
+    f = u - i
+    fy, fx = f[:, np.newaxis], f[np.newaxis, :]
+    iy, ix = i[:, np.newaxis], i[np.newaxis, :]
+
+    def lerp(g):
+        top_row = g[iy, ix] * (1 - fx) + g[iy, ix + 1] * fx
+        bottom_row = g[iy + 1, ix] * (1 - fx) + g[iy + 1, ix + 1] * fx
+        return top_row * (1 - fy) + bottom_row * fy
+
+    return lerp(gx), lerp(gy)
+
+
+def _warped_tiles(level, georef, out_left, out_top, res, out_w, out_h, tile_px, cancel):
+    """Nearest-neighbour EPSG:3857 tiles, row-major: colour bands + an alpha band for coverage."""
+    color = _color_bands(level)
+    alpha_max = np.iinfo(level.dtype).max if np.issubdtype(level.dtype, np.integer) else 1.0
+    for y0 in range(0, out_h, tile_px):
+        for x0 in range(0, out_w, tile_px):
+            if cancel is not None and cancel.is_set():
+                raise WarpCancelled()
+            tile = np.zeros((tile_px, tile_px, color + 1), dtype=level.dtype)
+            sx, sy = _source_coords(georef, out_left + x0 * res, out_top - y0 * res, res, tile_px)
+            cols = np.floor((sx - georef.left) / georef.pixel_x)
+            rows = np.floor((georef.top - sy) / georef.pixel_y)
+            inside = (cols >= 0) & (cols < level.width) & (rows >= 0) & (rows < level.height)
+            if inside.any():
+                cols, rows = cols[inside].astype(np.int64), rows[inside].astype(np.int64)
+                c0, r0 = cols.min(), rows.min()
+                window = level.read(r0, c0, rows.max() + 1, cols.max() + 1)
+                if window.ndim == 2:
+                    window = window[..., np.newaxis]
+                samples = window[rows - r0, cols - c0]
+                tile[inside, :color] = samples[:, :color]
+                tile[inside, color] = samples[:, -1] if level.alpha else alpha_max
+            yield tile
+
+
+def warp_to_webmercator(level, georef, out_path, tile_px=WARP_TILE_PX, cancel=None):
+    """
+    Write an EPSG:3857 copy of level (a tiff_tiles.RasterLevel) to out_path,
+    at about the source resolution, plus an alpha band marking coverage.
+    Works one output tile at a time; out_path only appears once complete.
+    """
+    left, bottom, right, top = georef.webmercator_bounds()
+    res = math.sqrt((right - left) * (top - bottom) / (georef.width * georef.height))
+    out_w, out_h = math.ceil((right - left) / res), math.ceil((top - bottom) / res)
+    bands = _color_bands(level) + 1
+    tmp = out_path + ".tmp"
+    try:
+        with TiffWriter(tmp, bigtiff=True) as writer:
+            writer.write(
+                _warped_tiles(level, georef, left, top, res, out_w, out_h, tile_px, cancel),
+                shape=(out_h, out_w, bands),
+                dtype=level.dtype,
+                tile=(tile_px, tile_px),
+                photometric="rgb" if bands == 4 else "minisblack",
+                planarconfig="contig",
+                extrasamples=("unassalpha",),
+                compression="zlib",
+                extratags=[
+                    (33550, "d", 3, (res, res, 0.0), True),                    # ModelPixelScale
+                    (33922, "d", 6, (0.0, 0.0, 0.0, left, top, 0.0), True),    # ModelTiepoint
+                    (34735, "H", 16, (1, 1, 0, 3,                              # GeoKeyDirectory
+                                      GT_MODEL_TYPE, 0, 1, 1,
+                                      GT_RASTER_TYPE, 0, 1, 1,
+                                      PROJECTED_CS_TYPE, 0, 1, WEB_MERCATOR), True),
+                ],
+            )
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out_w, out_h
@@ -0,0 +1,187 @@
+"""
+GPS fix processing between plyer.gps and the map marker.
+
+GpsFilter.update() takes each raw fix and returns the smoothed (lat, lon), or
+None when the fix is dropped:
+- its reported accuracy is worse than GPS_MAX_ACCURACY metres,
+- it repeats the previous fix (platforms re-deliver the last known fix),
+- it lies further away than the current speed could explain (a multipath
+  jump; the limit is twice the current or reported speed plus GATE_SLACK,
+  at most GPS_MAX_SPEED m/s). After MAX_JUMPS in a row the fixes are
+  believed and the filter restarts from them.
+Accepted fixes go through a constant-position Kalman filter with the reported
+accuracy as measurement noise, so a good fix moves the estimate more than a
+poor one and a standing user's marker stops jittering.
+
+The filter also tracks speed and picks a GPS_TIERS entry, the minTime /
+minDistance to request from gps.start. It moves to a faster tier at once and
+to a slower one only after GPS_TIER_HOLD fixes, so stopping at a tree does
+not flap the request rate.
+
+FixLog records raw fixes to CSV on the device (config.GPS_LOG_FILE);
+benchmarks/gps_replay.py replays them, or a synthetic day, off-device.
+"""
+
+import csv
+import math
+import threading
+import time
+
+from config import (R, GPS_DEFAULT_ACCURACY, GPS_MAX_ACCURACY, GPS_MAX_SPEED, GPS_PROCESS_NOISE, GPS_TIERS,
+                    GPS_TIER_HOLD)
+
+MAX_JUMPS = 3  # consecutive rejected jumps before the estimate itself is assumed wrong
+GATE_SLACK = 3.0  # m/s allowed on top of twice the current speed before a fix is a jump
+FIX_FIELDS = ("t", "lat", "lon", "accuracy", "speed")
+COUNTERS = ("fixes", "accepted", "inaccurate", "duplicates", "jumps", "resets")
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Equirectangular distance in metres; plenty for fixes seconds apart."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return R * math.hypot(x, y)
+
+
+def tier_for(speed, tiers=GPS_TIERS):
+    """Index of the first tier whose speed limit covers speed (m/s)."""
+    for i, (max_speed, _min_time, _min_distance) in enumerate(tiers):
+        if speed <= max_speed:
+            return i
+    return len(tiers) - 1
+
+
+class GpsFilter:
+    def __init__(self, max_accuracy=GPS_MAX_ACCURACY, max_speed=GPS_MAX_SPEED, process_noise=GPS_PROCESS_NOISE,
+                 tiers=GPS_TIERS, tier_hold=GPS_TIER_HOLD):
+        self.max_accuracy = max_accuracy
+        self.max_speed = max_speed
+        self.process_noise = process_noise
+        self.tiers = tiers
+        self.tier_hold = tier_hold
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.tier = tier_for(1.0, tiers)  # assume walking until the fixes say otherwise
+        self.reset()
+
+    def reset(self):
+        self.lat = self.lon = None
+        self.variance = None  # m^2
+        self.t = None
+        self.speed = 0.0  # m/s, smoothed
+        self._last_raw = None
+        self._jumps = 0
+        self._slower = 0  # consecutive fixes asking for a slower tier
+
+    @property
+    def request(self):
+        """(minTime ms, minDistance m) for gps.start at the current tier."""
+        _max_speed, min_time, min_distance = self.tiers[self.tier]
+        return min_time, min_distance
+
+    def update(self, lat, lon, accuracy=None, speed=None, t=None):
+        """Feed one raw fix; return the smoothed (lat, lon) or None if the fix was dropped."""
+        t = time.monotonic() if t is None else t
+        self.counts["fixes"] += 1
+        if lat is None or lon is None:
+            return None
+        accuracy = GPS_DEFAULT_ACCURACY if accuracy is None or accuracy <= 0 else accuracy
+        if accuracy > self.max_accuracy:
+            self.counts["inaccurate"] += 1
+            return None
+        raw = (lat, lon, accuracy)
+        if raw == self._last_raw:
+            self.counts["duplicates"] += 1
+            return None
+
+        if self.lat is None:
+            self._last_raw = raw
+            self.lat, self.lon, self.variance, self.t = lat, lon, accuracy ** 2, t
+            self.counts["accepted"] += 1
+            return self.lat, self.lon
+
+        dt = max(t - self.t, 1e-3)
+        moved = distance_m(self.lat, self.lon, lat, lon)
+        limit = min(self.max_speed, 2 * max(self.speed, speed or 0) + GATE_SLACK)
+        if moved > accuracy + math.sqrt(self.variance) + limit * dt:
+            self._jumps += 1
+            self.counts["jumps"] += 1
+            if self._jumps >= MAX_JUMPS:  # the fixes agree with each other, not with us
+                self.counts["resets"] += 1
+                self.reset()
+                return self.update(lat, lon, accuracy, speed, t)
+            return None
+        self._jumps = 0
+
+        prev = self._last_raw
+        self._last_raw = raw
+        if speed is None or speed < 0:
+            # no Doppler speed from the platform: only movement beyond the two fixes' error counts
+            speed = max(0.0, distance_m(prev[0], prev[1], lat, lon) - math.hypot(prev[2], accuracy)) / dt
+        self.speed = 0.5 * self.speed + 0.5 * speed
+
+        # predict: the position may have drifted by up to process noise (or our speed) per second
+        q = max(self.process_noise, self.speed)
+        self.variance += dt * q * q
+        # correct
+        k = self.variance / (self.variance + accuracy * accuracy)
+        self.lat += k * (lat - self.lat)
+        self.lon += k * (lon - self.lon)
+        self.variance *= 1 - k
+        self.t = t
+        self.counts["accepted"] += 1
+        self._update_tier()
+        return self.lat, self.lon
+
+    def _update_tier(self):
+        wanted = tier_for(self.speed, self.tiers)
+        if wanted > self.tier:
+            self.tier = wanted
+            self._slower = 0
+        elif wanted < self.tier:
+            self._slower += 1
+            if self._slower >= self.tier_hold:
+                self.tier = wanted
+                self._slower = 0
+        else:
+            self._slower = 0
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats["speed"] = self.speed
+        stats["tier"] = self.tier
+        stats["accuracy"] = math.sqrt(self.variance) if self.variance is not None else None
+        return stats
+
+
+class FixLog:
+    """
+    Append raw plyer fixes to a CSV file (t, lat, lon, accuracy, speed).
+    write() runs on the location thread and close() on the main thread, so
+    writes that arrive after close are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", newline="", buffering=1)
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(FIX_FIELDS)
+
+    def write(self, t, lat, lon, accuracy=None, speed=None):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._writer.writerow((f"{t:.3f}", lat, lon, "" if accuracy is None else accuracy,
+                                   "" if speed is None else speed))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_fixes(path):
+    """Yield the fixes of a FixLog file as dicts with float values (None when blank)."""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield {k: (float(v) if v not in ("", None) else None) for k, v in row.items()}
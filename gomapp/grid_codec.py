@@ -0,0 +1,132 @@
+"""
+Compact encoding of the 5×5 growth assessment grid.
+
+Each cell is one of GrowthCell.STATES (P, M, G), stored as a 2-bit code
+0, 1, 2; cell (r, c) occupies bits 2 * (5 * r + c), so a whole grid packs
+into a 50-bit integer. That fits a SQLite INTEGER (8 bytes instead of ~130
+bytes of JSON) and a JSON number without loss (below 2**53, so R and
+JavaScript doubles hold it exactly).
+
+encode_grid / decode_grid handle one grid in plain Python, for the
+assessment popup. encode_grids / decode_grids / cell_counts are the NumPy
+versions for many grids at once (migration backfill, sync, history);
+from_json converts legacy JSON payloads in bulk.
+
+    code = encode_grid([["P", "M", "G", "P", "P"], ...])
+    decode_grid(code)  # -> the same 5×5 list of letters
+"""
+
+import json
+
+import numpy as np
+
+STATES = ("P", "M", "G")  # same order as assessment.GrowthCell.STATES
+SIZE = 5
+CELLS = SIZE * SIZE
+BITS = 2
+MASK = (1 << BITS) - 1
+SHIFTS = np.arange(CELLS, dtype=np.int64) * BITS
+
+_CODE = {s: i for i, s in enumerate(STATES)}
+_LETTERS = np.array(STATES)
+_LUT = np.full(256, MASK, dtype=np.int64)  # ASCII letter -> code, MASK for anything else
+for _i, _s in enumerate(STATES):
+    _LUT[ord(_s)] = _i
+
+
+class GridError(ValueError):
+    pass
+
+
+def encode_grid(grid):
+    """Pack a 5×5 list of "P"/"M"/"G" into an int."""
+    code = 0
+    try:
+        cells = [_CODE[v] for row in grid for v in row]
+    except KeyError as e:
+        raise GridError(f"unknown growth state {e.args[0]!r}") from None
+    if len(cells) != CELLS:
+        raise GridError(f"expected {CELLS} cells, got {len(cells)}")
+    for i, v in enumerate(cells):
+        code |= v << (BITS * i)
+    return code
+
+
+def decode_grid(code):
+    """Unpack an int into a 5×5 list of "P"/"M"/"G"."""
+    code = int(code)
+    cells = [(code >> (BITS * i)) & MASK for i in range(CELLS)]
+    if max(cells) >= len(STATES) or code >> (BITS * CELLS):
+        raise GridError(f"not a packed growth grid: {code}")
+    return [[STATES[v] for v in cells[r * SIZE:(r + 1) * SIZE]] for r in range(SIZE)]
+
+
+def encode_grids(grids, strict=True):
+    """
+    Pack many grids (a sequence of 5×5 letter lists, or an (n, 5, 5) array)
+    into int64 codes. An unknown state (including a cell of more than one
+    character) raises GridError, or with strict=False gives that grid the
+    code -1. Anything but 5×5 grids of strings raises GridError.
+    """
+    letters = np.asarray(grids)
+    if letters.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if letters.dtype.kind != "U":
+        raise GridError(f"expected growth state letters, got {letters.dtype}")
+    if letters.shape[-2:] != (SIZE, SIZE):
+        raise GridError(f"expected {SIZE}×{SIZE} grids, got shape {letters.shape}")
+    letters = np.ascontiguousarray(letters).reshape(-1, CELLS)
+    # code points per cell, zero-padded to the longest cell
+    points = letters.view(np.uint32).reshape(len(letters), CELLS, -1)
+    first = points[..., 0]
+    cells = _LUT[first & 0xFF]
+    bad = (cells == MASK) | (first > 0xFF) | points[..., 1:].any(axis=-1)
+    codes = (cells << SHIFTS).sum(axis=1)
+    if bad.any():
+        if strict:
+            raise GridError(f"unknown growth state {letters[bad][0]!r}")
+        codes[bad.any(axis=1)] = -1
+    return codes
+
+
+def decode_grids(codes):
+    """(n, 5, 5) uint8 array of state codes (0=P, 1=M, 2=G) for int codes."""
+    codes = np.asarray(codes, dtype=np.int64).reshape(-1, 1)
+    cells = ((codes >> SHIFTS) & MASK).astype(np.uint8)
+    if (cells >= len(STATES)).any() or ((codes >> (BITS * CELLS)) != 0).any():
+        raise GridError("not a packed growth grid")
+    return cells.reshape(-1, SIZE, SIZE)
+
+
+def to_letters(cells):
+    """Letters for an array of state codes, e.g. decode_grids(...)[i]."""
+    return _LETTERS[cells]
+
+
+def cell_counts(codes):
+    """(n, 3) counts of P, M and G cells per grid, without decoding to letters."""
+    cells = decode_grids(codes).reshape(-1, CELLS)
+    return np.stack([(cells == i).sum(axis=1) for i in range(len(STATES))], axis=1)
+
+
+def from_json(payloads):
+    """Codes for legacy trials.growth_grid payloads ('{"grid": [[...]]}'); -1 where unusable."""
+    payloads = list(payloads)
+    if not payloads:
+        return np.zeros(0, dtype=np.int64)
+    try:
+        # one parse for the lot; any malformed payload sends us down the per-row path
+        grids = [p["grid"] for p in json.loads("[" + ",".join(payloads) + "]")]
+        letters = np.asarray(grids)
+        if letters.shape != (len(payloads), SIZE, SIZE) or letters.dtype.kind != "U":
+            raise ValueError(letters.shape)
+    except (TypeError, ValueError, KeyError):
+        return np.array([_from_json_one(p) for p in payloads], dtype=np.int64)
+    return encode_grids(letters, strict=False)
+
+
+def _from_json_one(payload):
+    try:
+        return encode_grid(json.loads(payload)["grid"])
+    except (TypeError, ValueError, KeyError):
+        return -1
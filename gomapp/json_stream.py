@@ -0,0 +1,62 @@
+"""
+Incremental JSON readers for large HTTP responses.
+
+iter_records(response) yields one record at a time from a `requests`
+response opened with stream=True, whether the server sent a JSON array of
+objects or NDJSON (one object per line), so only one chunk of the body is
+held in memory at once.
+"""
+
+import json
+
+_decoder = json.JSONDecoder()
+_SKIP = " \t\r\n,"
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(chunks):
+    """Yield the objects of a top-level JSON array fed in as text chunks."""
+    buf = ""
+    pos = 0
+    started = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf = buf[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in _SKIP:
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, pos = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # element continues in the next chunk
+            yield obj
+    raise ValueError("Truncated JSON array")
+
+
+def iter_ndjson(lines):
+    """Yield one object per non-blank line."""
+    for line in lines:
+        if line and line.strip():
+            yield json.loads(line)
+
+
+def iter_records(response):
+    """Pick the parser from the Content-Type and stream the response body."""
+    if response.encoding is None:
+        response.encoding = "utf-8"
+    ctype = response.headers.get("Content-Type", "")
+    if "ndjson" in ctype or "jsonl" in ctype:
+        return iter_ndjson(response.iter_lines(decode_unicode=True))
+    return iter_json_array(response.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=True))
@@ -1,48 +1,326 @@
-from kivy_garden.mapview.mbtsource import MBTilesMapSource
+"""
+Read-only MBTiles map source.
+
+The .mbtiles file is never written: every thread (the main thread and each
+Downloader worker) gets one pooled connection opened through a
+"file:...?mode=ro&immutable=1" URI, so opening a large tile package takes no
+lock and doesn't touch the file. Anything that writes a package (an offline
+pack being downloaded again) must close its source or close_pool() first.
+Missing metadata is filled in memory:
+format from the first tile's magic bytes, min/max zoom and bounds from one
+query on the tiles index. That query's result is kept in a
+"<file>.bounds.json" sidecar (checked against the file's size and mtime), so
+it only runs the first time a package is opened.
+
+Decoded tiles are kept in a byte-budgeted LRU keyed by (zoom, column, row),
+so panning back over an area neither reads SQLite nor decodes again. For
+every tile the map asks for, its neighbours and its children at the next
+zoom are decoded ahead on a background thread. stats() reports hits, misses
+and prefetches for tuning MBTILES_CACHE_BYTES per device.
+"""
+
+import io
+import json
+import math
+import os
 import sqlite3
+import threading
+from collections import deque
+from urllib.parse import quote
 
-class SafeMBTilesSource(MBTilesMapSource):
-    
-    def __init__(self, filename, **kwargs):
-        super().__init__(filename)
-        # Ensure essential metadata exists
-        conn = sqlite3.connect(filename)
-        cur = conn.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
-        # Default metadata if missing
-        for key, val in {
-            "minzoom": "0",
-            "maxzoom": "18",
-            "center": "0,0,2",
-            #"bounds": "-180,-90,180,90",  # default global bounds
-        }.items():
-            cur.execute("INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)", (key, val))
-        conn.commit()
-
-        # Read metadata safely
-        cur.execute("SELECT name, value FROM metadata")
-        self.metadata = {name: value for name, value in cur.fetchall()}
-        print(f"Metadata: {self.metadata}")
-        conn.close()
+from kivy.core.image import Image as CoreImage
+from kivy_garden.mapview.downloader import Downloader
+from kivy_garden.mapview.mbtsource import MBTilesMapSource
+from kivy_garden.mapview.source import MapSource
 
-        metadata = getattr(self, "metadata", {})
+from config import MBTILES_CACHE_BYTES, MBTILES_PREFETCH, MBTILES_PREFETCH_QUEUE
+from lru import LRUCache
 
-        # --- Safe bounds ---
-        b = metadata.get("bounds", None)
-        if b:
+BOUNDS_SUFFIX = ".bounds.json"
+MISSING = object()  # cached "no such tile"
+PREFETCH_IDLE_WAIT = 0.02  # s between checks while the map has tiles loading
+WORLD_BOUNDS = (-180, -85.05112878, 180, 85.05112878)
+TILE_FORMATS = (
+    (b"\x89PNG", "png"),
+    (b"\xff\xd8", "jpg"),
+    (b"GIF8", "gif"),
+    (b"\x1f\x8b", "pbf"),  # gzip: vector tiles
+)
+
+
+def image_nbytes(im):
+    return 64 if im is MISSING else im.width * im.height * 4
+
+
+def readonly_uri(path):
+    return "file:{}?mode=ro&immutable=1".format(quote(os.path.abspath(path)))
+
+
+class ReadOnlyPool:
+    """One read-only connection per thread to a single SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(readonly_uri(self.path), uri=True, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """Close every thread's connection (threads reopen on next use)."""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        self._local = threading.local()
+        for conn in conns:
             try:
-                parts = list(map(float, b.split(",")))
-                if len(parts) == 4:
-                    self._bounds = tuple(parts)
-                else:
-                    self._bounds = (-180, -85.05112878, 180, 85.05112878)
-            except Exception:
-                self._bounds = (-180, -85.05112878, 180, 85.05112878)
-        else:
-            self._bounds = (-180, -85.05112878, 180, 85.05112878)
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    key = os.path.abspath(path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ReadOnlyPool(key)
+        return pool
+
+
+def close_pool(path):
+    with _pools_lock:
+        pool = _pools.pop(os.path.abspath(path), None)
+    if pool is not None:
+        pool.close()
+
+
+def tile_format(data):
+    data = bytes(data[:12])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    for magic, fmt in TILE_FORMATS:
+        if data.startswith(magic):
+            return fmt
+    return "png"
+
+
+def tms_bounds(zoom, col0, col1, row0, row1):
+    """(west, south, east, north) of an inclusive TMS tile range."""
+    n = 2 ** zoom
 
+    def lat(y):  # XYZ tile edge -> latitude
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return (col0 / n * 360.0 - 180.0, lat(n - row0), (col1 + 1) / n * 360.0 - 180.0, lat(n - 1 - row1))
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def tile_extent(conn, path):
+    """
+    {"minzoom", "maxzoom", "bounds"} of the tiles table, from the sidecar when
+    it matches the file, else from one indexed query (then saved to the sidecar).
+    """
+    sidecar = path + BOUNDS_SUFFIX
+    stamp = _file_stamp(path)
+    try:
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached.get("stamp") == stamp:
+            return cached["extent"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # MIN/MAX(zoom_level) are index lookups; the column/row range scans only the deepest zoom's index entries
+    row = conn.execute(
+        "SELECT (SELECT MIN(zoom_level) FROM tiles), zoom_level,"
+        " MIN(tile_column), MAX(tile_column), MIN(tile_row), MAX(tile_row)"
+        " FROM tiles WHERE zoom_level = (SELECT MAX(zoom_level) FROM tiles)"
+    ).fetchone()
+    if row is None or row[1] is None:
+        return None
+    minzoom, maxzoom, col0, col1, row0, row1 = row
+    extent = {"minzoom": minzoom, "maxzoom": maxzoom, "bounds": tms_bounds(maxzoom, col0, col1, row0, row1)}
+    try:
+        with open(sidecar, "w") as f:
+            json.dump({"stamp": stamp, "extent": extent}, f)
+    except OSError as e:
+        print(f"⚠️ Could not write MBTiles sidecar: {e}")
+    return extent
+
+
+def read_metadata(conn, path):
+    """The metadata table (if any) with missing essentials synthesised in memory."""
+    try:
+        metadata = dict(conn.execute("SELECT name, value FROM metadata"))
+    except sqlite3.OperationalError:
+        metadata = {}
+    if "format" not in metadata:
+        row = conn.execute("SELECT tile_data FROM tiles LIMIT 1").fetchone()
+        metadata["format"] = tile_format(row[0]) if row else "png"
+    if not {"minzoom", "maxzoom", "bounds"} <= metadata.keys():
+        extent = tile_extent(conn, path)
+        if extent:
+            metadata.setdefault("minzoom", str(extent["minzoom"]))
+            metadata.setdefault("maxzoom", str(extent["maxzoom"]))
+            metadata.setdefault("bounds", ",".join(str(v) for v in extent["bounds"]))
+    metadata.setdefault("minzoom", "0")
+    metadata.setdefault("maxzoom", "18")
+    return metadata
+
+
+def parse_bounds(value):
+    try:
+        parts = tuple(map(float, value.split(",")))
+    except (AttributeError, ValueError):
+        return WORLD_BOUNDS
+    return parts if len(parts) == 4 else WORLD_BOUNDS
+
+
+class SafeMBTilesSource(MBTilesMapSource):
+
+    def __init__(self, filename, cache_bytes=MBTILES_CACHE_BYTES, prefetch=MBTILES_PREFETCH, **kwargs):
+        # MBTilesMapSource.__init__ opens the file read-write and needs complete metadata; set up here instead
+        MapSource.__init__(self, **kwargs)
+        self.filename = filename
+        self.pool = get_pool(filename)
+        self.metadata = read_metadata(self.pool.get(), filename)
+        print(f"Metadata: {self.metadata}")
+        if self.metadata["format"] == "pbf":
+            raise ValueError("Only raster maps are supported, not vector maps.")
+        self.format = self.metadata["format"]
+        self.attribution = self.metadata.get("attribution", "")
+        self.projection = self.metadata.get("projection", "")
+        self.is_xy = self.projection == "xy"
+
+        # --- Safe bounds ---
+        self._bounds = parse_bounds(self.metadata.get("bounds"))
+        self.bounds = self._bounds
 
         # Safe min/max zoom
         self.min_zoom = int(self.metadata.get("minzoom", 0))
         self.max_zoom = int(self.metadata.get("maxzoom", 18))
+        west, south, east, north = self._bounds
+        try:
+            cx, cy = map(float, self.metadata["center"].split(",")[:2])
+        except (KeyError, ValueError):
+            cx, cy = (west + east) / 2.0, (south + north) / 2.0
+        self.default_lon, self.default_lat = cx, cy
         self.default_zoom = int(self.metadata.get("defaultzoom", self.min_zoom))
+
+        # Decoded tiles by (zoom, column, row), filled on demand and by the prefetch thread
+        self.images = LRUCache(cache_bytes, size_of=image_nbytes)
+        self.prefetched = 0
+        self._loading = set()  # keys submitted to the Downloader
+        self._prefetch_queue = deque(maxlen=MBTILES_PREFETCH_QUEUE)
+        self._prefetch_cond = threading.Condition()
+        self._closed = False
+        self._prefetcher = None
+        if prefetch:
+            self._prefetcher = threading.Thread(target=self._prefetch_loop, name="gomapp-mbtiles-prefetch",
+                                                daemon=True)
+            self._prefetcher.start()
+
+    def fill_tile(self, tile):
+        if tile.state == "done":
+            return
+        key = (tile.zoom, tile.tile_x, tile.tile_y)
+        im = self.images.get(key)
+        if im is MISSING:
+            tile.state = "done"
+        elif im is not None:
+            self._load_tile_done(tile, im)
+        else:
+            self._loading.add(key)
+            Downloader.instance(self.cache_dir).submit(self._load_tile, tile)
+        if self._prefetcher is not None:
+            self._queue_prefetch(key)
+
+    def _read_image(self, zoom, x, y):
+        """Decoded tile (CoreImage), or MISSING if the package has no such tile."""
+        row = self.pool.get().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+            (zoom, x, y),
+        ).fetchone()
+        if not row:
+            return MISSING
+        im = CoreImage(
+            io.BytesIO(bytes(row[0])),
+            ext=self.format,
+            filename="{}.{}.{}.{}".format(zoom, x, y, self.format),
+            nocache=True,  # self.images is the cache
+        )
+        return MISSING if im is None else im
+
+    def _load_tile(self, tile):
+        key = (tile.zoom, tile.tile_x, tile.tile_y)
+        im = self.images.peek(key)  # prefetched since fill_tile missed
+        if im is None:
+            im = self._read_image(*key)
+            self.images.put(key, im)
+        self._loading.discard(key)
+        if im is MISSING:
+            tile.state = "done"
+            return
+        return self._load_tile_done, (tile, im)
+
+    # --- prefetch ---
+
+    def _queue_prefetch(self, key):
+        """Queue the 4 children of a requested tile at the next zoom, then its 8 neighbours (taken first)."""
+        zoom, x, y = key
+        n = 2 ** zoom
+        keys = []
+        if zoom < self.max_zoom:
+            keys += [(zoom + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1)]
+        keys += [(zoom, (x + dx) % n, y + dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy]
+        with self._prefetch_cond:
+            for k in keys:
+                if 0 <= k[2] < 2 ** k[0] and k not in self.images and k not in self._loading:
+                    self._prefetch_queue.append(k)
+            self._prefetch_cond.notify()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._prefetch_cond:
+                # stay behind the tiles the map is waiting for
+                while (not self._prefetch_queue or self._loading) and not self._closed:
+                    self._prefetch_cond.wait(PREFETCH_IDLE_WAIT if self._loading else None)
+                if self._closed:
+                    return
+                key = self._prefetch_queue.pop()  # newest first: the current viewport
+            if key in self.images or key in self._loading:
+                continue
+            try:
+                self.images.put(key, self._read_image(*key))
+                self.prefetched += 1
+            except Exception as e:
+                print(f"⚠️ MBTiles prefetch failed for {key}: {e}")
+
+    def stats(self):
+        stats = self.images.stats()
+        stats["prefetched"] = self.prefetched
+        return stats
+
+    def close(self):
+        with self._prefetch_cond:
+            self._closed = True
+            self._prefetch_queue.clear()
+            self._prefetch_cond.notify_all()
+        self.images.clear()
+        close_pool(self.filename)
@@ -1,78 +1,317 @@
-import numpy as np
+import itertools
 import math
-from kivy.uix.image import Image
-from kivy_garden.mapview import MapView, MapMarker, MapMarkerPopup
-from tifffile import TiffFile
+import queue
+import threading
+
 import numpy as np
+from kivy.clock import Clock, mainthread
+from kivy.graphics import Color, InstructionGroup, PopMatrix, PushMatrix, Rectangle, Scale, Translate
 from kivy.graphics.texture import Texture
+from kivy.uix.widget import Widget
+from kivy_garden.mapview import MapView
+
+from config import R, OVERLAY_TILE_PX, OVERLAY_TEXTURE_BYTES, OVERLAY_STRETCH
+from georef import read_georef, warp_to_webmercator, warped_path, is_fresh
+from lru import LRUCache
+from normalize import compute_stats, rescale_to_ubyte
+from overlay_cache import file_key
+from tiff_tiles import TiledTiffReader, OverviewBuildCancelled
+
+BYTES_PER_PIXEL = {"rgb": 3, "rgba": 4, "luminance": 1, "luminance_alpha": 2}
+COLORFMTS = {(3, False): "rgb", (3, True): "rgba", (1, False): "luminance", (1, True): "luminance_alpha"}
+PREVIEW_MAX_TILES = 16   # the coarsest level is decoded up front as a preview if it is this small
+MAX_VISIBLE_TILES = 64   # above this (no usable overview yet) only the decimated preview is drawn
+PREVIEW_MAX_PX = 1024    # longest side of the decimated preview shown while overviews are built
+PRIORITY_STOP, PRIORITY_PREVIEW, PRIORITY_VISIBLE = -1, 0, 1
+
+
+def texture_nbytes(tex):
+    return tex.width * tex.height * BYTES_PER_PIXEL.get(tex.colorfmt, 4)
 
-def webmercator_to_lonlat(x, y):
-    """Convert x/y (meters) → lon/lat (degrees, EPSG:4326)."""
-    lon = math.degrees(x / R)
-    lat = math.degrees(2 * math.atan(math.exp(y / R)) - math.pi / 2)
-    return lon, lat
 
-class GeoTiffOverlay(Image):
-    def __init__(self, geotiff_path, mapview: MapView, **kwargs):
+class GeoTiffOverlay(Widget):
+    """
+    GeoTIFF drawn as a grid of OVERLAY_TILE_PX textures. Only the tiles that
+    overlap the MapView are read from the file (see tiff_tiles) and drawn;
+    built textures are kept in an LRU keyed by (level, ty, tx). The level is
+    the coarsest overview that still has at least one raster pixel per screen
+    pixel at the current zoom; a missing pyramid is built in the background.
+    Rasters in another CRS are drawn from a warped EPSG:3857 copy (see georef).
+
+    Opening the file, computing display ranges and decoding/normalizing tiles
+    all happen on a worker thread; only Texture creation and blit_buffer run
+    on the main thread. The coarsest level is shown first as a preview and
+    tiles that are not decoded yet are drawn from a coarser level meanwhile.
+    A raster without overviews gets a decimated preview (every n-th pixel)
+    first, which stands in for everything until the sidecar pyramid is built.
+    close() cancels outstanding work.
+
+    on_texture, if given, is called after each new texture, and on_failed
+    if the file cannot be loaded (see overlay_manager, which holds several
+    overlays to one texture budget). The texture LRU never evicts the tiles
+    on screen.
+
+    With an overlay_cache.OverlayCache, display ranges, bounds and every
+    decoded tile are kept on disk, so reopening the same file skips the stats
+    pass and the decoding.
+
+    Tile rectangles live in full-resolution raster pixel units (y up) under a
+    Translate/Scale pair. Map movement is coalesced to one update_position
+    per frame, which moves the overlay by updating that transform; the tile
+    rectangles are only rebuilt when the level or the visible tile range
+    changes.
+    """
+
+    def __init__(self, geotiff_path, mapview: MapView, tile_px=OVERLAY_TILE_PX,
+                 cache_bytes=OVERLAY_TEXTURE_BYTES, stretch=OVERLAY_STRETCH, cache=None,
+                 on_texture=None, on_failed=None, **kwargs):
         super().__init__(**kwargs)
+        self.path = str(geotiff_path)
         self.mapview = mapview
+        self.tile_px = tile_px
+        self.stretch = stretch
+        self.reader = None
+        self.wgs_bounds = None  # set once the worker has opened the file
+        self.ranges = None
+        self.alpha = False
+        self.colorfmt = None
+        self.cache = cache
+        self._cache_key = None
+        self._entry = None  # overlay_cache.CacheEntry of this file
+        self.textures = LRUCache(cache_bytes, size_of=texture_nbytes, keep=self.onscreen_keys)
+        self.on_texture = on_texture
+        self.on_failed = on_failed
+        self._rects = {}  # (level, ty, tx) -> Rectangle currently on the canvas
+        self._borrowed = set()  # coarser tiles whose regions stand in for missing ones
+        self._preview = None  # decimated whole-raster Texture until the overviews are built
+        self._preview_rect = None
+        self._level = 0
+        self._view = None  # (level, visible tile range) the rectangles were built for
+        self._screen = (0, 0, 0, 0)  # overlay extent in window coords: x1, y1, x2, y2
+        self._wanted = set()
+        self._pending = set()
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._cancel = threading.Event()
+        self.opacity = 0.6
+
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            PushMatrix()
+            self._translate = Translate(0, 0)
+            self._scale = Scale(1, 1, 1)
+            self._tiles = InstructionGroup()
+            PopMatrix()
 
-        with TiffFile(geotiff_path) as tif:
-            img = tif.asarray()
-            tags = tif.pages[0].tags
-
-            # --- Extract approximate georeferencing ---
-            model_tiepoint = tags.get("ModelTiepointTag")
-            model_pixel_scale = tags.get("ModelPixelScaleTag")
-
-            if model_tiepoint and model_pixel_scale:
-                tiepoint = model_tiepoint.value
-                scale = model_pixel_scale.value
-                width = img.shape[-1]
-                height = img.shape[-2]
-                origin_x = tiepoint[3]
-                origin_y = tiepoint[4]
-                pixel_x = scale[0]
-                pixel_y = scale[1]
-
-                left = origin_x
-                top = origin_y
-                right = origin_x + width * pixel_x
-                bottom = origin_y - height * pixel_y
-                #self.merc_bounds = (left, bottom, right, top)
-                
-            print(f"Tiff shape: {img.shape}")
-            if img.ndim == 3 and img.shape[2] >= 3:
-                data = img[..., :3]
-                data = np.nan_to_num(data).astype(np.uint8)
-                print(f"Min val:{np.min(data)}; max val: {np.max(data)}")
-                colorfmt = "rgb"
-            else:
-                data = img.astype(np.float32)
-                data = 255 * (data - np.nanmin(data)) / (np.nanmax(data) - np.nanmin(data))
-                data = np.nan_to_num(data).astype(np.uint8)
-                colorfmt = "luminance"
-
-            height, width = data.shape[:2]
-            tex = Texture.create(size=(width, height), colorfmt=colorfmt)
-            tex.blit_buffer(data.tobytes(), colorfmt=colorfmt, bufferfmt="ubyte")
-            tex.flip_vertical()
-            self.texture = tex
- 
-
-        # ✅ Convert bounds to WGS84 (lat/lon)
-        
-        ll_left, ll_bottom = webmercator_to_lonlat(left, bottom)
-        ll_right, ll_top   = webmercator_to_lonlat(right, top)
-
-        self.wgs_bounds = (ll_left, ll_bottom, ll_right, ll_top)
+        # Reposition at most once per frame, however many map properties change
+        self._reposition = Clock.create_trigger(self.update_position, -1)
+        self.mapview.bind(zoom=self._reposition, lat=self._reposition,
+                          lon=self._reposition, size=self._reposition, pos=self._reposition)
+
+        threading.Thread(target=self._run, name="gomapp-geotiff", daemon=True).start()
+
+    # --- worker thread ---
+
+    def _run(self):
+        try:
+            bounds = self._open()
+            self._ready(bounds)
+            while True:
+                priority, _seq, key = self._queue.get()
+                if self._cancel.is_set() or key is None:
+                    break
+                if priority == PRIORITY_VISIBLE and key not in self._wanted:
+                    self._pending.discard(key)  # scrolled away before we got to it
+                    continue
+                self._tile_ready(key, self._load_tile(*key), self.colorfmt)
+        except Exception as e:
+            if not self._cancel.is_set():
+                print(f"❌ Could not load GeoTIFF {self.path}: {e}")
+                self._failed()
+        finally:
+            if self.reader is not None:
+                self.reader.close()
+            if self._entry is not None:
+                self.cache.release(self._cache_key)
+
+    def _open(self):
+        meta = None
+        if self.cache is not None:
+            self._cache_key = file_key(self.path, tile_px=self.tile_px, stretch=self.stretch)
+            self._entry = self.cache.open(self._cache_key)
+            meta = self._entry.meta()
+        self.reader = reader = TiledTiffReader(self.path)
+        georef = read_georef(reader.tags, reader.width, reader.height)
+        if not georef.is_webmercator:
+            warped = warped_path(self.path)
+            if not is_fresh(warped, self.path):
+                print(f"🛠️  Reprojecting EPSG:{georef.epsg} → EPSG:3857: {warped}")
+                warp_to_webmercator(reader.levels[0], georef, warped, cancel=self._cancel)
+            reader.close()
+            self.reader = reader = TiledTiffReader(warped)
+            georef = read_georef(reader.tags, reader.width, reader.height)
+        self.pixel_m = georef.pixel_x  # full-resolution pixel size in metres (EPSG:3857)
+
+        level = reader.levels[0]
+        print(f"Tiff shape: {level.shape} ({'tiled' if level.tiled else 'striped'}, {level.dtype}), "
+              f"{len(reader.levels)} level(s)")
+        self.alpha = level.alpha
+        if meta is not None:
+            print("✅ Using cached overlay tiles")
+            self.ranges = [tuple(r) for r in meta["ranges"]]
+            bounds = tuple(meta["bounds"])
+        else:
+            self.ranges = self._display_ranges(reader.levels[-1], self.stretch)
+            # ✅ Convert bounds to WGS84 (lat/lon)
+            bounds = georef.lonlat_bounds()
+        print(f"Display ranges: {self.ranges}")
+        self.colorfmt = COLORFMTS[len(self.ranges), self.alpha]
+
+        ll_left, ll_bottom, ll_right, ll_top = bounds
         print(f"File Bounds: {ll_left}, {ll_top}, {ll_right},{ll_bottom}")
+        if self._entry is not None and meta is None:
+            self._entry.write_meta({"source": self.path, "bounds": bounds, "ranges": self.ranges,
+                                    "alpha": self.alpha, "width": reader.width, "height": reader.height})
+            self.cache.trim()
+        return bounds
+
+    @staticmethod
+    def _display_ranges(level, stretch):
+        """Per-band (lo, hi) mapped to 0..255: RGB for 3+ colour bands, else the first band."""
+        bands = 3 if level.bands - level.alpha >= 3 else 1
+        if level.dtype == np.uint8 and bands == 3 and stretch is None:
+            return [(0.0, 255.0)] * 3
+        return compute_stats(level, bands=bands, alpha=level.alpha).ranges(stretch)
+
+    def _load_tile(self, level, ty, tx):
+        """Ready-to-blit tile from the disk cache, else decoded (and cached)."""
+        shape = self.reader.levels[level].shape[:2]
+        if self._entry is not None:
+            data = self._entry.get_tile(shape, ty, tx)
+            if data is not None:
+                return data
+        data = self._decode_tile(level, ty, tx)
+        if self._entry is not None:
+            try:
+                self._entry.put_tile(shape, ty, tx, data)
+            except OSError as e:
+                print("⚠️ Could not cache overlay tile:", e)
+        return data
+
+    def _decode_tile(self, level, ty, tx):
+        y0, x0 = ty * self.tile_px, tx * self.tile_px
+        return self._to_ubyte(self.reader.levels[level].read(y0, x0, y0 + self.tile_px, x0 + self.tile_px)[::-1])
 
-        # Bind update on map movement
-        self.mapview.bind(zoom=self.update_position, lat=self.update_position, lon=self.update_position)
+    def _to_ubyte(self, data):
+        color = len(self.ranges)
+        out = np.empty(data.shape[:2] + (color + self.alpha,), dtype=np.uint8)
+        # rows bottom-up, as Kivy textures expect
+        rescale_to_ubyte(data, self.ranges, out=out[..., :color])
+        if self.alpha:
+            np.multiply(data[..., -1] > 0, 255, out=out[..., color], casting="unsafe")
+        return out
+
+    def _build_overviews(self):
+        reader = self.reader
+        step = -(-max(reader.width, reader.height) // PREVIEW_MAX_PX)
+        print(f"🛠️  Building overviews: {reader.overview_path}")
+        try:
+            self._preview_ready(self._to_ubyte(reader.levels[0].read_decimated(step, cancel=self._cancel)[::-1]),
+                                self.colorfmt)
+            levels = reader.build_overviews(cancel=self._cancel)
+        except OverviewBuildCancelled:
+            return
+        except Exception as e:
+            if not self._cancel.is_set():
+                print("⚠️ Could not build GeoTIFF overviews:", e)
+            return
+        print(f"✅ Built {levels} overview level(s)")
+        self._overviews_built()
+
+    # --- main thread ---
+
+    @mainthread
+    def _ready(self, bounds):
+        if self._cancel.is_set():
+            return
+        self.wgs_bounds = bounds
+        if self.reader.needs_overviews:
+            threading.Thread(target=self._build_overviews, name="gomapp-overviews", daemon=True).start()
+        self._request_preview()
+        self.update_position()
+
+    @mainthread
+    def _failed(self):
+        if self.on_failed is not None:
+            self.on_failed(self)
+            return
+        if self.parent:
+            self.parent.remove_widget(self)
+        self.close()
+
+    @mainthread
+    def _preview_ready(self, data, colorfmt):
+        if self._cancel.is_set() or self.reader.open_overviews():
+            return
+        height, width = data.shape[:2]
+        self._preview = Texture.create(size=(width, height), colorfmt=colorfmt)
+        self._preview.blit_buffer(data.tobytes(), colorfmt=colorfmt, bufferfmt="ubyte")
+        if self._view is not None:
+            self._update_tiles()
+
+    @mainthread
+    def _overviews_built(self):
+        if not self._cancel.is_set() and self.reader.open_overviews():
+            self._preview = None
+            self._request_preview()
+            self._view = None  # rebuild: the preview and its regions are gone
+            self.update_position()
+
+    @mainthread
+    def _tile_ready(self, key, data, colorfmt):
+        self._pending.discard(key)
+        if self._cancel.is_set():
+            return
+        height, width = data.shape[:2]
+        tex = Texture.create(size=(width, height), colorfmt=colorfmt)
+        tex.blit_buffer(data.tobytes(), colorfmt=colorfmt, bufferfmt="ubyte")
+        self.textures.put(key, tex)
+        if self.on_texture is not None:
+            self.on_texture(self)
+        if self._view is not None and (key in self._wanted or key[0] > self._level):
+            self._update_tiles()
+
+    def _request(self, key, priority=PRIORITY_VISIBLE):
+        if key not in self._pending:
+            self._pending.add(key)
+            self._queue.put((priority, next(self._seq), key))
+
+    def _request_preview(self):
+        level = len(self.reader.levels) - 1
+        tiles = self._tile_grid(level)
+        if len(tiles) <= PREVIEW_MAX_TILES:
+            for ty, tx in tiles:
+                if (level, ty, tx) not in self.textures:
+                    self._request((level, ty, tx), PRIORITY_PREVIEW)
+
+    def close(self):
+        """Unbind from the map, cancel pending work and release the textures and the file."""
+        self._cancel.set()
+        self._queue.put((PRIORITY_STOP, next(self._seq), None))
+        self._reposition.cancel()
+        self.mapview.unbind(zoom=self._reposition, lat=self._reposition,
+                            lon=self._reposition, size=self._reposition, pos=self._reposition)
+        self._tiles.clear()
+        self._rects.clear()
+        self._wanted = set()
+        self._borrowed = set()
+        self._preview = self._preview_rect = None
+        self.textures.clear()
 
     def update_position(self, *args):
         """Update overlay position and size relative to the map."""
+        if self.wgs_bounds is None:
+            return
         try:
             left, bottom, right, top = self.wgs_bounds  # in lon/lat order
 
@@ -80,10 +319,135 @@ class GeoTiffOverlay(Image):
             x1, y1 = self.mapview.get_window_xy_from(top, left, self.mapview.zoom)      # top-left
             x2, y2 = self.mapview.get_window_xy_from(bottom, right, self.mapview.zoom)  # bottom-right
 
-            self.pos = (x1, y2)
-            self.size = (x2 - x1, y1 - y2)
-            self.opacity = 0.6
-            self.canvas.ask_update()
+            self._screen = (x1, y2, x2, y1)
+            self._translate.xy = (x1, y2)
+            self._scale.xyz = ((x2 - x1) / self.reader.width, (y1 - y2) / self.reader.height, 1)
+
+            level = self.choose_level()
+            view = (level, self.visible_range(level))
+            if view != self._view:
+                self._view = view
+                self._update_tiles()
 
         except Exception as e:
             print("Error updating overlay position:", e)
+
+    def choose_level(self):
+        """Coarsest level whose pixels are no larger than a screen pixel."""
+        screen_m = 2 * math.pi * R / (256 * 2 ** self.mapview.zoom * getattr(self.mapview, "scale", 1.0))
+        chosen = 0
+        for i, lv in enumerate(self.reader.levels):
+            if self.pixel_m * self.reader.width / lv.width <= screen_m:
+                chosen = i
+        return chosen
+
+    def _tile_grid(self, level):
+        lv = self.reader.levels[level]
+        t = self.tile_px
+        return [(ty, tx) for ty in range(-(-lv.height // t)) for tx in range(-(-lv.width // t))]
+
+    def visible_range(self, level):
+        """(ty0, ty1, tx0, tx1) of the level's tiles that overlap the MapView, or None."""
+        lv = self.reader.levels[level]
+        mv = self.mapview
+        x1, y1, x2, y2 = self._screen
+        if x2 <= x1 or y2 <= y1:
+            return None
+        sx, sy = (x2 - x1) / lv.width, (y2 - y1) / lv.height  # screen px per raster px
+        vx0, vx1 = max(mv.x, x1), min(mv.right, x2)
+        vy0, vy1 = max(mv.y, y1), min(mv.top, y2)
+        if vx1 <= vx0 or vy1 <= vy0:
+            return None
+        t = self.tile_px
+        tx0 = int((vx0 - x1) / sx) // t
+        tx1 = min(int(math.ceil((vx1 - x1) / sx)), lv.width - 1) // t
+        ty0 = int((y2 - vy1) / sy) // t
+        ty1 = min(int(math.ceil((y2 - vy0) / sy)), lv.height - 1) // t
+        return (ty0, ty1, tx0, tx1)
+
+    def visible_tiles(self, level):
+        """(ty, tx) of the level's tiles that overlap the MapView."""
+        span = self.visible_range(level)
+        if span is None:
+            return []
+        ty0, ty1, tx0, tx1 = span
+        return [(ty, tx) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+    def _fallback(self, level, ty, tx):
+        """Region of an already-built coarser tile (or the preview) covering (level, ty, tx), if any."""
+        levels = self.reader.levels
+        lv, t = levels[level], self.tile_px
+        x0, y0 = tx * t, ty * t
+        w, h = min(t, lv.width - x0), min(t, lv.height - y0)
+        for coarse in range(level + 1, len(levels)):
+            cl = levels[coarse]
+            fx, fy = cl.width / lv.width, cl.height / lv.height
+            cx, cy = int(x0 * fx), int(y0 * fy)
+            tex = self.textures.peek((coarse, cy // t, cx // t))
+            if tex is None:
+                continue
+            self._borrowed.add((coarse, cy // t, cx // t))
+            return self._region(tex, cx % t, cy % t, w * fx, h * fy)
+        tex = self._preview
+        if tex is None:
+            return None
+        fx, fy = tex.width / lv.width, tex.height / lv.height
+        return self._region(tex, int(x0 * fx), int(y0 * fy), w * fx, h * fy)
+
+    @staticmethod
+    def _region(tex, rx, ry, w, h):
+        """Sub-texture at (rx, ry) from the top (textures are stored bottom-up)."""
+        rw = max(1, min(int(round(w)), tex.width - rx))
+        rh = max(1, min(int(round(h)), tex.height - ry))
+        return tex.get_region(rx, tex.height - ry - rh, rw, rh)
+
+    def onscreen_keys(self):
+        """Texture keys the current view draws (directly or as a coarser stand-in)."""
+        return self._wanted | self._borrowed
+
+    def _show_preview(self, show):
+        """Draw the decimated preview over the whole raster, or take it away."""
+        if show and self._preview_rect is None:
+            self._preview_rect = Rectangle(texture=self._preview, pos=(0, 0),
+                                           size=(self.reader.width, self.reader.height))
+            self._tiles.insert(0, self._preview_rect)
+        elif not show and self._preview_rect is not None:
+            self._tiles.remove(self._preview_rect)
+            self._preview_rect = None
+
+    def _update_tiles(self):
+        """Rebuild the tile rectangles for self._view (raster pixel units)."""
+        level = self._level = self._view[0]
+        lv = self.reader.levels[level]
+        fx, fy = self.reader.width / lv.width, self.reader.height / lv.height
+        full_h = self.reader.height
+        t = self.tile_px
+        tiles = self.visible_tiles(level)
+        if len(tiles) > MAX_VISIBLE_TILES:
+            tiles = []  # wait for the overviews rather than decode the full raster
+        self._show_preview(not tiles and self._preview is not None)
+        wanted = {(level, ty, tx) for ty, tx in tiles}
+        self._wanted = wanted
+        self._borrowed = set()
+        for key in wanted:
+            _, ty, tx = key
+            # peek while a decode is outstanding so the LRU counters see one miss per tile
+            tex = self.textures.peek(key) if key in self._pending else self.textures.get(key)
+            if tex is None:
+                self._request(key)
+                tex = self._fallback(level, ty, tx)
+            rect = self._rects.get(key)
+            if tex is None:
+                if rect is not None:
+                    self._tiles.remove(self._rects.pop(key))
+                continue
+            if rect is None:
+                w, h = min(t, lv.width - tx * t), min(t, lv.height - ty * t)
+                rect = Rectangle(texture=tex, pos=(tx * t * fx, full_h - (ty * t + h) * fy), size=(w * fx, h * fy))
+                self._tiles.add(rect)
+                self._rects[key] = rect
+            elif rect.texture is not tex:
+                rect.texture = tex
+        for key in list(self._rects):
+            if key not in wanted:
+                self._tiles.remove(self._rects.pop(key))
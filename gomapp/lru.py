@@ -0,0 +1,105 @@
+"""
+Thread-safe LRU cache with a byte budget.
+
+Entries are charged size_of(value) bytes; inserting past max_bytes evicts the
+least recently used entries (calling on_evict(key, value) for each). Keys in
+keep() (e.g. the tiles on screen) are never evicted; they may hold the cache
+over budget until they are released. hits and misses are counted for tuning.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_bytes, size_of=len, on_evict=None, keep=None):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.on_evict = on_evict
+        self.keep = keep
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (value, size)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def keys(self):
+        with self._lock:
+            return list(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key, default=None):
+        """Return the value without touching recency or the counters."""
+        item = self._items.get(key)
+        return default if item is None else item[0]
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.nbytes -= item[1]
+            return item[0]
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            items, self._items = self._items, OrderedDict()
+            self.nbytes = 0
+        if self.on_evict:
+            for key, (value, _size) in items.items():
+                self.on_evict(key, value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _evict(self):
+        if self.nbytes <= self.max_bytes:
+            return
+        keep = self.keep() if self.keep else ()
+        # oldest first; keep at least the newest entry even if it alone is over budget
+        for key in list(self._items)[:-1]:
+            if self.nbytes <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            value, size = self._items.pop(key)
+            self.nbytes -= size
+            if self.on_evict:
+                self.on_evict(key, value)
@@ -26,22 +26,25 @@ from kivy.animation import Animation
 import re
 import os
 import sys
-import sqlite3
-import requests
 import datetime
-import json
 import uuid
+import hashlib
+import threading
+import time
 import os.path
-from plyer import gps
 
 from assessment import GrowthCell, GrowthGrid
-from config import DB_PATH, API_URL, USER_RE
-from db_trials import upload_trials, download_trials, update_trial, get_trial_row
+from config import USER_RE, TILE_CACHE_FILE, GPS_LOG_FILE, SYNC_STOP_TIMEOUT
+from db_trials import (update_trial, get_trial_row, insert_trial, load_trial_changes,
+                       delete_trial_row, save_assessment, get_latest_assessment)
+from db import close_all
 from db_users import init_db, list_users, get_current_user_uuid, set_current_user_uuid, load_current_user_profile, create_user_profile, get_active_user
-from load_mbtiles import SafeMBTilesSource
-from load_tif import GeoTiffOverlay
-from popups import LocationPopup, TrialFormPopup, DraggableButton, EditTrialPopup
-from file_picker import pick_files
+from tile_cache import CachedMapSource, TileCache
+from gps_filter import GpsFilter, FixLog
+from sync_engine import SyncEngine
+from trial_markers import TrialMarkerRegistry, TrialMarker, PopupPool
+from popups import (LocationPopup, TrialFormPopup, DraggableButton, EditTrialPopup, OverlayLayersPopup,
+                    DownloadAreaPopup)
 
 from kivy.properties import BooleanProperty
 from kivy.graphics import Color, Rectangle
@@ -71,11 +74,24 @@ class Scrim(Widget):
             return True
         return super().on_touch_down(touch)
 
+class LazyScreenManager(ScreenManager):
+    """ScreenManager that builds a screen the first time it is shown or looked up."""
+
+    def __init__(self, factories, **kwargs):
+        self.factories = factories  # name -> Screen class
+        super().__init__(**kwargs)
+
+    def get_screen(self, name):
+        if not self.has_screen(name) and name in self.factories:
+            self.add_widget(self.factories[name](name=name))
+        return super().get_screen(name)
+
 class MapScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.root_widget = RootWidget()
         self.add_widget(self.root_widget)
+        self.root_widget.load_trials()  # @mainthread: runs after the first frame
         
     def on_pre_enter(self, *args):
         try:
@@ -159,12 +175,24 @@ class RootWidget(FloatLayout):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         
-        self.geotiff_overlay = None
         self.marker = None
-        self.trial_markers = []
+        self.pending_marker = None
         
-        self.mapview = MapView(zoom=11, lat=49.0, lon=-123.0)
-        self.default_source = self.mapview.map_source
+        self.default_source = CachedMapSource(
+            TileCache(os.path.join(App.get_running_app().user_data_dir, TILE_CACHE_FILE)))
+        self.mapview = MapView(zoom=11, lat=49.0, lon=-123.0, map_source=self.default_source)
+        self._overlays = None  # built on first GeoTIFF use (numpy, tifffile)
+        self.popup_pool = PopupPool({
+            "delete": self.delete_trial,
+            "edit": self.open_edit_trial,
+            "assess": self.open_growth_popup,
+        })
+        self.trial_markers = TrialMarkerRegistry(self.mapview, self.build_trial_marker)
+        self.sync_engine = SyncEngine(
+            on_done=self.apply_trial_changes,
+            on_event=self._on_sync_event,
+            since_version=lambda: self.trial_markers.version,
+        )
         self.mbtiles_source = None
         
         self.add_widget(self.mapview)
@@ -223,8 +251,10 @@ class RootWidget(FloatLayout):
 
         add_menu_item("Upload GeoTIFF", self.pick_geotiff)
         add_menu_item("Upload MBTiles", self.pick_mbtiles)
+        add_menu_item("GeoTIFF Layers", self.open_overlay_layers)
         add_menu_item("Remove GeoTIFF", self.remove_geotiff)
         add_menu_item("Remove MBTiles", self.remove_mbtiles)
+        add_menu_item("Download Offline Map", self.open_download_area)
         add_menu_item("Record New Trial", self.record_new_trial)
         add_menu_item("Sync with Server", self.sync_with_server)
         add_menu_item("Change user", self.change_user_popup)
@@ -241,6 +271,15 @@ class RootWidget(FloatLayout):
         self.add_widget(self.btn_open)
         self._set_scrim(False)
         
+    @property
+    def overlays(self):
+        if self._overlays is None:
+            from overlay_cache import default_cache
+            from overlay_manager import OverlayManager
+
+            self._overlays = OverlayManager(self.mapview, cache=default_cache())
+        return self._overlays
+
     def _set_scrim(self, open_):
         self.scrim.active = open_
 
@@ -271,7 +310,6 @@ class RootWidget(FloatLayout):
             print("⚠️ Could not refresh active user label:", e)
             self.active_user_lbl.text = "Active User: (error)"
         
-    @mainthread
     def set_marker(self, lat, lon):
         self.lat, self.lon = lat, lon
         # 2) Create/update marker
@@ -332,20 +370,31 @@ class RootWidget(FloatLayout):
 
 #
     def remove_geotiff(self, instance=None):
-        """Remove the GeoTIFF overlay from the map if it exists."""
+        """Remove the topmost GeoTIFF overlay from the map if there is one."""
         try:
-            if self.geotiff_overlay.parent:
-                self.geotiff_overlay.parent.remove_widget(self.geotiff_overlay)
-            self.geotiff_overlay = None
+            if self._overlays is None or not self._overlays.overlays:
+                return
+            self.overlays.remove_top()
             print("✅ GeoTIFF overlay removed.")
         except Exception as e:
             print(f"⚠️ Error removing overlay: {e}")
 
     def remove_mbtiles(self, instance=None):
         self.mapview.map_source = self.default_source
+        if self.mbtiles_source is not None:
+            self.mbtiles_source.close()
         self.mbtiles_source = None
 
+    def release_mbtiles(self, path):
+        """Stop showing the MBTiles file at path, if it is loaded, before something writes to it."""
+        source = self.mbtiles_source
+        if source is not None and os.path.abspath(source.filename) == os.path.abspath(path):
+            # read as immutable: a pack rewritten under its open connections reads stale or corrupt pages
+            self.remove_mbtiles()
+
     def pick_mbtiles(self, *_):
+        from file_picker import pick_files
+
         pick_files(exts=(".mbtiles",), callback=self._on_mbtiles_picked, subdir="mbtiles")
 
     def _on_mbtiles_picked(self, selection):
@@ -359,27 +408,92 @@ class RootWidget(FloatLayout):
     def load_mbtiles(self, path):
         print(f"Loading MBTiles: {path}")
         try:
+            from load_mbtiles import SafeMBTilesSource
+
             source = SafeMBTilesSource(path)
             #source.bounds = (-123, -48, -117, 63)
             source.bounds = False
             print(f"Bounds:{source.bounds}")
             #source._bounds = source.bounds
             self.mapview.map_source = source
+            if self.mbtiles_source is not None:
+                self.mbtiles_source.close()
+            self.mbtiles_source = source
             print(f"✅ Switched to MBTiles source: {path}")
         except Exception as e:
             print(f"❌ Error loading MBTiles: {e}")
 
+    def open_download_area(self, *_):
+        """Download the map view (or the trials in it) from the online basemap into an MBTiles pack."""
+        from basemap_pack import PackBuilder, count_tiles
+
+        lat1, lon1, lat2, lon2 = self.mapview.get_bbox()
+        lat_min, lat_max, lon_min, lon_max = min(lat1, lat2), max(lat1, lat2), min(lon1, lon2), max(lon1, lon2)
+        areas = {"Map view": (lon_min, lat_min, lon_max, lat_max)}
+        trials = self.trial_markers.trials_bbox(lat_min, lon_min, lat_max, lon_max)
+        if trials:
+            areas["Trials in view"] = trials
+        zoom = int(self.mapview.zoom)
+        source = self.default_source
+        cancel = threading.Event()
+        popup = None
+
+        def on_start(bbox, zooms):
+            # same area and zooms -> same file, so starting again resumes an interrupted download
+            area = ",".join(f"{v:.4f}" for v in bbox) + f",{zooms.start}-{zooms.stop - 1}"
+            path = os.path.join(App.get_running_app().user_data_dir, "mbtiles",
+                                f"offline_{hashlib.sha1(area.encode()).hexdigest()[:10]}.mbtiles")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.release_mbtiles(path)
+            cancel.clear()
+            builder = PackBuilder(path, source.url, bbox, zooms, subdomains=source.subdomains,
+                                  cancel=cancel, progress=mainthread(popup.show_progress))
+            threading.Thread(target=self._build_pack, args=(builder, popup), name="gomapp-basemap-pack",
+                             daemon=True).start()
+
+        popup = DownloadAreaPopup(areas, zoom, min(zoom + 3, source.max_zoom), count_tiles,
+                                  on_start=on_start, on_cancel=cancel.set)
+        popup.open()
+
+    def _build_pack(self, builder, popup):
+        from basemap_pack import PackCancelled
+
+        try:
+            stats = builder.build()
+        except PackCancelled:
+            self._pack_done(popup, None, "Cancelled (start again to resume)")
+            return
+        except Exception as e:
+            print(f"❌ Offline map download failed: {e}")
+            self._pack_done(popup, None, f"Failed: {e}")
+            return
+        print(f"✅ Offline map saved: {builder.path} {stats}")
+        if stats["failed"]:
+            # not loaded: an incomplete pack would show holes as if the area had been saved
+            self._pack_done(popup, None, f"Incomplete: {stats['failed']} of {stats['total']} tiles failed. "
+                                         "Start again to retry them.")
+            return
+        self._pack_done(popup, builder.path, f"Done: {stats['fetched']} tiles")
+
+    @mainthread
+    def _pack_done(self, popup, path, message):
+        popup.finished(message)
+        if path:
+            self.load_mbtiles(path)
+
     def pick_geotiff(self, *_):
+        from file_picker import pick_files
+
         pick_files(exts=(".tif", ".tiff"), callback=self._on_tif_picked, subdir="geotiff")
 
     def _on_tif_picked(self, selection):
         if not selection:
             return
         path = selection[0]
-        # Use your existing GeoTIFF loader / overlay
-        overlay = GeoTiffOverlay(path, self.mapview)
-        self.mapview.add_widget(overlay)
-        self.geotiff_overlay = overlay
+        self.overlays.add(path)
+
+    def open_overlay_layers(self, *_):
+        OverlayLayersPopup(self.overlays).open()
         
     def record_new_trial(self, instance):
         if self.lat is None or self.lon is None:
@@ -397,6 +511,7 @@ class RootWidget(FloatLayout):
         label = Label(text="New Trial", size_hint=(None, None), size=(100, 40))
         marker.add_widget(label)
         self.mapview.add_marker(marker)
+        self.pending_marker = marker
 
         # Open form popup
         popup = TrialFormPopup(lat, lon, self.save_trial)
@@ -406,112 +521,49 @@ class RootWidget(FloatLayout):
         """Save submitted trial data into the SQLite DB."""
         print("Saving trial:", data)
         app = App.get_running_app()
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO trials (uuid, species, seedlings, seedlot, spacing, lat, lon, user_id, site_series, smr, snr, site_fact, site_prep)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (data["uuid"], data["species"], data["seedlings"], data["seedlot"],
-              data["spacing"], data["lat"], data["lon"], get_active_user()["username"], data["site_series"], data["smr"], data["snr"], data["site_factors"], data["site_prep"]))
-        conn.commit()
-        conn.close()
+        insert_trial(data, get_active_user()["username"])
         print("✅ Trial saved.")
+
+        # Swap the placeholder for the real marker
+        if self.pending_marker is not None:
+            self.mapview.remove_marker(self.pending_marker)
+            self.pending_marker = None
+        self.load_trials()
         
     @mainthread
     def load_trials(self):
-        """Load all saved trials from SQLite and show them as markers."""
+        """Bring trial markers up to date with whatever changed in SQLite."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT uuid, id, species, seedlings, seedlot, spacing, lat, lon FROM trials")
-            rows = c.fetchall()
-            conn.close()
-
-            print(f"📍 Loaded {len(rows)} trials from DB")
-
-            for row in rows:
-                uuid, trial_id, species, seedlings, seedlot, spacing, lat, lon = row
-                if uuid not in self.trial_markers:
-                    self.add_trial_marker(uuid, trial_id, species, seedlings, seedlot, spacing, lat, lon)
-                    self.trial_markers.append(uuid)
-
+            self.apply_trial_changes(load_trial_changes(self.trial_markers.version))
         except Exception as e:
             print(f"⚠️ Error loading trials: {e}")
+
+    def apply_trial_changes(self, changes):
+        """Apply a (rows, deleted, version) change set to the markers (main thread only)."""
+        added, removed = self.trial_markers.apply_changes(*changes)
+        print(f"📍 {added} trials changed, {removed} removed ({len(self.trial_markers)} on map)")
             
     def sync_with_server(self, instance):
-        print("🔄 Starting sync...")
-        upload_trials()
-        download_trials()
-        self.load_trials()   # refresh markers
-        print("✅ Sync complete")
+        if self.sync_engine.start():
+            print("🔄 Starting sync...")
+        else:
+            print("🔄 Sync already in progress")
+
+    def _on_sync_event(self, event, *args):
+        # Called on the sync worker thread; only log here.
+        if event == "uploading":
+            print(f"⬆️  Uploading {args[0]}/{args[1]}")
+        elif event == "done":
+            print("✅ Sync complete")
+        elif event == "cancelled":
+            print("⏹️ Sync cancelled")
+        elif event == "error":
+            print("⚠️ Sync error:", args[0])
 
     
-    def add_trial_marker(self, uuid, trial_id, species, seedlings, seedlot, spacing, lat, lon):
-        """Create a marker for a trial and add it to the map."""
-        marker = MapMarkerPopup(lat=lat, lon=lon)
-        marker.trial_id = trial_id  # store id for deletion
-        marker.uuid = uuid
-
-        # --- Build popup content ---
-        box = BoxLayout(orientation="vertical", spacing=4, padding=5, size_hint=(None, None))
-        box.size = (600,600)
-        
-        with box.canvas.before:
-            Color(0, 0, 0, 0.7)  # RGBA → black with 70% opacity
-            box._bg_rect = Rectangle(pos=box.pos, size=box.size)
-
-        # Keep background aligned when widget resizes
-        def _update_bg(instance, value):
-            box._bg_rect.pos = instance.pos
-            box._bg_rect.size = instance.size
-
-        box.bind(pos=_update_bg, size=_update_bg)
-
-        info_text = (
-            f"[b]Species:[/b] {species}\n"
-            f"[b]Seedlings:[/b] {seedlings}\n"
-            f"[b]Seedlot:[/b] {seedlot}\n"
-            f"[b]Spacing:[/b] {spacing}\n"
-        )
-
-        info_label = Label(text=info_text, markup=True, halign="left", valign="middle")
-        info_label.bind(size=lambda _, __: info_label.texture_update())
-        box.add_widget(info_label)
-
-        # --- Delete button ---
-        delete_btn = Button(
-            text="🗑️ Delete",
-            size_hint_y=None,
-            height=64,
-            background_normal="",
-            background_color=(0.8, 0.2, 0.2, 0.9),
-        )
-        delete_btn.bind(on_release=lambda instance: self.delete_trial(marker))
-        box.add_widget(delete_btn)
-        
-        # --- Edit Trial ---
-        edit_btn = Button(
-            text="Edit Trial",
-            size_hint_y=None,
-            height=64,
-            background_normal="",
-            background_color=(0.8, 0.2, 0.2, 0.9),
-        )
-        edit_btn.bind(on_release=lambda instance: self.open_edit_trial(marker))
-        box.add_widget(edit_btn)
-        
-        growth_button = Button(
-            text="Add Assessment",
-            size_hint_y=None,
-            height=80,
-            background_normal="",
-            background_color=(0.8, 0.1, 0.8, 0.9),
-        )
-        growth_button.bind(on_release=lambda instance: self.open_growth_popup(marker))
-        box.add_widget(growth_button)
-
-        marker.add_widget(box)
-        self.mapview.add_marker(marker)
+    def build_trial_marker(self, row):
+        """Create the marker for a trial row (the registry adds it to the map)."""
+        return TrialMarker(row, self.popup_pool)
         
     def open_edit_trial(self, marker):
         uuid = marker.uuid
@@ -526,9 +578,7 @@ class RootWidget(FloatLayout):
                 data=edited
             )
             print("✅ Trial updated locally, marked for sync")
-
-            # Optional: refresh markers/popup UI
-            # self.refresh_trial_marker(uuid)
+            self.load_trials()
 
         EditTrialPopup(trial_row=trial, on_save=_on_save).open()
         
@@ -561,38 +611,19 @@ class RootWidget(FloatLayout):
 
     def save_grid(self, marker):
         grid = self.growth_grid_widget.get_grid()
-        payload = json.dumps({"grid": grid})
-        print("Grid data:", payload)
-
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("""
-                UPDATE trials
-                SET growth_grid = ?
-                WHERE uuid = ?
-            """, (payload, marker.uuid))
-            conn.commit()
+        code = save_assessment(marker.uuid, grid, get_active_user()["username"])
+        print("Grid data:", code)
 
         self.assessment_popup.dismiss()
         print(f"Saved growth grid for trial {marker.trial_id}")
 
         
     def load_growth_grid(self, marker):
-        id = marker.uuid
-        print(id)
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT growth_grid FROM trials WHERE uuid=?", (id,))
-            row = cur.fetchone()
-        print(row)
-        if not row or row[0] is None:
-            return None  # No grid stored yet
-
+        """The trial's latest 5×5 grid, or None if it has never been assessed."""
         try:
-            data = json.loads(row[0])
-            return data.get("grid")  # Should be a 5×5 list
+            return get_latest_assessment(marker.uuid)
         except Exception as e:
-            print("Error parsing grid JSON:", e)
+            print("Error loading growth grid:", e)
             return None
             
     def delete_trial(self, marker):
@@ -602,18 +633,11 @@ class RootWidget(FloatLayout):
             return
 
         # Remove from map
-        try:
-            self.mapview.remove_marker(marker)
-        except Exception as e:
-            print("⚠️ Could not remove marker:", e)
+        self.trial_markers.remove(marker.uuid)
 
         # Remove from database
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("DELETE FROM trials WHERE id = ?", (trial_id,))
-            conn.commit()
-            conn.close()
+            delete_trial_row(trial_id)
             print(f"🗑️ Deleted trial {trial_id}")
         except Exception as e:
             print("⚠️ Error deleting trial:", e)
@@ -624,13 +648,18 @@ class TreeApp(App):
     def build(self):
         TreeApp.instance = self
         self.user_profile = None
+        self.gps = None  # plyer.gps, imported when GPS starts
+        self.gps_filter = GpsFilter()
+        self.gps_request = None  # (minTime, minDistance) GPS is running with
+        self.gps_log = None
+        self._gps_fix = None
+        self._gps_trigger = Clock.create_trigger(self._apply_gps_fix)  # fires at most once per frame
         #Window.softinput_mode = "pan"
         
         init_db()
 
-        sm = ScreenManager()
-        sm.add_widget(LoginScreen(name="login"))
-        sm.add_widget(MapScreen(name="map"))
+        # Only the first screen is built now; the other one when it is first shown
+        sm = LazyScreenManager({"login": LoginScreen, "map": MapScreen})
 
         # Route based on whether profile exists
         prof = load_current_user_profile()
@@ -646,9 +675,6 @@ class TreeApp(App):
         # Wait until root is built before starting GPS
         Clock.schedule_once(self.start_gps, 1.0)
         
-        if self.root.current == "map":
-            app = TreeApp.instance.get_root_widget().load_trials()
-        
     def get_root_widget(self):
         """Convenience accessor for the existing RootWidget inside MapScreen."""
         map_screen = self.root.get_screen("map")
@@ -659,40 +685,80 @@ class TreeApp(App):
             self.root.current = "login"
     
     def start_gps(self, dt):
+        from plyer import gps
+
+        self.gps = gps
+        if GPS_LOG_FILE:
+            self.gps_log = FixLog(os.path.join(self.user_data_dir, GPS_LOG_FILE))
         gps.configure(on_location=self.on_location)
-        gps.start(minTime=1000, minDistance=1)
+        self.request_gps()
+
+    def request_gps(self):
+        """(Re)start GPS if the filter's speed tier asks for another minTime/minDistance."""
+        request = self.gps_filter.request
+        if not self.gps or request == self.gps_request:
+            return
+        if self.gps_request is not None:
+            self.gps.stop()
+        self.gps_request = request
+        self.gps.start(minTime=request[0], minDistance=request[1])
+        print(f"📡 GPS every {request[0] / 1000:g} s / {request[1]} m")
         
     def start(self, minTime, minDistance):
-        gps.start(minTime, minDistance)
+        if self.gps:
+            self.gps.start(minTime, minDistance)
 
     def stop(self):
-        gps.stop()
+        if self.gps:
+            self.gps.stop()
+            self.gps_request = None
 
-    @mainthread
     def on_location(self, **kwargs):
+        """plyer callback, on the platform's location thread: filter, then let the next frame draw it."""
         lat, lon = kwargs.get("lat"), kwargs.get("lon")
+        accuracy, speed = kwargs.get("accuracy"), kwargs.get("speed")
+        if self.gps_log is not None:
+            self.gps_log.write(time.time(), lat, lon, accuracy, speed)
+        fix = self.gps_filter.update(lat, lon, accuracy, speed)
+        if fix is None:
+            return
+        self._gps_fix = fix
+        self._gps_trigger()
 
+    def _apply_gps_fix(self, dt):
         # If we're not on the map screen yet (user still on login), ignore GPS updates
-        if not self.root or self.root.current != "map":
+        if self._gps_fix is None or not self.root or self.root.current != "map":
             return
 
         try:
-            rw = self.get_root_widget()
-            Clock.schedule_once(lambda dt: rw.set_marker(lat, lon))
+            self.get_root_widget().set_marker(*self._gps_fix)
         except Exception as e:
             print("⚠️ Could not set marker:", e)
+        self.request_gps()
         
     @mainthread
     def on_status(self, stype, status):
         self.gps_status = 'type={}\n{}'.format(stype, status)
 
     def on_pause(self):
-        gps.stop()
+        self.stop()
         return True
 
+    def on_stop(self):
+        synced = True
+        if self.root and self.root.has_screen("map"):
+            # the worker may be inside a transaction: let it roll back and close its connection first
+            synced = self.get_root_widget().sync_engine.stop(SYNC_STOP_TIMEOUT)
+        self.stop()  # no more fixes for the log once it is closed
+        if self.gps_log is not None:
+            self.gps_log.close()
+        if synced:
+            close_all()
+        else:
+            print("⚠️ Sync still running; leaving the database connections to close at exit")
+
     def on_resume(self):
-        gps.start(1000, 0)
-        pass
+        self.request_gps()
 
 if __name__ == "__main__":
     TreeApp().run()
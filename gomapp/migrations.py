@@ -0,0 +1,190 @@
+"""
+Versioned schema migrations, tracked with PRAGMA user_version.
+
+Each entry in MIGRATIONS is (version, description, steps); a step is either
+an SQL string or a callable taking the connection. Pending migrations run in
+order, each in its own transaction together with the user_version bump, so a
+device that was interrupted mid-upgrade picks up where it stopped.
+"""
+
+from db import get_conn, transaction
+
+
+def _backfill_assessments(conn):
+    """
+    Move each trial's JSON growth_grid into assessments as one packed row,
+    dated by the trial. Unreadable payloads are left in trials.growth_grid.
+    """
+    from grid_codec import from_json
+
+    trials = conn.execute(
+        "SELECT uuid, timestamp, growth_grid, assess_updated, user_id FROM trials WHERE growth_grid IS NOT NULL"
+    ).fetchall()
+    codes = from_json([t[2] for t in trials])
+    rows = []
+    for (uuid, timestamp, _payload, pending, user_id), code in zip(trials, codes.tolist()):
+        if code < 0:
+            print(f"⚠️ Skipping unreadable growth grid of trial {uuid}")
+            continue
+        rows.append((uuid, (timestamp or "")[:10] or None, code, user_id, timestamp, 0 if pending else 1))
+    conn.executemany("""
+        INSERT OR IGNORE INTO assessments (trial_uuid, assessed_on, grid, user_id, updated_at, synced)
+        VALUES (?, COALESCE(?, date('now')), ?, ?, ?, ?)
+    """, rows)
+    conn.executemany("UPDATE trials SET growth_grid = NULL, assess_updated = 0 WHERE uuid = ?",
+                     [(r[0],) for r in rows])
+
+
+MIGRATIONS = [
+    (1, "baseline schema", [
+        """
+        CREATE TABLE IF NOT EXISTS trials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT UNIQUE,
+            species TEXT,
+            seedlings INTEGER,
+            seedlot TEXT,
+            spacing TEXT,
+            lat REAL,
+            lon REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_id TEXT,
+            request_key TEXT,
+            notes TEXT,
+            site_series TEXT,
+            smr TEXT,
+            snr TEXT,
+            site_fact TEXT,
+            site_prep TEXT,
+            trial_company TEXT,
+            trial_obj TEXT,
+            synced BOOLEAN DEFAULT 0,
+            assess_updated BOOLEAN DEFAULT 0,
+            growth_grid TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_uuid TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            username TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """,
+    ]),
+    (2, "indexes for sync and map queries", [
+        # upload_trials: WHERE synced=0 AND user_id=? AND id>? ORDER BY id
+        "CREATE INDEX IF NOT EXISTS idx_trials_unsynced ON trials(user_id, id) WHERE synced=0",
+        # the pre-v4 upload_assess (WHERE assess_updated=1 AND id>? ORDER BY id);
+        # dropped in v4, when assessments moved to their own table
+        "CREATE INDEX IF NOT EXISTS idx_trials_assess_pending ON trials(id) WHERE assess_updated=1",
+        # first-sync download watermark: MAX(timestamp) WHERE synced <> 0
+        "CREATE INDEX IF NOT EXISTS idx_trials_synced_timestamp ON trials(timestamp) WHERE synced <> 0",
+        # map bbox lookups
+        "CREATE INDEX IF NOT EXISTS idx_trials_lat_lon ON trials(lat, lon)",
+        "ANALYZE",
+    ]),
+    (3, "row versions for incremental marker refresh", [
+        # change_seq is a single-row counter; every insert, display-relevant
+        # update or delete of a trial takes the next value as its row_version
+        # (deletes leave a tombstone), so the map can ask "what changed since
+        # version N" instead of rereading the whole table.
+        "ALTER TABLE trials ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0",
+        "UPDATE trials SET row_version = id",
+        """
+        CREATE TABLE IF NOT EXISTS change_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO change_seq (id, value) SELECT 1, COALESCE(MAX(row_version), 0) FROM trials",
+        """
+        CREATE TABLE IF NOT EXISTS trial_tombstones (
+            uuid TEXT PRIMARY KEY,
+            row_version INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_trials_row_version ON trials(row_version)",
+        "CREATE INDEX IF NOT EXISTS idx_tombstones_row_version ON trial_tombstones(row_version)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trials_version_insert AFTER INSERT ON trials BEGIN
+            UPDATE change_seq SET value = value + 1 WHERE id = 1;
+            UPDATE trials SET row_version = (SELECT value FROM change_seq WHERE id = 1) WHERE id = NEW.id;
+            DELETE FROM trial_tombstones WHERE uuid = NEW.uuid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trials_version_update
+        AFTER UPDATE OF uuid, species, seedlings, seedlot, spacing, lat, lon ON trials BEGIN
+            UPDATE change_seq SET value = value + 1 WHERE id = 1;
+            UPDATE trials SET row_version = (SELECT value FROM change_seq WHERE id = 1) WHERE id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trials_version_delete AFTER DELETE ON trials BEGIN
+            UPDATE change_seq SET value = value + 1 WHERE id = 1;
+            INSERT OR REPLACE INTO trial_tombstones (uuid, row_version)
+            VALUES (OLD.uuid, (SELECT value FROM change_seq WHERE id = 1));
+        END
+        """,
+    ]),
+    (4, "assessment history table with packed grids", [
+        # One row per trial per assessment date; grid packs the 25 P/M/G
+        # cells at 2 bits each (see grid_codec), replacing the JSON string
+        # in trials.growth_grid.
+        """
+        CREATE TABLE IF NOT EXISTS assessments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trial_uuid TEXT NOT NULL,
+            assessed_on TEXT NOT NULL,
+            grid INTEGER NOT NULL,
+            user_id TEXT,
+            updated_at TEXT,
+            synced BOOLEAN NOT NULL DEFAULT 0,
+            UNIQUE (trial_uuid, assessed_on)
+        )
+        """,
+        # upload_assess: WHERE synced=0 AND id>? ORDER BY id
+        "CREATE INDEX IF NOT EXISTS idx_assessments_unsynced ON assessments(id) WHERE synced=0",
+        _backfill_assessments,
+        # nothing sets assess_updated any more
+        "DROP INDEX IF EXISTS idx_trials_assess_pending",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn=None):
+    conn = conn or get_conn()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(target=LATEST_VERSION):
+    """Apply pending migrations up to target; returns the resulting version."""
+    current = schema_version()
+    if current >= target:
+        return current  # the usual start: one PRAGMA read, no DDL
+
+    for version, description, steps in MIGRATIONS:
+        if version > target:
+            break
+        with transaction() as conn:
+            # Re-check under the write lock in case another thread got here first.
+            if schema_version(conn) >= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version={version}")
+        print(f"🛠️  Migrated database to v{version}: {description}")
+    return schema_version()
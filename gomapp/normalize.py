@@ -0,0 +1,172 @@
+"""
+Memory-bounded rescaling of raster data to 8-bit for display.
+
+BandStats accumulates per-band min/max and a percentile histogram over
+blocks fed in one at a time (one streaming pass, never the whole raster).
+8/16-bit integers use an exact per-value histogram; other types keep exact
+min/max plus a bounded sample for percentiles. NaN and inf are ignored, as
+are pixels outside an optional coverage mask (e.g. a zero alpha band).
+
+rescale_to_ubyte maps one block to uint8 with per-band (lo, hi) ranges,
+row-block by row-block through a small float32 scratch buffer, writing into
+a preallocated output. NaN becomes 0.
+"""
+
+import math
+
+import numpy as np
+
+SAMPLE_PER_BLOCK = 4096  # values per band kept from each block for float percentiles
+SAMPLE_MAX = 1_000_000   # cap on the float percentile sample per band
+BLOCK_ROWS = 256
+WINDOW_PX = 1024  # edge of the windows stats are streamed through
+STATS_MAX_PIXELS = 4_000_000  # pixels visited when estimating display ranges
+STATS_MIN_WINDOWS = 9  # sampled windows however large each one is
+
+
+def as_bands(block):
+    """(h, w) -> (h, w, 1); (h, w, c) unchanged."""
+    return block[..., np.newaxis] if block.ndim == 2 else block
+
+
+class BandStats:
+    def __init__(self, bands, dtype):
+        self.bands = bands
+        self.dtype = np.dtype(dtype)
+        self.count = np.zeros(bands, dtype=np.int64)
+        self.min = np.full(bands, np.inf)
+        self.max = np.full(bands, -np.inf)
+        self.exact = self.dtype.kind in "ui" and self.dtype.itemsize <= 2
+        if self.exact:
+            self._offset = -np.iinfo(self.dtype).min
+            nbins = 1 << (8 * self.dtype.itemsize)
+            self.hist = np.zeros((bands, nbins), dtype=np.int64)
+        else:
+            self._samples = [[] for _ in range(bands)]
+            self._sampled = np.zeros(bands, dtype=np.int64)
+            self._rng = np.random.default_rng(0)
+
+    def update(self, block, mask=None):
+        block = as_bands(block)
+        for b in range(min(self.bands, block.shape[2])):
+            values = block[..., b].ravel() if mask is None else block[..., b][mask]
+            if self.exact:
+                counts = np.bincount(values.astype(np.int64) + self._offset, minlength=self.hist.shape[1])
+                self.hist[b] += counts
+                nz = np.flatnonzero(counts)
+                if nz.size:
+                    self.min[b] = min(self.min[b], nz[0] - self._offset)
+                    self.max[b] = max(self.max[b], nz[-1] - self._offset)
+                self.count[b] += values.size
+                continue
+            values = values[np.isfinite(values)]
+            if not values.size:
+                continue
+            self.min[b] = min(self.min[b], float(values.min()))
+            self.max[b] = max(self.max[b], float(values.max()))
+            self.count[b] += values.size
+            if self._sampled[b] < SAMPLE_MAX:
+                take = min(SAMPLE_PER_BLOCK, values.size, SAMPLE_MAX - self._sampled[b])
+                self._samples[b].append(self._rng.choice(values, take, replace=False).astype(np.float64))
+                self._sampled[b] += take
+
+    def ranges(self, percentiles=None):
+        """Per-band (lo, hi): min/max, or the given (low, high) percentiles."""
+        out = []
+        for b in range(self.bands):
+            if not self.count[b]:
+                out.append((0.0, 1.0))
+                continue
+            if percentiles is None:
+                lo, hi = self.min[b], self.max[b]
+            elif self.exact:
+                cdf = np.cumsum(self.hist[b])
+                lo, hi = (np.searchsorted(cdf, cdf[-1] * p / 100.0) - self._offset for p in percentiles)
+            else:
+                lo, hi = np.percentile(np.concatenate(self._samples[b]), percentiles)
+            out.append((float(lo), float(hi)))
+        return out
+
+
+def iter_windows(level, window=WINDOW_PX, max_pixels=None):
+    """
+    Yield level.read() windows covering the raster (see tiff_tiles.RasterLevel).
+    With max_pixels and a larger raster, only a grid of windows spread evenly
+    over the whole raster is read (see sample_windows).
+    """
+    if max_pixels and level.height * level.width > max_pixels:
+        yield from sample_windows(level, max_pixels, window)
+        return
+    for y in range(0, level.height, window):
+        for x in range(0, level.width, window):
+            yield level.read(y, x, y + window, x + window)
+
+
+def _spread(n, k):
+    """k of the indices 0..n-1, evenly spaced from the first to the last."""
+    if k >= n:
+        return range(n)
+    return sorted({round(i * (n - 1) / max(k - 1, 1)) for i in range(k)})
+
+
+def sample_windows(level, max_pixels, window=WINDOW_PX):
+    """
+    Yield windows on an evenly spaced grid over the whole raster, about
+    max_pixels pixels in total (at least STATS_MIN_WINDOWS windows). Windows
+    of a memory-mapped level can be any size; otherwise they are aligned to
+    the level's tiles, and compressed strips are read as full-width bands,
+    so no segment is decoded twice.
+    """
+    if level.memmapped:
+        unit_h = unit_w = max(1, min(window, math.isqrt(max_pixels // STATS_MIN_WINDOWS)))
+    elif level.tiled:
+        unit_h, unit_w = min(level.seg_h, window), min(level.seg_w, window)
+    else:
+        unit_h, unit_w = min(level.seg_h, window), level.width
+    rows, cols = -(-level.height // unit_h), -(-level.width // unit_w)
+    count = max(STATS_MIN_WINDOWS, max_pixels // (unit_h * unit_w))
+    # about as far apart vertically as horizontally, in pixels
+    down = min(rows, max(1, round(math.sqrt(count * level.height / level.width))))
+    across = min(cols, max(1, count // down))
+    down = min(rows, max(1, count // across))
+    for r in _spread(rows, down):
+        for c in _spread(cols, across):
+            y, x = r * unit_h, c * unit_w
+            yield level.read(y, x, y + unit_h, x + unit_w)
+
+
+def compute_stats(level, bands=None, max_pixels=STATS_MAX_PIXELS, alpha=False):
+    """BandStats of a raster level, streamed window by window (alpha: last band masks coverage)."""
+    bands = bands or level.bands
+    stats = BandStats(bands, level.dtype)
+    for block in iter_windows(level, max_pixels=max_pixels):
+        stats.update(block, mask=block[..., -1] > 0 if alpha else None)
+    return stats
+
+
+def rescale_to_ubyte(block, ranges, out=None, block_rows=BLOCK_ROWS):
+    """
+    Map block (h, w[, c]) to uint8 with ranges[b] = (lo, hi) per band.
+    uint8 data with a (0, 255) range is copied as is.
+    """
+    src = as_bands(block)
+    h, w, c = src.shape[0], src.shape[1], len(ranges)
+    if out is None:
+        out = np.empty((h, w, c), dtype=np.uint8)
+    dst = as_bands(out)
+    if src.dtype == np.uint8 and all(r == (0.0, 255.0) for r in ranges):
+        np.copyto(dst, src[..., :c])
+        return out
+    lo = np.array([r[0] for r in ranges], dtype=np.float32)
+    span = np.array([r[1] - r[0] for r in ranges], dtype=np.float32)
+    scale = np.divide(255.0, span, out=np.zeros_like(span), where=span > 0)
+    scratch = np.empty((min(block_rows, h), w, c), dtype=np.float32)
+    for y in range(0, h, block_rows):
+        rows = src[y:y + block_rows, :, :c]
+        buf = scratch[:rows.shape[0]]
+        np.subtract(rows, lo, out=buf, casting="unsafe")
+        np.multiply(buf, scale, out=buf)
+        np.clip(buf, 0, 255, out=buf)
+        np.nan_to_num(buf, copy=False, nan=0.0)
+        np.copyto(dst[y:y + block_rows], buf, casting="unsafe")
+    return out
@@ -0,0 +1,167 @@
+"""
+Persistent on-disk cache of GeoTIFF overlay tiles.
+
+Every imported raster gets a directory under
+App.user_data_dir/overlay_cache named by a content key: a SHA-1 of the file
+size, mtime and a few sampled 1 MiB chunks (start, middle, end), plus the
+settings that change the output (tile size, stretch). It holds meta.json
+(bounds, pixel size, display ranges, alpha) and one .npy per decoded tile:
+ready-to-blit uint8 rows, bottom-up, read back with np.load(mmap_mode="r").
+
+Whole entries are evicted least recently used first (meta.json's mtime is
+touched on every open) once the cache is over max_bytes; entries of open
+overlays are never evicted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from config import OVERLAY_CACHE_BYTES, OVERLAY_CACHE_DIR
+
+CACHE_VERSION = 2  # bump when the tile format or meta.json (including how ranges are computed) changes
+SAMPLE_BYTES = 1 << 20
+META_NAME = "meta.json"
+
+
+def file_key(path, **settings):
+    """Content key of path (size, mtime, sampled bytes) and the settings the tiles depend on."""
+    st = os.stat(path)
+    h = hashlib.sha1()
+    h.update(json.dumps({"version": CACHE_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                         **settings}, sort_keys=True).encode())
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, st.st_size // 2 - SAMPLE_BYTES // 2), max(0, st.st_size - SAMPLE_BYTES)}):
+            f.seek(offset)
+            h.update(f.read(SAMPLE_BYTES))
+    return h.hexdigest()
+
+
+class CacheEntry:
+    """The cached tiles and metadata of one raster."""
+
+    def __init__(self, directory):
+        self.dir = Path(directory)
+
+    def meta(self):
+        try:
+            with open(self.dir / META_NAME) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, meta):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.dir / (META_NAME + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.dir / META_NAME)
+
+    def touch(self):
+        try:
+            os.utime(self.dir / META_NAME)
+        except OSError:
+            pass
+
+    def _tile_path(self, level_shape, ty, tx):
+        # named by the level's size, not its index, so a later pyramid build doesn't shift them
+        height, width = level_shape
+        return self.dir / f"{width}x{height}_{ty}_{tx}.npy"
+
+    def get_tile(self, level_shape, ty, tx):
+        try:
+            return np.load(self._tile_path(level_shape, ty, tx), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def put_tile(self, level_shape, ty, tx, data):
+        path = self._tile_path(level_shape, ty, tx)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, path)
+
+    def nbytes(self):
+        try:
+            return sum(e.stat().st_size for e in os.scandir(self.dir) if e.is_file())
+        except OSError:
+            return 0
+
+    def last_used(self):
+        try:
+            return os.path.getmtime(self.dir / META_NAME)
+        except OSError:
+            return 0.0
+
+
+class OverlayCache:
+    def __init__(self, root, max_bytes=OVERLAY_CACHE_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._in_use = Counter()
+        self._lock = threading.Lock()
+
+    def open(self, key):
+        """CacheEntry for key, protected from eviction until release(key)."""
+        with self._lock:
+            self._in_use[key] += 1
+        entry = CacheEntry(self.root / key)
+        entry.touch()
+        return entry
+
+    def release(self, key):
+        with self._lock:
+            self._in_use[key] -= 1
+            if self._in_use[key] <= 0:
+                del self._in_use[key]
+
+    def entries(self):
+        """[(key, CacheEntry)] of everything on disk."""
+        try:
+            return [(e.name, CacheEntry(e.path)) for e in os.scandir(self.root) if e.is_dir()]
+        except OSError:
+            return []
+
+    def nbytes(self):
+        return sum(entry.nbytes() for _key, entry in self.entries())
+
+    def trim(self):
+        """Delete least recently used entries (not in use) until the cache fits max_bytes."""
+        entries = [(entry.last_used(), entry.nbytes(), key, entry) for key, entry in self.entries()]
+        total = sum(e[1] for e in entries)
+        removed = 0
+        for _used, size, key, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                if key in self._in_use:
+                    continue
+            shutil.rmtree(entry.dir, ignore_errors=True)
+            total -= size
+            removed += 1
+        if removed:
+            print(f"🧹 Evicted {removed} cached overlay(s), {total / 2**20:.0f} MiB left")
+        return removed
+
+
+@lru_cache(maxsize=None)
+def get_cache(root):
+    """One shared OverlayCache per directory, so in-use tracking covers every overlay."""
+    return OverlayCache(root)
+
+
+def default_cache():
+    """The cache under the running App's user_data_dir, or None outside an App."""
+    from kivy.app import App
+
+    app = App.get_running_app()
+    if app is None:
+        return None
+    return get_cache(os.path.join(app.user_data_dir, OVERLAY_CACHE_DIR))
@@ -0,0 +1,109 @@
+"""
+Several GeoTIFF overlays on one MapView under a shared texture budget.
+
+OverlayManager keeps the overlays in draw order (bottom to top), handles
+adding, removing, reordering and opacity, and holds the GPU texture memory
+of all of them under one max_bytes budget. Each overlay's texture LRU gets an
+equal share of the budget, re-split whenever an overlay is added or removed.
+Tiles a Rectangle is still drawing are never evicted (their texture memory
+would stay in use and the tile would only be decoded again), so an overlay
+showing more than its share holds the excess; if the total ends up over
+budget after an overlay builds a texture, tiles that are not on screen are
+evicted from all overlays (least recently used first, overlays entirely off
+screen before the others). An overlay whose file fails to load is removed.
+"""
+
+from config import OVERLAY_TEXTURE_BYTES
+from load_tif import GeoTiffOverlay, texture_nbytes
+
+
+class OverlayManager:
+    def __init__(self, mapview, max_bytes=OVERLAY_TEXTURE_BYTES, cache=None):
+        self.mapview = mapview
+        self.max_bytes = max_bytes
+        self.cache = cache  # overlay_cache.OverlayCache shared by every overlay
+        self.overlays = []  # bottom to top
+
+    def __len__(self):
+        return len(self.overlays)
+
+    def add(self, path, opacity=0.6):
+        overlay = GeoTiffOverlay(path, self.mapview, cache_bytes=self.share(len(self.overlays) + 1),
+                                 cache=self.cache, on_texture=self.enforce_budget, on_failed=self.remove)
+        overlay.opacity = opacity
+        self.overlays.append(overlay)
+        self._rebalance()
+        self.mapview.add_widget(overlay)  # added last, drawn on top
+        return overlay
+
+    def remove(self, overlay):
+        if overlay not in self.overlays:
+            return
+        self.overlays.remove(overlay)
+        if overlay.parent:
+            overlay.parent.remove_widget(overlay)
+        overlay.close()
+        self._rebalance()
+
+    def remove_top(self):
+        if self.overlays:
+            self.remove(self.overlays[-1])
+
+    def clear(self):
+        for overlay in list(self.overlays):
+            self.remove(overlay)
+
+    def move(self, overlay, delta):
+        """Move overlay delta places up (+) or down (-) the draw order."""
+        i = self.overlays.index(overlay)
+        j = max(0, min(len(self.overlays) - 1, i + delta))
+        if i == j:
+            return
+        self.overlays.insert(j, self.overlays.pop(i))
+        for o in self.overlays:
+            self.mapview.remove_widget(o)
+        for o in self.overlays:
+            self.mapview.add_widget(o)
+
+    def set_opacity(self, overlay, opacity):
+        overlay.opacity = max(0.0, min(1.0, opacity))
+
+    def share(self, count=None):
+        """Texture bytes each overlay may hold when count overlays (default: the current ones) split the budget."""
+        count = len(self.overlays) if count is None else count
+        return self.max_bytes // max(1, count)
+
+    def _rebalance(self):
+        share = self.share()
+        for overlay in self.overlays:
+            overlay.textures.resize(share)
+
+    def texture_bytes(self):
+        return sum(o.textures.nbytes for o in self.overlays)
+
+    def enforce_budget(self, *args):
+        """Evict off-screen textures until all overlays together fit max_bytes."""
+        total = self.texture_bytes()
+        if total <= self.max_bytes:
+            return
+        # overlays with nothing on screen first, then top to bottom
+        order = sorted(reversed(self.overlays), key=lambda o: bool(o.onscreen_keys()))
+        for overlay in order:
+            keep = overlay.onscreen_keys()
+            for key in overlay.textures.keys():  # least recently used first
+                if total <= self.max_bytes:
+                    return
+                if key in keep:
+                    continue  # still drawn by a Rectangle
+                tex = overlay.textures.pop(key)
+                if tex is not None:
+                    total -= texture_nbytes(tex)
+
+    def stats(self):
+        return {
+            "overlays": len(self.overlays),
+            "bytes": self.texture_bytes(),
+            "max_bytes": self.max_bytes,
+            "share": self.share(),
+            "per_overlay": {o.path: o.textures.stats() for o in self.overlays},
+        }
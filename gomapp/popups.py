@@ -10,9 +10,11 @@ from kivy.uix.widget import Widget
 from kivy.clock import Clock
 from kivy.uix.spinner import Spinner
 from kivy.uix.togglebutton import ToggleButton
+from kivy.uix.slider import Slider
 from kivy.animation import Animation
 
 
+import os
 import uuid
 
 SMR_OPTIONS = ["(Select)", "VX", "X", "SX", "SM", "M", "SHG","HG","SHD","HD"]
@@ -268,3 +270,152 @@ class EditTrialPopup(Popup):
         }
         self.on_save(data)
         self.dismiss()
+
+
+class OverlayLayersPopup(Popup):
+    """List of GeoTIFF overlays (top first): opacity slider, move up/down, remove."""
+
+    def __init__(self, manager, **kwargs):
+        super().__init__(**kwargs)
+        self.title = "GeoTIFF Layers"
+        self.size_hint = (0.92, 0.75)
+        self.manager = manager
+
+        root = BoxLayout(orientation="vertical", spacing=dp(10), padding=dp(12))
+        scroll = ScrollView(size_hint=(1, 1))
+        self.rows = BoxLayout(orientation="vertical", spacing=dp(8), size_hint_y=None)
+        self.rows.bind(minimum_height=self.rows.setter("height"))
+        scroll.add_widget(self.rows)
+        root.add_widget(scroll)
+
+        btn_close = Button(text="Close", size_hint_y=None, height=dp(52))
+        btn_close.bind(on_release=lambda *_: self.dismiss())
+        root.add_widget(btn_close)
+
+        self.content = root
+        self.refresh()
+
+    def refresh(self, *_):
+        self.rows.clear_widgets()
+        if not self.manager.overlays:
+            self.rows.add_widget(Label(text="No GeoTIFFs loaded", size_hint_y=None, height=dp(44)))
+            return
+        for overlay in reversed(self.manager.overlays):
+            self.rows.add_widget(self._row(overlay))
+
+    def _row(self, overlay):
+        row = BoxLayout(orientation="vertical", size_hint_y=None, height=dp(96), spacing=dp(4))
+        name = Label(text=os.path.basename(overlay.path), size_hint_y=None, height=dp(24),
+                     halign="left", valign="middle", shorten=True)
+        name.bind(size=lambda inst, *_: setattr(inst, "text_size", inst.size))
+        row.add_widget(name)
+
+        controls = BoxLayout(size_hint_y=None, height=dp(52), spacing=dp(6))
+        slider = Slider(min=0, max=1, value=overlay.opacity)
+        slider.bind(value=lambda _s, value: self.manager.set_opacity(overlay, value))
+        controls.add_widget(slider)
+        for text, action in (("▲", lambda *_: self._move(overlay, 1)),
+                             ("▼", lambda *_: self._move(overlay, -1)),
+                             ("✕", lambda *_: self._remove(overlay))):
+            btn = Button(text=text, size_hint_x=None, width=dp(48))
+            btn.bind(on_release=action)
+            controls.add_widget(btn)
+        row.add_widget(controls)
+        return row
+
+    def _move(self, overlay, delta):
+        self.manager.move(overlay, delta)
+        self.refresh()
+
+    def _remove(self, overlay):
+        self.manager.remove(overlay)
+        self.refresh()
+
+
+class DownloadAreaPopup(Popup):
+    """
+    Choose an area and zoom range for an offline basemap pack, then follow
+    the download. areas maps a label to (west, south, east, north);
+    count_tiles(bbox, zooms) estimates the size; on_start(bbox, zooms) starts
+    the build and on_cancel() stops it.
+    """
+
+    def __init__(self, areas, min_zoom, max_zoom, count_tiles, on_start, on_cancel, **kwargs):
+        kwargs.setdefault("auto_dismiss", False)
+        super().__init__(**kwargs)
+        self.title = "Download Offline Map"
+        self.size_hint = (0.92, 0.6)
+        self.areas = areas
+        self.count_tiles = count_tiles
+        self.on_start = on_start
+        self.on_cancel = on_cancel
+        self.running = False
+
+        root = BoxLayout(orientation="vertical", spacing=dp(8), padding=dp(12))
+        self.area = Spinner(text=next(iter(areas)), values=list(areas), size_hint_y=None, height=dp(44))
+        self.min_zoom = TextInput(text=str(min_zoom), hint_text="From zoom", input_filter="int",
+                                  multiline=False, size_hint_y=None, height=dp(44))
+        self.max_zoom = TextInput(text=str(max_zoom), hint_text="To zoom", input_filter="int",
+                                  multiline=False, size_hint_y=None, height=dp(44))
+        root.add_widget(Label(text="Area", size_hint_y=None, height=dp(20)))
+        root.add_widget(self.area)
+        zooms = BoxLayout(size_hint_y=None, height=dp(44), spacing=dp(10))
+        zooms.add_widget(self.min_zoom)
+        zooms.add_widget(self.max_zoom)
+        root.add_widget(Label(text="Zoom levels", size_hint_y=None, height=dp(20)))
+        root.add_widget(zooms)
+        self.status = Label(text="", size_hint_y=None, height=dp(44))
+        root.add_widget(self.status)
+        root.add_widget(Widget())
+
+        btn_row = BoxLayout(size_hint_y=None, height=dp(52), spacing=dp(10))
+        self.btn_cancel = Button(text="Close")
+        self.btn_start = Button(text="Download")
+        self.btn_cancel.bind(on_release=self._cancel)
+        self.btn_start.bind(on_release=self._start)
+        btn_row.add_widget(self.btn_cancel)
+        btn_row.add_widget(self.btn_start)
+        root.add_widget(btn_row)
+        self.content = root
+
+        for widget in (self.area, self.min_zoom, self.max_zoom):
+            widget.bind(text=self._estimate)
+        self._estimate()
+
+    def _selection(self):
+        try:
+            lo, hi = int(self.min_zoom.text), int(self.max_zoom.text)
+        except ValueError:
+            return None, None
+        if not 0 <= lo <= hi <= 22:
+            return None, None
+        return self.areas[self.area.text], range(lo, hi + 1)
+
+    def _estimate(self, *_):
+        bbox, zooms = self._selection()
+        self.status.text = "Invalid zoom range" if bbox is None else f"{self.count_tiles(bbox, zooms)} tiles"
+
+    def _start(self, *_):
+        bbox, zooms = self._selection()
+        if bbox is None or self.running:
+            return
+        self.running = True
+        self.btn_start.disabled = True
+        self.btn_cancel.text = "Cancel"
+        self.status.text = "Starting…"
+        self.on_start(bbox, zooms)
+
+    def _cancel(self, *_):
+        if self.running:
+            self.on_cancel()
+        self.dismiss()
+
+    def show_progress(self, stats):
+        done = stats["skipped"] + stats["fetched"] + stats["missing"] + stats["failed"]
+        self.status.text = f"{done}/{stats['total']} tiles ({stats['bytes'] / 2**20:.1f} MB)"
+
+    def finished(self, message):
+        self.running = False
+        self.btn_start.disabled = False
+        self.btn_cancel.text = "Close"
+        self.status.text = message
@@ -0,0 +1,69 @@
+"""
+Grid-bucket spatial index over lat/lon points.
+
+Points are bucketed into fixed-size cells (cell_deg degrees on a side);
+query(bbox) only looks at the cells the bbox overlaps, or at the occupied
+cells when that is cheaper (very zoomed-out views), so lookups cost the
+number of nearby points rather than the total.
+"""
+
+import math
+
+DEFAULT_CELL_DEG = 0.02  # ~2 km north-south
+
+
+class GridIndex:
+    def __init__(self, cell_deg=DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells = {}   # (ix, iy) -> {key: (lat, lon)}
+        self._where = {}   # key -> (ix, iy)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _cell(self, lat, lon):
+        return (math.floor(lon / self.cell_deg), math.floor(lat / self.cell_deg))
+
+    def insert(self, key, lat, lon):
+        """Add key at (lat, lon), moving it if it is already indexed."""
+        if lat is None or lon is None:
+            self.remove(key)
+            return
+        cell = self._cell(lat, lon)
+        old = self._where.get(key)
+        if old is not None and old != cell:
+            self._discard(key, old)
+        self._cells.setdefault(cell, {})[key] = (lat, lon)
+        self._where[key] = cell
+
+    def remove(self, key):
+        cell = self._where.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+
+    def _discard(self, key, cell):
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            return
+        bucket.pop(key, None)
+        if not bucket:
+            del self._cells[cell]
+
+    def query(self, lat_min, lon_min, lat_max, lon_max):
+        """Yield the keys whose point lies inside the bbox."""
+        x0, y0 = self._cell(lat_min, lon_min)
+        x1, y1 = self._cell(lat_max, lon_max)
+        span = (x1 - x0 + 1) * (y1 - y0 + 1)
+        if span > len(self._cells):
+            cells = [c for c in self._cells if x0 <= c[0] <= x1 and y0 <= c[1] <= y1]
+        else:
+            cells = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if (x, y) in self._cells]
+        for cell in cells:
+            bucket = self._cells[cell]
+            inner = x0 < cell[0] < x1 and y0 < cell[1] < y1
+            for key, (lat, lon) in bucket.items():
+                if inner or (lat_min <= lat <= lat_max and lon_min <= lon <= lon_max):
+                    yield key
@@ -0,0 +1,97 @@
+"""
+Background sync with the server.
+
+SyncEngine runs upload_trials, upload_assess, download_trials and
+download_assessments on a worker thread so the map stays responsive on slow
+networks. Only one sync is in flight at a time and it can be cancelled
+between chunks; stop() also waits for the worker to let go of the database.
+Progress events are published to
+on_event on the worker thread (keep handlers cheap and thread-safe); only the
+final marker change set (see db_trials.load_trial_changes) is marshalled back
+to the Kivy main thread via on_done.
+
+Events: ("queued",), ("uploading", done, total), ("downloading", done),
+("applied", n), ("done",), ("cancelled",), ("error", message)
+"""
+
+import threading
+
+from kivy.clock import mainthread
+
+from db import close_thread_connection
+from db_trials import upload_trials, upload_assess, download_trials, download_assessments, load_trial_changes
+
+
+class SyncCancelled(Exception):
+    pass
+
+
+class SyncEngine:
+    def __init__(self, on_done, on_event=None, since_version=lambda: 0):
+        self.on_done = on_done
+        self.on_event = on_event
+        self.since_version = since_version
+        self._thread = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start a sync; returns False if one is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._cancel.clear()
+            self._thread = threading.Thread(target=self._run, name="gomapp-sync", daemon=True)
+            self._emit("queued")
+            self._thread.start()
+            return True
+
+    def cancel(self):
+        self._cancel.set()
+
+    def stop(self, timeout=None):
+        """Cancel and wait for the worker; returns False if it is still running after timeout."""
+        self.cancel()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return not self.running
+
+    def _emit(self, *event):
+        if self.on_event:
+            try:
+                self.on_event(*event)
+            except Exception as e:
+                print("⚠️ Sync event handler failed:", e)
+
+    def _check_cancel(self):
+        if self._cancel.is_set():
+            raise SyncCancelled()
+
+    def _run(self):
+        try:
+            upload_trials(progress=self._emit, cancel=self._cancel)
+            self._check_cancel()
+            upload_assess(progress=self._emit, cancel=self._cancel)
+            self._check_cancel()
+            download_trials(progress=self._emit, cancel=self._cancel)
+            self._check_cancel()
+            download_assessments(progress=self._emit, cancel=self._cancel)
+            self._check_cancel()
+            changes = load_trial_changes(self.since_version())
+            self._emit("done")
+            self._deliver(changes)
+        except SyncCancelled:
+            self._emit("cancelled")
+        except Exception as e:
+            self._emit("error", str(e))
+        finally:
+            close_thread_connection()
+
+    @mainthread
+    def _deliver(self, changes):
+        self.on_done(changes)
@@ -0,0 +1,37 @@
+"""
+Persistent sync cursors, kept in the app_state table.
+
+Each cursor is a small JSON dict stored under the key
+"sync:<direction>:<endpoint>:<user>", e.g. sync:download:trials:jdoe.
+Callers advance a cursor with set_cursor() inside the same transaction that
+applies the batch it describes, so after an interruption the next sync
+resumes from the last committed batch.
+"""
+
+import json
+
+from db import query_one
+
+DOWNLOAD = "download"
+
+
+def _key(direction, endpoint, user):
+    return f"sync:{direction}:{endpoint}:{user}"
+
+
+def get_cursor(direction, endpoint, user):
+    row = query_one("SELECT value FROM app_state WHERE key=?", (_key(direction, endpoint, user),))
+    if not row or not row[0]:
+        return None
+    try:
+        return json.loads(row[0])
+    except ValueError:
+        return None
+
+
+def set_cursor(conn, direction, endpoint, user, cursor):
+    """Write a cursor on conn; call inside the transaction that applied the batch."""
+    conn.execute("""
+        INSERT INTO app_state(key, value) VALUES(?, ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value
+    """, (_key(direction, endpoint, user), json.dumps(cursor)))
@@ -0,0 +1,288 @@
+"""
+Windowed reads from (possibly huge) GeoTIFFs.
+
+RasterLevel.read(y0, x0, y1, x1) returns just that pixel window. Uncompressed
+contiguous pages are memory-mapped; tiled or compressed pages decode only the
+tiles/strips that overlap the window (TiffPage.decode on segments read
+through the shared file handle). The whole image is never loaded.
+
+Reduced-resolution levels come from the file itself (SubIFDs or reduced
+pages, via series.levels) or, failing that, from a sidecar
+"<path>.ovr.tif" that build_overviews writes once by repeated 2x2 averaging,
+one output tile at a time. Only one build per sidecar runs at a time.
+RasterLevel.read_decimated gives a quick nearest-neighbour preview while
+the pyramid is being built.
+"""
+
+import os
+import threading
+import uuid
+
+import numpy as np
+from tifffile import TiffFile, TiffWriter
+
+OVERVIEW_SUFFIX = ".ovr.tif"
+OVERVIEW_TILE_PX = 256
+
+
+_build_locks = {}  # sidecar path -> Lock held while it is being built
+_build_locks_lock = threading.Lock()
+
+
+class OverviewBuildCancelled(Exception):
+    pass
+
+
+def _build_lock(path):
+    with _build_locks_lock:
+        return _build_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class RasterLevel:
+    """One resolution of the raster (a TIFF page), read by pixel window."""
+
+    def __init__(self, page, lock):
+        self.page = page
+        self.lock = lock
+        self.height = page.imagelength
+        self.width = page.imagewidth
+        self.bands = page.samplesperpixel
+        self.dtype = page.dtype
+        self.tiled = page.is_tiled
+        if self.tiled:
+            self.seg_h, self.seg_w = page.tilelength, page.tilewidth
+        else:
+            self.seg_h, self.seg_w = min(page.rowsperstrip, self.height), self.width
+        self.segs_down = -(-self.height // self.seg_h)
+        self.segs_across = -(-self.width // self.seg_w)
+        self.planar = page.planarconfig == 2 and self.bands > 1
+        self.extrasamples = tuple(page.extrasamples or ())
+        self.alpha = bool(self.extrasamples) and self.extrasamples[-1] in (1, 2)  # assoc/unassoc alpha
+        self._mmap = self._open_memmap()
+
+    @property
+    def memmapped(self):
+        """True when any window reads straight from a memory map, without decoding segments."""
+        return self._mmap is not None
+
+    @property
+    def shape(self):
+        return (self.height, self.width, self.bands) if self.bands > 1 else (self.height, self.width)
+
+    def _open_memmap(self):
+        page = self.page
+        if not page.is_memmappable:
+            return None
+        dtype = np.dtype(page.dtype).newbyteorder(page.parent.byteorder)
+        try:
+            # normalized shape: (separate samples, depth, length, width, contig samples)
+            return np.memmap(page.parent.filehandle.path, dtype=dtype, mode="r",
+                             offset=page.dataoffsets[0], shape=page.shaped)
+        except (OSError, ValueError) as e:
+            print("⚠️ Could not memory-map GeoTIFF, decoding segments instead:", e)
+            return None
+
+    def _to_hwc(self, shaped):
+        """(S, 1, H, W, C) -> (H, W[, bands])"""
+        if self.planar:
+            return np.moveaxis(shaped[:, 0, :, :, 0], 0, -1)
+        arr = shaped[0, 0]
+        return arr[..., 0] if arr.shape[-1] == 1 else arr
+
+    def read(self, y0, x0, y1, x1):
+        """Pixel window [y0:y1, x0:x1] as (h, w) or (h, w, bands)."""
+        y0, x0 = max(0, y0), max(0, x0)
+        y1, x1 = min(self.height, y1), min(self.width, x1)
+        if self._mmap is not None:
+            return np.asarray(self._to_hwc(self._mmap[:, :, y0:y1, x0:x1]))
+        return self._to_hwc(self._decode_window(y0, x0, y1, x1))
+
+    def read_decimated(self, step, cancel=None):
+        """
+        Every step-th row and column of the level as (h, w[, bands]). Only
+        the bands of segments holding a sampled row are decoded, one at a time.
+        """
+        if self._mmap is not None:
+            return np.ascontiguousarray(self._to_hwc(self._mmap[:, :, ::step, ::step]))
+        parts = []
+        for y0 in range(0, self.height, self.seg_h):
+            first = -(-y0 // step) * step
+            if first >= y0 + self.seg_h or first >= self.height:
+                continue
+            if cancel is not None and cancel.is_set():
+                raise OverviewBuildCancelled()
+            block = self.read(y0, 0, y0 + self.seg_h, self.width)
+            parts.append(block[first - y0::step, ::step])
+        return np.concatenate(parts)
+
+    def segment_indices(self, y0, x0, y1, x1):
+        """Indices (into the page offsets) of the segments overlapping the window."""
+        rows = range(y0 // self.seg_h, (y1 - 1) // self.seg_h + 1)
+        cols = range(x0 // self.seg_w, (x1 - 1) // self.seg_w + 1)
+        per_plane = self.segs_down * self.segs_across
+        planes = range(self.bands) if self.planar else (0,)
+        return [p * per_plane + r * self.segs_across + c for p in planes for r in rows for c in cols]
+
+    def _decode_window(self, y0, x0, y1, x1):
+        page = self.page
+        samples = 1 if self.planar else self.bands
+        planes = self.bands if self.planar else 1
+        out = np.zeros((planes, 1, y1 - y0, x1 - x0, samples), dtype=self.dtype)
+        if y1 <= y0 or x1 <= x0:
+            return out
+        indices = self.segment_indices(y0, x0, y1, x1)
+        decode = page.decode
+        fh = page.parent.filehandle
+        offsets = [page.dataoffsets[i] for i in indices]
+        counts = [page.databytecounts[i] for i in indices]
+        for data, index in fh.read_segments(offsets, counts, indices, lock=self.lock):
+            seg, (s, _d, sy, sx, _c), shape = decode(data, index, jpegtables=page.jpegtables)
+            if seg is None:
+                continue
+            seg = seg.reshape(shape)[0]  # (length, width, samples)
+            # clip the segment (edge tiles are padded) to the requested window
+            ty0, tx0 = max(y0, sy), max(x0, sx)
+            ty1 = min(y1, sy + shape[1], self.height)
+            tx1 = min(x1, sx + shape[2], self.width)
+            if ty1 <= ty0 or tx1 <= tx0:
+                continue
+            out[s, 0, ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = seg[ty0 - sy:ty1 - sy, tx0 - sx:tx1 - sx]
+        return out
+
+
+def downsample2(block):
+    """2x2 mean of an (h, w[, bands]) block; an odd last row/column is repeated."""
+    h, w = block.shape[:2]
+    if h % 2 or w % 2:
+        block = np.pad(block, [(0, h % 2), (0, w % 2)] + [(0, 0)] * (block.ndim - 2), mode="edge")
+    f = block.astype(np.float32)
+    out = (f[0::2, 0::2] + f[1::2, 0::2] + f[0::2, 1::2] + f[1::2, 1::2]) * 0.25
+    if np.issubdtype(block.dtype, np.integer):
+        np.rint(out, out=out)
+    return out.astype(block.dtype)
+
+
+def _level_tiles(level, tile_px, cancel, halve):
+    """Row-major, zero-padded tile_px tiles of level (halved when halve=True)."""
+    f = 2 if halve else 1
+    height, width = -(-level.height // f), -(-level.width // f)
+    extra = level.shape[2:]
+    for y in range(0, height, tile_px):
+        for x in range(0, width, tile_px):
+            if cancel is not None and cancel.is_set():
+                raise OverviewBuildCancelled()
+            data = level.read(y * f, x * f, (y + tile_px) * f, (x + tile_px) * f)
+            if halve:
+                data = downsample2(data)
+            tile = np.zeros((tile_px, tile_px) + extra, dtype=level.dtype)
+            tile[:data.shape[0], :data.shape[1]] = data
+            yield tile
+
+
+def _write_level(writer, level, tile_px, cancel, halve, subfiletype=0):
+    f = 2 if halve else 1
+    shape = (-(-level.height // f), -(-level.width // f)) + level.shape[2:]
+    writer.write(
+        _level_tiles(level, tile_px, cancel, halve),
+        shape=shape,
+        dtype=level.dtype,
+        tile=(tile_px, tile_px),
+        photometric="rgb" if level.bands - len(level.extrasamples) == 3 else "minisblack",
+        planarconfig="contig" if level.bands > 1 else None,
+        extrasamples=level.extrasamples or None,
+        compression="zlib",
+        subfiletype=subfiletype,
+    )
+
+
+def build_overviews(level, out_path, tile_px=OVERVIEW_TILE_PX, min_size=OVERVIEW_TILE_PX, cancel=None):
+    """
+    Write the 1/2, 1/4, ... pyramid of level to out_path (one page per level)
+    until both sides fit in min_size. Each level is first written to its own
+    temporary file so the next one can be read from it, then all are copied
+    into out_path, which only appears once complete.
+    """
+    temps, files = [], []
+    tag = uuid.uuid4().hex[:8]  # unique per build, so concurrent builds never share temporaries
+    tmp_out = f"{out_path}.{tag}.tmp"
+    try:
+        src = level
+        while max(src.height, src.width) > min_size:
+            tmp = f"{out_path}.{tag}.{len(temps) + 1}.tmp"
+            temps.append(tmp)
+            with TiffWriter(tmp, bigtiff=True) as writer:
+                _write_level(writer, src, tile_px, cancel, halve=True)
+            files.append(TiffFile(tmp))
+            src = RasterLevel(files[-1].pages[0], threading.RLock())
+        if not files:
+            return 0
+        with TiffWriter(tmp_out, bigtiff=True) as writer:
+            for tf in files:
+                _write_level(writer, RasterLevel(tf.pages[0], threading.RLock()), tile_px, cancel,
+                             halve=False, subfiletype=1)
+        os.replace(tmp_out, out_path)
+        return len(files)
+    finally:
+        for tf in files:
+            tf.close()
+        for tmp in temps + [tmp_out]:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+class TiledTiffReader:
+    """Open GeoTIFF whose pixels are read on demand, window by window."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.RLock()
+        self.tif = TiffFile(self.path)
+        self.page = self.tif.series[0].keyframe
+        self.tags = self.tif.pages[0].tags
+        # levels[0] is full resolution, each further level is a coarser overview
+        self.levels = [RasterLevel(series.keyframe, self.lock) for series in self.tif.series[0].levels]
+        self.overview_path = self.path + OVERVIEW_SUFFIX
+        self._overviews = None
+        if len(self.levels) == 1:
+            self.open_overviews()
+
+    @property
+    def needs_overviews(self):
+        """True when neither the file nor a sidecar provides reduced levels."""
+        return len(self.levels) == 1 and max(self.width, self.height) > OVERVIEW_TILE_PX
+
+    def open_overviews(self):
+        """Append the sidecar pyramid's levels if it exists and is up to date."""
+        if self._overviews is not None:
+            return True
+        try:
+            if os.path.getmtime(self.overview_path) < os.path.getmtime(self.path):
+                return False
+            tif = TiffFile(self.overview_path)
+        except OSError:
+            return False
+        with self.lock:
+            self._overviews = tif
+            self.levels += [RasterLevel(page, self.lock) for page in tif.pages]
+        return True
+
+    def build_overviews(self, cancel=None):
+        """Build the sidecar pyramid (slow: call off the UI thread); returns the number of levels."""
+        with _build_lock(self.overview_path):
+            if self.open_overviews():  # another reader of the same file built it meanwhile
+                return len(self.levels) - 1
+            return build_overviews(self.levels[0], self.overview_path, cancel=cancel)
+
+    @property
+    def width(self):
+        return self.levels[0].width
+
+    @property
+    def height(self):
+        return self.levels[0].height
+
+    def close(self):
+        with self.lock:
+            self.tif.close()
+            if self._overviews is not None:
+                self._overviews.close()
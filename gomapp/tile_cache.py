@@ -0,0 +1,275 @@
+"""
+Persistent HTTP tile cache for the online basemap.
+
+TileCache keeps downloaded tiles in one SQLite file (MBTiles-like rows keyed
+by source, zoom, column and TMS row) instead of thousands of loose files in
+the mapview cache_dir, together with each tile's ETag, Last-Modified and
+expiry. CachedMapSource serves a tile straight from the file while it is
+fresh (Cache-Control max-age / Expires, else TILE_CACHE_TTL), revalidates
+stale tiles with If-None-Match / If-Modified-Since (a 304 only extends the
+expiry), and falls back to a stale copy when the network is unavailable.
+
+The file is held under max_bytes by deleting the least recently used tiles.
+The byte total is kept in a cache_meta row, updated in the same transaction
+as each write, so opening the cache reads one row instead of summing every
+tile. The small per-tile columns come before tile_data, so queries on them
+(size, last_used) stay on each row's first page and never read the blob's
+overflow pages. Last-use times are only rewritten once per TOUCH_INTERVAL
+per tile, so cache hits rarely write. stats() counts hits, revalidations, downloads,
+stale fallbacks and errors.
+"""
+
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from random import choice
+
+from kivy.core.image import Image as CoreImage
+from kivy_garden.mapview.downloader import Downloader
+from kivy_garden.mapview.source import MapSource
+
+from config import BASEMAP_USER_AGENT, TILE_CACHE_BYTES, TILE_CACHE_TTL
+
+TOUCH_INTERVAL = 3600  # s between last_used updates of a tile
+EVICT_TO = 0.9  # evict down to this fraction of max_bytes
+HTTP_TIMEOUT = 5
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+SCHEMA_VERSION = 2  # PRAGMA user_version; 1 had tile_data ahead of size and last_used, and no cache_meta
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS tiles (source TEXT NOT NULL, zoom_level INTEGER NOT NULL,"
+    " tile_column INTEGER NOT NULL, tile_row INTEGER NOT NULL, size INTEGER, last_used REAL, expires REAL,"
+    " etag TEXT, last_modified TEXT, tile_data BLOB)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS tiles_key ON tiles (source, zoom_level, tile_column, tile_row)",
+    "CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used)",
+    "CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER)",
+    "INSERT OR IGNORE INTO cache_meta (key, value) VALUES ('bytes', 0)",
+)
+COUNTERS = ("hits", "revalidated", "downloaded", "stale", "errors", "evicted")
+
+
+def expiry(headers, now, default_ttl=TILE_CACHE_TTL):
+    """Absolute expiry time from Cache-Control max-age or Expires, else now + default_ttl."""
+    m = MAX_AGE_RE.search(headers.get("Cache-Control", ""))
+    if m:
+        return now + int(m.group(1))
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return now + default_ttl
+
+
+class TileCache:
+    def __init__(self, path, max_bytes=TILE_CACHE_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()  # counters, nbytes and writes
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        conn = self._conn()
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            conn = self._create(conn)
+        self.nbytes = conn.execute("SELECT value FROM cache_meta WHERE key='bytes'").fetchone()[0]
+
+    def _create(self, conn):
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name='tiles'").fetchone():
+            # an older layout only holds cached tiles: start a new file rather than copy
+            # (or DROP, which visits every page) each blob
+            print("🛠️  Tile cache layout changed, starting a new cache")
+            conn.close()
+            self._local.conn = None
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except FileNotFoundError:
+                    pass
+            conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            for stmt in SCHEMA:
+                conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return conn
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def get(self, source, zoom, col, row):
+        """(data, etag, last_modified, expires) or None; refreshes the tile's last use."""
+        found = self._conn().execute(
+            "SELECT tile_data, etag, last_modified, expires, last_used FROM tiles"
+            " WHERE source=? AND zoom_level=? AND tile_column=? AND tile_row=?",
+            (source, zoom, col, row)).fetchone()
+        if found is None:
+            return None
+        now = time.time()
+        if now - (found[4] or 0) > TOUCH_INTERVAL:
+            with self._lock:
+                self._conn().execute(
+                    "UPDATE tiles SET last_used=? WHERE source=? AND zoom_level=? AND tile_column=? AND tile_row=?",
+                    (now, source, zoom, col, row))
+        return found[:4]
+
+    def put(self, source, zoom, col, row, data, etag, last_modified, expires):
+        key = (source, zoom, col, row)
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN")
+            try:
+                old = conn.execute("SELECT size FROM tiles WHERE source=? AND zoom_level=? AND tile_column=?"
+                                   " AND tile_row=?", key).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO tiles (source, zoom_level, tile_column, tile_row, size, last_used,"
+                    " expires, etag, last_modified, tile_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    key + (len(data), time.time(), expires, etag, last_modified, data))
+                delta = len(data) - (old[0] if old else 0)
+                conn.execute("UPDATE cache_meta SET value = value + ? WHERE key='bytes'", (delta,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.nbytes += delta
+            if self.nbytes > self.max_bytes:
+                self._evict(conn)
+
+    def refresh(self, source, zoom, col, row, expires):
+        """A 304: the cached tile is current until expires."""
+        with self._lock:
+            self._conn().execute(
+                "UPDATE tiles SET expires=?, last_used=? WHERE source=? AND zoom_level=? AND tile_column=?"
+                " AND tile_row=?", (expires, time.time(), source, zoom, col, row))
+
+    def _evict(self, conn):
+        target = self.max_bytes * EVICT_TO
+        conn.execute("BEGIN")
+        try:
+            while self.nbytes > target:
+                rows = conn.execute("SELECT rowid, size FROM tiles ORDER BY last_used LIMIT 256").fetchall()
+                if not rows:
+                    break
+                freed = 0
+                drop = []
+                for rowid, size in rows:
+                    drop.append((rowid,))
+                    freed += size
+                    if self.nbytes - freed <= target:
+                        break
+                conn.executemany("DELETE FROM tiles WHERE rowid=?", drop)
+                conn.execute("UPDATE cache_meta SET value = value - ? WHERE key='bytes'", (freed,))
+                self.nbytes -= freed
+                self.counts["evicted"] += len(drop)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counts)
+        served = stats["hits"] + stats["revalidated"] + stats["downloaded"] + stats["stale"]
+        stats["hit_rate"] = (stats["hits"] + stats["revalidated"]) / served if served else 0.0
+        stats["bytes"] = self.nbytes
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class CachedMapSource(MapSource):
+    """MapSource (same arguments) whose tiles go through a TileCache."""
+
+    def __init__(self, tile_cache, **kwargs):
+        super().__init__(**kwargs)
+        self.tile_cache = tile_cache
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+            session.headers["User-Agent"] = BASEMAP_USER_AGENT
+        return session
+
+    def get_tile_data(self, zoom, col, row):
+        """Image bytes of a tile (TMS row, as in Tile.tile_y), or None."""
+        cache = self.tile_cache
+        cached = cache.get(self.cache_key, zoom, col, row)
+        now = time.time()
+        if cached is not None and cached[3] > now:
+            cache.count("hits")
+            return cached[0]
+
+        headers = {}
+        if cached is not None:
+            if cached[1]:
+                headers["If-None-Match"] = cached[1]
+            if cached[2]:
+                headers["If-Modified-Since"] = cached[2]
+        url = self.url.format(z=zoom, x=col, y=self.get_row_count(zoom) - row - 1,
+                              s=choice(self.subdomains) if self.subdomains else "")
+        try:
+            response = self._session().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        except Exception as e:
+            if cached is not None:
+                cache.count("stale")  # offline: an old tile beats a blank one
+                return cached[0]
+            cache.count("errors")
+            print(f"⚠️ Tile download failed: {e}")
+            return None
+
+        if response.status_code == 304 and cached is not None:
+            cache.refresh(self.cache_key, zoom, col, row, expiry(response.headers, now))
+            cache.count("revalidated")
+            return cached[0]
+        if response.status_code != 200:
+            if cached is not None:
+                cache.count("stale")
+                return cached[0]
+            cache.count("errors")
+            return None
+        data = response.content
+        cache.put(self.cache_key, zoom, col, row, data, response.headers.get("ETag"),
+                  response.headers.get("Last-Modified"), expiry(response.headers, now))
+        cache.count("downloaded")
+        return data
+
+    def fill_tile(self, tile):
+        if tile.state == "done":
+            return
+        Downloader.instance(self.cache_dir).submit(self._load_tile, tile)
+
+    def _load_tile(self, tile):
+        if tile.state == "done":
+            return
+        data = self.get_tile_data(tile.zoom, tile.tile_x, tile.tile_y)
+        if data is None:
+            tile.state = "done"
+            return
+        im = CoreImage(io.BytesIO(data), ext=self.image_ext, nocache=True)
+        return self._load_tile_done, (tile, im)
+
+    def _load_tile_done(self, tile, im):
+        tile.texture = im.texture
+        tile.state = "need-animation"
@@ -0,0 +1,295 @@
+"""
+Trial markers on the map, keyed by trial uuid.
+
+The registry remembers the row_version high-water mark of the last change
+set it applied (see db_trials.load_trial_changes), so each refresh only
+touches the markers whose rows were inserted, edited or deleted since then.
+Markers are indexed by position and only those near the viewport are
+attached to the MapView, which repositions every attached marker on each
+pan and zoom. Below CLUSTER_MAX_ZOOM the trials are drawn as count bubbles
+from a ClusterIndex on their own MarkerMapLayer instead.
+
+Markers only carry their trial row. The popup (info label + Delete / Edit /
+Add Assessment buttons) is taken from a small shared pool when a marker is
+opened and handed back when it closes, so thousands of trials cost
+thousands of marker images rather than tens of thousands of widgets.
+"""
+
+from kivy.clock import Clock
+from kivy.graphics import Color, Ellipse, Rectangle
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.metrics import dp
+from kivy_garden.mapview import MapMarker, MapMarkerPopup
+from kivy_garden.mapview.view import MarkerMapLayer
+
+from clustering import ClusterIndex, CLUSTER_MAX_ZOOM
+from spatial_index import GridIndex
+
+POPUP_POOL_SIZE = 4
+VIEWPORT_MARGIN = 150  # px beyond the screen edge to keep markers attached
+
+
+def trial_info_text(row):
+    _uuid, _trial_id, species, seedlings, seedlot, spacing, _lat, _lon = row
+    return (
+        f"[b]Species:[/b] {species}\n"
+        f"[b]Seedlings:[/b] {seedlings}\n"
+        f"[b]Seedlot:[/b] {seedlot}\n"
+        f"[b]Spacing:[/b] {spacing}\n"
+    )
+
+
+class TrialPopupContent(BoxLayout):
+    """Popup body for whichever TrialMarker currently holds it."""
+
+    def __init__(self, actions, **kwargs):
+        super().__init__(orientation="vertical", spacing=4, padding=5, size_hint=(None, None), **kwargs)
+        self.size = (600, 600)
+        self.marker = None
+        self.actions = actions  # {"delete": fn(marker), "edit": ..., "assess": ...}
+
+        with self.canvas.before:
+            Color(0, 0, 0, 0.7)  # RGBA → black with 70% opacity
+            self._bg_rect = Rectangle(pos=self.pos, size=self.size)
+        self.bind(pos=self._update_bg, size=self._update_bg)
+
+        self.info_label = Label(text="", markup=True, halign="left", valign="middle")
+        self.info_label.bind(size=lambda inst, _: inst.texture_update())
+        self.add_widget(self.info_label)
+
+        for text, height, color, action in (
+            ("🗑️ Delete", 64, (0.8, 0.2, 0.2, 0.9), "delete"),
+            ("Edit Trial", 64, (0.8, 0.2, 0.2, 0.9), "edit"),
+            ("Add Assessment", 80, (0.8, 0.1, 0.8, 0.9), "assess"),
+        ):
+            btn = Button(
+                text=text,
+                size_hint_y=None,
+                height=height,
+                background_normal="",
+                background_color=color,
+            )
+            btn.bind(on_release=lambda _btn, a=action: self._run(a))
+            self.add_widget(btn)
+
+    def _update_bg(self, *_):
+        self._bg_rect.pos = self.pos
+        self._bg_rect.size = self.size
+
+    def show(self, marker):
+        self.marker = marker
+        self.info_label.text = trial_info_text(marker.row)
+
+    def _run(self, action):
+        if self.marker is not None:
+            self.actions[action](self.marker)
+
+
+class PopupPool:
+    def __init__(self, actions, max_size=POPUP_POOL_SIZE):
+        self.actions = actions
+        self.max_size = max_size
+        self._free = []
+
+    def acquire(self, marker):
+        content = self._free.pop() if self._free else TrialPopupContent(self.actions)
+        content.show(marker)
+        return content
+
+    def release(self, content):
+        if content.parent:
+            content.parent.remove_widget(content)
+        content.marker = None
+        if len(self._free) < self.max_size:
+            self._free.append(content)
+
+
+class TrialMarker(MapMarkerPopup):
+    """Map marker holding one trial row; popup content is borrowed on open."""
+
+    def __init__(self, row, pool, **kwargs):
+        self.pool = pool
+        self._content = None
+        super().__init__(lat=row[6], lon=row[7], **kwargs)
+        self.set_row(row)
+
+    def set_row(self, row):
+        self.row = row
+        self.uuid = row[0]
+        self.trial_id = row[1]  # store id for deletion
+        self.lat, self.lon = row[6], row[7]
+        if self._content is not None:
+            self._content.show(self)
+
+    def on_is_open(self, *args):
+        if self.is_open and self._content is None:
+            self._content = self.pool.acquire(self)
+            self.add_widget(self._content)
+        super().on_is_open(*args)
+        if not self.is_open and self._content is not None:
+            content, self._content = self._content, None
+            if self.placeholder is content:
+                self.placeholder = None
+            self.pool.release(content)
+
+
+class ClusterMarker(MapMarker):
+    """Marker with a count badge; tapping it zooms in on the cluster."""
+
+    def __init__(self, on_tap, **kwargs):
+        super().__init__(**kwargs)
+        self.on_tap = on_tap
+        with self.canvas.after:
+            Color(0.1, 0.3, 0.6, 0.9)
+            self._badge = Ellipse(size=(dp(26), dp(26)))
+        self.count_label = Label(text="", bold=True, size=(dp(26), dp(26)))
+        self.add_widget(self.count_label)
+        self.bind(pos=self._place_badge, size=self._place_badge)
+
+    def _place_badge(self, *_):
+        pos = (self.right - dp(13), self.top - dp(13))
+        self._badge.pos = pos
+        self.count_label.pos = pos
+
+    def show(self, count, lat, lon):
+        self.count_label.text = str(count) if count < 1000 else f"{count // 1000}k"
+        self.lat, self.lon = lat, lon
+
+    def on_release(self, *args):
+        self.on_tap(self)
+
+
+class TrialMarkerRegistry:
+    """
+    All trial markers keyed by uuid, with only those inside the visible bbox
+    (plus VIEWPORT_MARGIN px) attached to the MapView. Re-culling is driven by
+    the MapView lat/lon/zoom/size properties and coalesced to once per frame.
+    Below CLUSTER_MAX_ZOOM only cluster markers are attached.
+    """
+
+    def __init__(self, mapview, build_marker, margin=VIEWPORT_MARGIN):
+        self.mapview = mapview
+        self.build_marker = build_marker  # row -> marker
+        self.margin = margin
+        self.markers = {}
+        self.attached = set()
+        self.index = GridIndex()
+        self.cluster_index = ClusterIndex()
+        # MapView makes the first MarkerMapLayer added its default layer (where
+        # the GPS and placeholder markers go), so add a plain one before the
+        # cluster layer and keep cluster markers on theirs explicitly.
+        self.marker_layer = MarkerMapLayer()
+        mapview.add_layer(self.marker_layer)
+        self.cluster_layer = MarkerMapLayer()
+        mapview.add_layer(self.cluster_layer)
+        self.cluster_markers = {}  # cell -> ClusterMarker currently attached
+        self._spare_clusters = []
+        self.version = 0
+        self._refresh_trigger = Clock.create_trigger(self.refresh_viewport)
+        mapview.bind(lat=self._refresh_trigger, lon=self._refresh_trigger,
+                     zoom=self._refresh_trigger, size=self._refresh_trigger)
+
+    def __contains__(self, uuid):
+        return uuid in self.markers
+
+    def __len__(self):
+        return len(self.markers)
+
+    def get(self, uuid):
+        return self.markers.get(uuid)
+
+    def trials_bbox(self, lat_min, lon_min, lat_max, lon_max, pad_deg=0.01):
+        """(west, south, east, north) around the trials inside the bbox, padded, or None if there are none."""
+        points = [(m.lat, m.lon) for m in map(self.markers.get, self.index.query(lat_min, lon_min, lat_max, lon_max))
+                  if m is not None]
+        if not points:
+            return None
+        lats, lons = zip(*points)
+        return (min(lons) - pad_deg, min(lats) - pad_deg, max(lons) + pad_deg, max(lats) + pad_deg)
+
+    def apply_changes(self, rows, deleted, version):
+        """Add/update markers for changed rows and drop deleted ones."""
+        moved = False
+        for row in rows:
+            marker = self.markers.get(row[0])
+            if marker is None:
+                marker = self.build_marker(row)
+                self.markers[row[0]] = marker
+            else:
+                moved = moved or (marker.lat, marker.lon) != (row[6], row[7])
+                marker.set_row(row)
+            self.index.insert(row[0], row[6], row[7])
+            self.cluster_index.insert(row[0], row[6], row[7])
+        for uuid in deleted:
+            self.remove(uuid)
+        if moved:
+            self.mapview.trigger_update(True)
+        self.version = max(self.version, version)
+        self._refresh_trigger()
+        return len(rows), len(deleted)
+
+    def remove(self, uuid):
+        marker = self.markers.pop(uuid, None)
+        self.index.remove(uuid)
+        self.cluster_index.remove(uuid)
+        if marker is None:
+            return
+        marker.is_open = False
+        self._detach(uuid, marker)
+
+    def refresh_viewport(self, *_):
+        """Attach the markers or clusters inside the padded viewport, detach the rest."""
+        lat1, lon1, lat2, lon2 = self.mapview.get_bbox(self.margin)
+        bbox = (min(lat1, lat2), min(lon1, lon2), max(lat1, lat2), max(lon1, lon2))
+        if self.mapview.zoom < CLUSTER_MAX_ZOOM:
+            self._show_markers(set())
+            self._show_clusters(bbox)
+        else:
+            self._show_clusters(None)
+            self._show_markers(set(self.index.query(*bbox)))
+
+    def _show_markers(self, visible):
+        for uuid in self.attached - visible:
+            marker = self.markers.get(uuid)
+            if marker is not None and not marker.is_open:
+                self._detach(uuid, marker)
+        for uuid in visible - self.attached:
+            self.mapview.add_marker(self.markers[uuid], layer=self.marker_layer)
+            self.attached.add(uuid)
+
+    def _show_clusters(self, bbox):
+        clusters = {}
+        if bbox is not None:
+            clusters = {cell: (count, lat, lon) for cell, count, lat, lon
+                        in self.cluster_index.clusters(self.mapview.zoom, *bbox)}
+        for cell in list(self.cluster_markers):
+            if cell not in clusters:
+                marker = self.cluster_markers.pop(cell)
+                self.mapview.remove_marker(marker)
+                self._spare_clusters.append(marker)
+        for cell, (count, lat, lon) in clusters.items():
+            marker = self.cluster_markers.get(cell)
+            if marker is None:
+                marker = self._spare_clusters.pop() if self._spare_clusters else ClusterMarker(self._zoom_into)
+                self.cluster_markers[cell] = marker
+                marker.show(count, lat, lon)
+                self.mapview.add_marker(marker, layer=self.cluster_layer)
+            else:
+                marker.show(count, lat, lon)
+        if clusters:
+            self.cluster_layer.reposition()
+
+    def _zoom_into(self, cluster):
+        self.mapview.zoom = min(self.mapview.zoom + 2, CLUSTER_MAX_ZOOM)
+        self.mapview.center_on(cluster.lat, cluster.lon)
+
+    def _detach(self, uuid, marker):
+        if uuid not in self.attached:
+            return
+        self.attached.discard(uuid)
+        try:
+            self.mapview.remove_marker(marker)
+        except Exception as e:
+            print("⚠️ Could not remove marker:", e)
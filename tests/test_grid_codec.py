@@ -0,0 +1,35 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+from grid_codec import GridError, decode_grid, encode_grid, encode_grids, from_json  # noqa: E402
+
+GRID = [["P", "M", "G", "P", "P"]] * 5
+
+
+def test_encode_grids_matches_encode_grid():
+    grids = [GRID, [row[::-1] for row in GRID]]
+    codes = encode_grids(grids)
+    assert codes.tolist() == [encode_grid(g) for g in grids]
+    assert decode_grid(codes[0]) == GRID
+    assert encode_grids([]).shape == (0,)
+
+
+def test_multi_character_cells_are_not_truncated():
+    bad = [row[:] for row in GRID]
+    bad[2][3] = "PG"
+    with pytest.raises(GridError, match="PG"):
+        encode_grids([GRID, bad])
+    assert encode_grids([GRID, bad], strict=False).tolist() == [encode_grid(GRID), -1]
+    assert from_json([json.dumps({"grid": GRID}), json.dumps({"grid": bad})]).tolist() == [encode_grid(GRID), -1]
+
+
+@pytest.mark.parametrize("grids", [[[["P"] * 4] * 5], np.zeros((1, 5, 5)), [[[1] * 5] * 5]])
+def test_malformed_grids_raise(grids):
+    with pytest.raises(GridError):
+        encode_grids(grids, strict=False)
@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import tifffile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+from normalize import compute_stats, iter_windows  # noqa: E402
+from tiff_tiles import TiledTiffReader  # noqa: E402
+
+
+def bright_outside_top(shape, dtype, value):
+    """Dim raster whose bottom-right quarter is bright."""
+    img = np.ones(shape, dtype=dtype)
+    h, w = shape
+    img[h // 2:, w // 2:] = value
+    img[-1, -1] = value + 1  # a single pixel only a full read sees
+    return img
+
+
+@pytest.mark.parametrize("layout", [
+    {"tile": (256, 256)}, {"tile": (256, 256), "compression": "zlib"},
+    {"rowsperstrip": 64}, {"rowsperstrip": 64, "compression": "zlib"}, {},
+])
+@pytest.mark.parametrize("dtype, value", [(np.float32, 1999.0), (np.uint16, 1999)])
+def test_sampled_range_sees_the_whole_raster(tmp_path, layout, dtype, value):
+    path = tmp_path / "raster.tif"
+    tifffile.imwrite(path, bright_outside_top((6000, 5000), dtype, value), **layout)
+    reader = TiledTiffReader(path)
+    try:
+        level = reader.levels[0]
+        visited = sum(block.size for block in iter_windows(level, max_pixels=2_000_000))
+        assert visited < level.height * level.width / 4
+        (lo, hi), = compute_stats(level, max_pixels=2_000_000).ranges()
+        assert lo == 1.0 and hi >= 1999.0
+    finally:
+        reader.close()
+
+
+def test_small_raster_is_read_whole(tmp_path):
+    path = tmp_path / "raster.tif"
+    img = bright_outside_top((1500, 1200), np.uint16, 399)
+    tifffile.imwrite(path, img, tile=(256, 256))
+    reader = TiledTiffReader(path)
+    try:
+        level = reader.levels[0]
+        assert sum(block.size for block in iter_windows(level, max_pixels=4_000_000)) == img.size
+        assert compute_stats(level).ranges() == [(1.0, 400.0)]
+    finally:
+        reader.close()
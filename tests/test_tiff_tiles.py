@@ -0,0 +1,59 @@
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+import tifffile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gomapp"))
+
+from tiff_tiles import TiledTiffReader  # noqa: E402
+
+
+def gradient(shape):
+    h, w = shape
+    return (np.arange(h, dtype=np.uint32)[:, None] * w + np.arange(w)).astype(np.float32)
+
+
+@pytest.mark.parametrize("layout", [
+    {"tile": (256, 256)}, {"tile": (256, 256), "compression": "zlib"},
+    {"rowsperstrip": 64, "compression": "zlib"}, {},
+])
+def test_read_decimated_matches_strided_slice(tmp_path, layout):
+    path = tmp_path / "raster.tif"
+    img = gradient((3000, 2100))
+    tifffile.imwrite(path, img, **layout)
+    reader = TiledTiffReader(path)
+    try:
+        for step in (1, 7, 300, 5000):
+            np.testing.assert_array_equal(reader.levels[0].read_decimated(step), img[::step, ::step])
+    finally:
+        reader.close()
+
+
+def test_concurrent_builds_of_the_same_file(tmp_path):
+    path = tmp_path / "raster.tif"
+    tifffile.imwrite(path, gradient((3000, 2100)), tile=(256, 256), compression="zlib")
+    readers = [TiledTiffReader(path) for _ in range(3)]
+    errors = []
+
+    def build(reader):
+        try:
+            reader.build_overviews()
+            assert reader.open_overviews()
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=build, args=(r,)) for r in readers]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert {len(r.levels) for r in readers} == {len(readers[0].levels)} and len(readers[0].levels) > 1
+        assert not list(tmp_path.glob("*.tmp"))
+    finally:
+        for r in readers:
+            r.close()